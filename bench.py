@@ -0,0 +1,1874 @@
+# bench.py - BookieVerse benchmarks
+#
+#   python bench.py odds --sports 20 --repeat 20
+#   python bench.py indexes --bets 1000000
+#   python bench.py take --takers 1000
+#   python bench.py book --lines 50000
+#   python bench.py groups --groups 100000
+#   python bench.py auth --requests 20000
+#   python bench.py db --requests 20000 --concurrency 200
+#   python bench.py ledger --requests 20000 --bets 1000000
+#   python bench.py jobs --workers 4 --games 200 --bets 200000
+#   python bench.py events --workers 4 --requests 5000
+#   python bench.py scores --games 400 --bets 50000
+#   python bench.py bulk --users 50 --lines 10000 --batch 100
+#   python bench.py history --bets 500000
+#   python bench.py serialize --repeat 5
+#   python bench.py static --requests 5000
+#   python bench.py metrics --requests 5000
+#   python bench.py reads --requests 20000 --concurrency 64
+#   python bench.py parlays --parlays 100000 --games 200
+#   python bench.py lifecycle --users 2000 --lines 5000 --groups 500 --bets 50000 --games 60 --requests 20000 \
+#       --output results.json [--baseline previous.json]
+#
+# Every benchmark seeds a throwaway SQLite file unless --database-url is given.
+# Only point --database-url at a scratch database: benchmarks create, drop and
+# bulk-load tables.
+
+import argparse
+import asyncio
+import atexit
+import contextlib
+import contextvars
+import io
+import json
+import platform
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from sqlalchemy import event, func, insert, select, text, update
+
+def load_app(args):
+    """Import main.py against the benchmark database"""
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmp = tempfile.mkdtemp(prefix="bookieverse-bench-")
+        atexit.register(shutil.rmtree, tmp, True)
+        path = os.path.join(tmp, "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.setdefault("ODDS_API_KEY", "")
+    import main
+    main.scheduler.shutdown(wait=False)
+    main.job_runner.stop()
+    main.event_bus.stop()
+    return main
+
+def timed(fn, repeat):
+    """Latencies of repeat calls to fn, in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+def summary(samples):
+    return f"p50 {percentile(samples, 50):8.2f} ms  p99 {percentile(samples, 99):8.2f} ms  mean {statistics.mean(samples):8.2f} ms"
+
+class Checks:
+    """Correctness checks printed as ok/FAIL lines; exit() fails the run if any of them failed"""
+    def __init__(self):
+        self.failures = []
+
+    def __call__(self, label, ok):
+        print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+        if not ok:
+            self.failures.append(label)
+        return ok
+
+    def exit(self):
+        if self.failures:
+            sys.exit(1)
+
+def bulk_insert(main, model, rows, chunk=50000):
+    with main.engine.begin() as conn:
+        for i in range(0, len(rows), chunk):
+            conn.execute(insert(model), rows[i:i + chunk])
+
+def seed_users(main, rows):
+    """Insert users, their all-time stats and their ledger accounts with the balance in each row"""
+    bulk_insert(main, main.User, rows)
+    with main.engine.begin() as conn:
+        main.seed_missing_stats(conn)
+        main.open_missing_accounts(conn)
+
+def seed_book(main, users, bets, games=200, open_lines=20000, open_props=20000):
+    """Seed users, lines, props and bets spread over games"""
+    rnd = random.Random(42)
+    game_ids = [f"game_{i}" for i in range(games)]
+    seed_users(main, [{"username": f"user{i}", "password": "x", "balance": 10000.0,
+                       "profit": rnd.uniform(-5000, 5000), "wins": rnd.randint(0, 50),
+                       "losses": rnd.randint(0, 50), "lines_created": 0, "is_admin": False}
+                      for i in range(users)])
+    bulk_insert(main, main.Line, [{"bookie_id": rnd.randint(1, users), "bookie_name": "bookie", "game_id": rnd.choice(game_ids),
+                                   "game": "Away @ Home", "sport": rnd.choice(["NBA", "NFL"]),
+                                   "type": rnd.choice(["spread", "moneyline", "total"]), "side": "home",
+                                   "value": -3.5, "amount": rnd.choice([10.0, 25.0, 50.0, 100.0]),
+                                   "status": "open" if i < open_lines else "matched", "current_bettors": 0,
+                                   "is_private": False} for i in range(open_lines + bets // 10)])
+    bulk_insert(main, main.Prop, [{"bookie_id": rnd.randint(1, users), "bookie_name": "bookie", "sport": "NBA",
+                                   "player_name": f"Player {i % 500}", "prop_type": "Points", "line": 20.5,
+                                   "side": "over", "amount": 25.0, "status": "open"} for i in range(open_props)])
+    line_count = open_lines + bets // 10
+    rows = []
+    for i in range(bets):
+        rows.append({"line_id": rnd.randint(1, line_count), "bookie_id": rnd.randint(1, users), "bookie_name": "bookie",
+                     "bettor_id": rnd.randint(1, users), "bettor_name": "bettor", "game_id": rnd.choice(game_ids),
+                     "game": "Away @ Home", "type": rnd.choice(["spread", "moneyline", "total"]), "bookie_side": "home",
+                     "bettor_side": "away", "value": -3.5, "amount": 25.0,
+                     "status": "pending" if rnd.random() < 0.1 else "settled"})
+        if len(rows) == 100000:
+            bulk_insert(main, main.Bet, rows)
+            rows = []
+    bulk_insert(main, main.Bet, rows)
+    return game_ids
+
+async def asgi_get(app, path, headers=None):
+    """GET path straight through an ASGI app: (status, headers, body) as they'd go on the wire"""
+    path, _, query = path.partition("?")
+    scope = {"type": "http", "http_version": "1.1", "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+             "query_string": query.encode(), "root_path": "", "server": ("bench", 80), "client": ("127.0.0.1", 1),
+             "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent[0]["status"], dict(sent[0]["headers"]), b"".join(m.get("body", b"") for m in sent[1:])
+
+def explain(main, conn, sql, params):
+    if main.engine.dialect.name == "sqlite":
+        plan = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).all()
+        return [row[-1] for row in plan]
+    return [row[0] for row in conn.execute(text(f"EXPLAIN {sql}"), params).all()]
+
+class ScriptedOddsApi:
+    """A local Odds API whose answers per sport key are scripted as (status, delay) pairs, then 200s with an ETag"""
+    def __init__(self, delay=0.0):
+        self.delay = delay  # upstream latency of unscripted answers
+        self.scripts = {}  # sport key -> [(status, delay), ...] still to answer
+        self.hits = {}  # sport key -> requests seen
+        self.statuses = {}  # status -> answers sent
+        self.in_flight = self.peak = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                key = self.path.split("?")[0].strip("/").split("/")[1]
+                status, delay = api.answer(key, self.headers.get("If-None-Match"))
+                with api.lock:
+                    api.in_flight += 1
+                    api.peak = max(api.peak, api.in_flight)
+                time.sleep(delay)
+                with api.lock:
+                    api.in_flight -= 1
+                body = json.dumps([{"id": f"{key}_1", "sport_key": key, "home_team": "Home", "away_team": "Away",
+                                    "commence_time": "2026-01-01T00:00:00Z"}]).encode() if status == 200 else b""
+                try:
+                    self.send_response(status)
+                    self.send_header("ETag", f'"{key}"')
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client timed out first
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 128  # the default listen backlog of 5 drops a burst of concurrent connects
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def close(self):
+        self.server.shutdown()
+
+    def answer(self, key, etag):
+        with self.lock:
+            self.hits[key] = self.hits.get(key, 0) + 1
+            script = self.scripts.get(key)
+            status, delay = script.pop(0) if script else (200, self.delay)
+            if status == 200 and etag == f'"{key}"':
+                status = 304
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+        return status, delay
+
+    def reset(self, delay=0.0, **scripts):
+        self.delay, self.scripts, self.hits, self.statuses, self.peak = delay, scripts, {}, {}, 0
+
+def bench_odds(args):
+    """OddsClient against a scripted local Odds API: concurrent sports, ETag revalidation, retries on 429/5xx and timeouts"""
+    main = load_app(args)
+    sports = [f"sport_{i}" for i in range(args.sports)]
+    api = ScriptedOddsApi()
+    url = api.start()
+    client = main.OddsClient(base_url=url, api_key="bench-secret", timeout=1.0, retries=2, backoff=0.05,
+                             max_connections=args.sports)
+    check = Checks()
+    try:
+        api.reset(delay=0.2)
+        started = time.perf_counter()
+        results = client.odds(sports)
+        elapsed = time.perf_counter() - started
+        print(f"{'cold fetch':24s} {args.sports} sports at 200 ms each in {elapsed * 1000:7.1f} ms, {api.peak} in flight at once")
+        check("every sport fetched", all(isinstance(r, list) and r[0]["sport_key"] == key for key, r in results.items()))
+        check("sports fetched concurrently", api.peak == args.sports and elapsed < 0.2 * args.sports / 2)
+
+        api.reset()
+        samples = timed(lambda: client.odds(sports), args.repeat)
+        print(f"{'revalidated fetch':24s} {summary(samples)}")
+        check("unchanged feeds answered 304 and served from the ETag cache",
+              api.statuses == {304: args.repeat * args.sports} and client.odds(sports) == results)
+
+        client.etags.clear()
+        a, b, c, d = sports[:4]
+        api.reset(**{a: [(503, 0), (502, 0)], b: [(429, 0)], c: [(401, 0)], d: [(500, 0)] * 3})
+        results = client.odds([a, b, c, d])
+        check("503 then 502 retried through to the feed", isinstance(results[a], list) and api.hits[a] == 3)
+        check("429 retried", isinstance(results[b], list) and api.hits[b] == 2)
+        check("401 not retried", client.describe(results[c]) == "HTTP 401" and api.hits[c] == 1)
+        check("500 on every attempt gives up after the retries", client.describe(results[d]) == "HTTP 500" and api.hits[d] == 3)
+        check("errors don't carry the apiKey", not any("bench-secret" in client.describe(r) for r in results.values()))
+
+        api.reset(**{a: [(200, 3.0)] * 3})
+        started = time.perf_counter()
+        results = client.odds(sports)
+        elapsed = time.perf_counter() - started
+        print(f"{'one hung sport':24s} gave up on it after {elapsed * 1000:7.1f} ms: {client.describe(results[a])}")
+        check("a hung sport times out after its retries",
+              isinstance(results[a], Exception) and api.hits[a] == 3 and elapsed < 3 * 1.0 + 0.05 * 4 + 0.5)
+        check("the other sports still come back", all(isinstance(results[key], list) for key in sports[1:]))
+    finally:
+        client.close()
+        api.close()
+    check.exit()
+
+def bench_indexes(args):
+    """Query plans and latency of the settlement/listing hot paths with and without their indexes"""
+    main = load_app(args)
+    queries = {
+        "settlement": ("SELECT * FROM bets WHERE game_id = :game AND status = 'pending' ORDER BY id LIMIT 500", {"game": "game_7"}),
+        "get_lines": ("SELECT * FROM lines WHERE status = 'open' ORDER BY id LIMIT 100", {}),
+        "get_props": ("SELECT * FROM props WHERE status = 'open' ORDER BY id LIMIT 100", {}),
+        "get_bets": ("SELECT * FROM bets WHERE bookie_id = :user OR bettor_id = :user", {"user": 17}),
+        "leaderboard": ("SELECT * FROM leaderboard_entries WHERE board = 'all' AND sport = 'ALL' ORDER BY profit DESC LIMIT 10", {}),
+    }
+    indexes = [index for table in main.Base.metadata.sorted_tables for index in table.indexes if not index.unique]
+    with main.engine.begin() as conn:
+        for index in indexes:
+            index.drop(conn, checkfirst=True)
+
+    started = time.perf_counter()
+    seed_book(main, args.users, args.bets)
+    print(f"Seeded {args.users} users and {args.bets} bets in {time.perf_counter() - started:.1f}s")
+
+    def run(label):
+        print(f"\n== {label} ==")
+        with main.engine.connect() as conn:
+            for name, (sql, params) in queries.items():
+                samples = timed(lambda: conn.execute(text(sql), params).all(), args.repeat)
+                print(f"{name:12s} {summary(samples)}")
+                for step in explain(main, conn, sql, params):
+                    print(f"{'':12s}   {step}")
+
+    run("without indexes")
+    started = time.perf_counter()
+    with main.engine.begin() as conn:
+        for index in indexes:
+            index.create(conn, checkfirst=True)
+    main.engine.dispose()  # drop pooled connections holding prepared statements from the old schema
+    print(f"\nCreated {len(indexes)} indexes in {time.perf_counter() - started:.1f}s")
+    run("with indexes")
+
+def bench_take(args):
+    """Stress the matching engine with concurrent takers and check nobody double-matches or overdraws"""
+    main = load_app(args)
+    takers = args.takers
+    seed_users(main, [{"username": f"user{i}", "password": "x", "balance": 100.0, "profit": 0.0, "wins": 0,
+                       "losses": 0, "lines_created": 0, "is_admin": False} for i in range(takers + 1)])
+    bookie = 1
+    line = {"bookie_id": bookie, "bookie_name": "user0", "game_id": "demo_1", "game": "Warriors @ Lakers", "sport": "NBA",
+            "type": "spread", "side": "home", "value": -3.5, "status": "open", "current_bettors": 0, "total_action": 0.0,
+            "is_private": False}
+    # line 1: single taker; line 2: up to 50 bettors of 10 each; lines 3..: one per taker
+    bulk_insert(main, main.Line, [dict(line, amount=10.0), dict(line, amount=500.0, max_bettors=50, max_bet_per_user=10.0)]
+                + [dict(line, amount=10.0) for _ in range(takers)])
+    check = Checks()
+
+    def race(name, jobs):
+        def take(job):
+            user_id, line_id, amount = job
+            db = main.SessionLocal()
+            try:
+                main._take_line(db, main.TakeLine(line_id=line_id, amount=amount), main.load_principal(db, user_id))
+                return True
+            except main.HTTPException:
+                return False
+            finally:
+                db.close()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            won = sum(pool.map(take, jobs))
+        elapsed = time.perf_counter() - started
+        print(f"{name:28s} {len(jobs):5d} takers  {won:5d} matched  {elapsed:6.2f}s  {len(jobs) / elapsed:8.0f} takes/s")
+        return won
+
+    users = range(2, takers + 2)
+    check("exactly one taker wins a single-taker line", race("one line, one taker", [(u, 1, None) for u in users]) == 1)
+    check("exactly max_bettors takers win a capped line", race("one line, max_bettors=50", [(u, 2, 10.0) for u in users]) == 50)
+    check("every taker on its own line wins", race("distinct lines", [(u, 2 + i + 1, None) for i, u in enumerate(users)]) == takers)
+    with main.engine.connect() as conn:
+        line_rows = {r.id: r for r in conn.execute(text("SELECT id, status, current_bettors, total_action FROM lines")).all()}
+        bet_count = conn.execute(text("SELECT count(*) FROM bets")).scalar()
+    check("line 1 matched once", line_rows[1].status == "matched" and line_rows[1].current_bettors == 1)
+    check("line 2 matched 50 bettors for 500", line_rows[2].current_bettors == 50 and line_rows[2].total_action == 500.0)
+    check("one bet row per match", bet_count == 1 + 50 + takers)
+
+    # One user with balance for 10 bets of 10 races onto 100 fresh lines
+    seed_users(main, [{"username": "whale", "password": "x", "balance": 100.0, "profit": 0.0, "wins": 0,
+                       "losses": 0, "lines_created": 0, "is_admin": False}])
+    bulk_insert(main, main.Line, [dict(line, amount=10.0) for _ in range(100)])
+    whale, first = takers + 2, takers + 3
+    check("a 100 balance covers exactly 10 takes", race("one bettor, 100 lines", [(whale, first + i, None) for i in range(100)]) == 10)
+    with main.SessionLocal() as db:
+        balances = main.ledger.balances(db, range(1, whale + 1))
+    check("no user overdrew", min(balances.values()) >= 0)
+    check.exit()
+
+def bench_book(args):
+    """Open book listing: full ORM load of every open line vs a projected, keyset-paginated page"""
+    main = load_app(args)
+    from fastapi.testclient import TestClient
+    seed_book(main, args.users, 0, open_lines=args.lines, open_props=args.lines)
+    client = TestClient(main.app)
+
+    @main.app.get("/bench/lines-unpaginated")
+    def old_get_lines():
+        db = main.SessionLocal()
+        try:
+            lines = db.query(main.Line).filter(main.Line.status == "open").all()
+            return [{"id": l.id, "bookie_id": l.bookie_id, "bookie_name": l.bookie_name, "game": l.game, "sport": l.sport,
+                     "type": l.type, "side": l.side, "value": l.value, "amount": l.amount, "status": l.status,
+                     "current_bettors": l.current_bettors, "is_private": l.is_private} for l in lines]
+        finally:
+            db.close()
+
+    paths = {
+        "old: all open lines": "/bench/lines-unpaginated",
+        "new: first page": "/api/lines",
+        "new: filtered page": "/api/lines?sport=NBA&type=spread&min_amount=25",
+    }
+    # A page deep in the book, to show keyset pagination doesn't slow down with depth
+    cursor = client.get(f"/api/lines?limit=1&cursor={args.lines // 2}").json()[0]["id"]
+    paths["new: page at mid-book cursor"] = f"/api/lines?cursor={cursor}"
+    print(f"{args.lines} open lines")
+    for name, path in paths.items():
+        size = len(client.get(path).content)
+        samples = timed(lambda: client.get(path), args.repeat)
+        print(f"{name:30s} {size / 1024:9.1f} KiB  {summary(samples)}")
+
+def bench_groups(args):
+    """get_groups over the legacy JSON member lists vs the indexed group_members join"""
+    main = load_app(args)
+    from fastapi.testclient import TestClient
+    rnd = random.Random(7)
+    seed_users(main, [{"username": f"user{i}", "password": "x", "balance": 1000.0, "profit": 0.0, "wins": 0,
+                       "losses": 0, "lines_created": 0, "is_admin": False} for i in range(args.users)])
+    bulk_insert(main, main.Group, [{"name": f"group {i}", "creator_id": 1, "creator_name": "user0",
+                                    "members": json.dumps(rnd.sample(range(1, args.users + 1), rnd.randint(2, 20)))}
+                                   for i in range(args.groups)])
+    with main.engine.begin() as conn:  # seeded like a database from before the copy ran
+        conn.execute(main.SchemaMarker.__table__.delete())
+    started = time.perf_counter()
+    main.migrate_schema()
+    with main.engine.connect() as conn:
+        memberships = conn.execute(text("SELECT count(*) FROM group_members")).scalar()
+    print(f"Migrated {args.groups} groups / {memberships} memberships from JSON in {time.perf_counter() - started:.1f}s")
+    client = TestClient(main.app)
+
+    @main.app.get("/bench/groups-json")
+    def old_get_groups(user_id: int):
+        db = main.SessionLocal()
+        try:
+            result = []
+            for g in db.query(main.Group).all():
+                members = json.loads(g.members)
+                if user_id in members:
+                    result.append({"id": g.id, "name": g.name, "description": g.description,
+                                   "creator_id": g.creator_id, "creator_name": g.creator_name,
+                                   "member_count": len(members), "is_creator": g.creator_id == user_id,
+                                   "invite_code": g.invite_code if g.creator_id == user_id else None})
+            return result
+        finally:
+            db.close()
+
+    user_id = 42
+    token = main.create_token(user_id)
+    old = client.get(f"/bench/groups-json?user_id={user_id}").json()
+    new = client.get(f"/api/groups?token={token}").json()
+    print(f"user {user_id} belongs to {len(new)} groups (legacy path agrees: {old == new})")
+    print(f"{'old: scan + json.loads':30s} {summary(timed(lambda: client.get(f'/bench/groups-json?user_id={user_id}'), args.repeat))}")
+    print(f"{'new: group_members join':30s} {summary(timed(lambda: client.get(f'/api/groups?token={token}'), args.repeat))}")
+
+def count_queries(main):
+    """Counter of SQL statements executed against main.engine"""
+    counter = {"queries": 0}
+
+    @main.event.listens_for(main.engine, "before_cursor_execute")
+    def count(*_):
+        counter["queries"] += 1
+    return counter
+
+def count_user_writes(main):
+    """Counter of UPDATEs to users rows executed against main.engine"""
+    counter = {"updates": 0}
+
+    @main.event.listens_for(main.engine, "before_cursor_execute")
+    def count(conn, cursor, statement, *_):
+        if statement.lstrip().upper().startswith("UPDATE USERS"):
+            counter["updates"] += 1
+    return counter
+
+def bench_auth(args):
+    """Per-request auth cost with and without the principal cache, and login latency"""
+    main = load_app(args)
+    seed_users(main, [{"username": f"user{i}", "password": "x", "balance": 1000.0, "profit": 0.0, "wins": 0,
+                       "losses": 0, "lines_created": 0, "is_admin": False} for i in range(args.users)])
+    tokens = [main.create_token(i) for i in range(1, 101)]
+    queries = count_queries(main)
+
+    async def resolve():
+        for i in range(args.requests):
+            await main.current_user(tokens[i % len(tokens)])
+
+    def run(label):
+        queries["queries"] = 0
+        started = time.perf_counter()
+        asyncio.run(resolve())
+        elapsed = time.perf_counter() - started
+        print(f"{label:28s} {args.requests / elapsed:8.0f} req/s  {queries['queries'] / args.requests:5.2f} queries/request")
+
+    cache_size = main.auth_cache.maxsize
+    main.auth_cache.maxsize = 0
+    main.auth_cache.entries.clear()
+    run("current_user, no cache")
+    main.auth_cache.maxsize = cache_size
+    run("current_user, cached")
+
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app)
+    client.post("/api/auth/register", json={"username": "bench", "password": "benchpass"})
+    samples = timed(lambda: client.post("/api/auth/login", json={"username": "bench", "password": "benchpass"}), args.repeat)
+    print(f"{'login (scrypt n=%d)' % main.PASSWORD_SCRYPT_N:28s} {summary(samples)}")
+
+    check = Checks()
+    balance = main.ledger.balance
+
+    def write_during_fetch(db, user_id):
+        main.auth_cache.invalidate([user_id])  # a balance change committing between the users read and the put
+        return balance(db, user_id)
+
+    main.ledger.balance = write_during_fetch
+    main.auth_cache.invalidate([1])
+    with main.SessionLocal() as db:
+        main.fetch_principal(db, 1)
+    main.ledger.balance = balance
+    check("a principal read before a write isn't cached past it", main.auth_cache.get(1) is None)
+    check.exit()
+
+def bench_db(args):
+    """Mixed API load with request queries on the sync engine's threadpool vs the asyncio engine"""
+    if "ASYNC_DB" not in os.environ:
+        # The engine is chosen at import, so run each mode in its own process
+        for mode in ("0", "1"):
+            subprocess.run([sys.executable, os.path.abspath(__file__)] + sys.argv[1:], env=dict(os.environ, ASYNC_DB=mode),
+                           check=True)
+        return
+    main = load_app(args)
+    import httpx
+    seed_book(main, args.users, 0, open_lines=args.lines, open_props=args.lines)
+    rnd = random.Random(7)
+    tokens = [main.create_token(i) for i in range(1, args.users + 1)]
+    requests = []
+    for i in range(args.requests):
+        token = rnd.choice(tokens)
+        requests.append(rnd.choice([
+            ("GET", "/api/lines?sport=NBA&limit=50", None),
+            ("GET", f"/api/props?player_name=Player%20{rnd.randrange(500)}", None),
+            ("GET", f"/api/users/search?q=user{rnd.randrange(100)}", None),
+            ("GET", f"/api/bets?token={token}", None),
+            ("GET", f"/api/leaderboard/rank?token={token}", None),
+            ("POST", f"/api/lines/take?token={token}", {"line_id": rnd.randint(1, args.lines), "amount": 1.0}),
+        ]))
+
+    async def load():
+        transport = httpx.ASGITransport(app=main.app)
+        gate = asyncio.Semaphore(args.concurrency)
+        latencies, statuses = [], {}
+
+        async def send(client, method, path, body):
+            async with gate:
+                started = time.perf_counter()
+                response = await client.request(method, path, json=body)
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(send(client, *request) for request in requests))
+            elapsed = time.perf_counter() - started
+        await main.shutdown()
+        return latencies, statuses, elapsed
+
+    latencies, statuses, elapsed = asyncio.run(load())
+    stats = main.db_stats()
+    pool = stats[stats["mode"]]
+    print(f"== {stats['mode']} engine, {len(requests)} requests, concurrency {args.concurrency} ==")
+    print(f"{len(requests) / elapsed:8.0f} req/s  {summary(latencies)}  statuses {dict(sorted(statuses.items()))}")
+    print(f"pool: {pool['checkouts']} checkouts, wait avg {pool['wait_avg_ms']} ms, max {pool['wait_max_ms']} ms, "
+          f"{pool['timeouts']} timeouts")
+
+def bench_ledger(args):
+    """Escrow debits and payout credits racing on one hot user, then snapshot and reconcile over a large ledger"""
+    main = load_app(args)
+    seed_users(main, [{"username": f"user{i}", "password": "x", "balance": 1e9, "profit": 0.0, "wins": 0, "losses": 0,
+                       "lines_created": 0, "is_admin": False} for i in range(args.users)])
+    hot = 1
+    check = Checks()
+
+    def in_place(job):
+        debit, amount = job
+        with main.engine.begin() as conn:
+            if debit:
+                conn.execute(text("UPDATE users SET balance = balance - :a WHERE id = :u AND balance >= :a"), {"a": amount, "u": hot})
+            else:
+                conn.execute(text("UPDATE users SET balance = balance + :a WHERE id = :u"), {"a": amount, "u": hot})
+
+    def ledger_op(job):
+        debit, amount = job
+        with main.SessionLocal() as db:
+            if debit:
+                main.ledger.debit(db, hot, amount, "line")
+            else:
+                main.ledger.credit(db, [(hot, amount, "payout", None)])
+            db.commit()
+
+    rnd = random.Random(3)
+    jobs = [(rnd.random() < 0.5, float(rnd.randint(1, 100))) for _ in range(args.requests)]
+    for label, op in (("old: UPDATE users.balance", in_place), ("ledger: append entries", ledger_op)):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(op, jobs))
+        elapsed = time.perf_counter() - started
+        print(f"{label:28s} {len(jobs)} ops on one user  {elapsed:6.2f}s  {len(jobs) / elapsed:8.0f} ops/s")
+    expected = 1e9 + sum(-a if debit else a for debit, a in jobs)
+    with main.SessionLocal() as db:
+        balance = main.ledger.balance(db, hot)
+    check(f"hot balance {balance:.2f} == {expected:.2f}", abs(balance - expected) < 0.01)
+
+    rows = [{"user_id": rnd.randint(1, args.users), "amount": rnd.choice([-25.0, 50.0]), "kind": "payout",
+             "created_at": main.datetime.utcnow()} for _ in range(args.bets)]
+    bulk_insert(main, main.LedgerEntry, rows)
+    main.LEDGER_SNAPSHOT_LAG = 0
+    with main.SessionLocal() as db:
+        samples = timed(lambda: main.ledger.balances(db, [rnd.randint(1, args.users) for _ in range(100)]) and
+                        main.ledger.invalidate([]), args.repeat)
+    print(f"{'100 balances, unsnapshotted':28s} {summary(samples)}")
+    result = main.ledger.snapshot()
+    print(f"{'snapshot':28s} {result['snapshotted']} accounts in {result['seconds']:.2f}s")
+    with main.SessionLocal() as db:
+        samples = timed(lambda: main.ledger.balances(db, [rnd.randint(1, args.users) for _ in range(100)]) and
+                        main.ledger.invalidate([]), args.repeat)
+    print(f"{'100 balances, snapshotted':28s} {summary(samples)}")
+    # Only the accounts written since the last run are looked at again
+    active = rnd.sample(range(1, args.users + 1), min(10, args.users))
+    bulk_insert(main, main.LedgerEntry, [{"user_id": user_id, "amount": 5.0, "kind": "payout",
+                                          "created_at": main.datetime.utcnow()} for user_id in active])
+    result = main.ledger.snapshot()
+    print(f"{'snapshot, 10 active':28s} {result['snapshotted']} of {result['checked']} accounts checked in {result['seconds']:.3f}s")
+    check("a later snapshot only checks accounts with new entries", result["checked"] == result["snapshotted"] == len(active))
+    result = main.ledger.reconcile()
+    print(f"{'reconcile':28s} {result['accounts']} accounts, {args.bets} entries in {result['seconds']:.2f}s")
+    check("ledger reconciles", not result["mismatched"] and not result["overdrawn"])
+    check.exit()
+
+def jobs_worker(args):
+    """One worker process of bench_jobs: run jobs, and while leader report more finished games every tick"""
+    main = load_app(args)
+    # Job threads print as they settle; keep stdout to the TERM/RELEASED/RAN lines the parent parses
+    report, sys.stdout = sys.stdout, open(os.devnull, "w")
+    games = [f"game_{i}" for i in range(args.games)]
+    main.job_runner.start()
+    ticks = 0
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        started = time.time()
+        if main.leader.renew():
+            print(f"TERM {started} {started + main.LEADER_LEASE_TTL * 2 / 3}", file=report, flush=True)
+            ticks += 1
+            for game in games[:ticks * 20]:
+                scores = random.Random(game)
+                main.job_queue.enqueue("settle_game", f"settle_game:{game}", {
+                    "game_id": game, "home_score": scores.randint(80, 120), "away_score": scores.randint(80, 120)})
+            if ticks == 3:
+                try:
+                    # The first process to get this far dies holding the lease and its claimed jobs
+                    os.close(os.open(os.environ["BENCH_JOBS_CRASH"], os.O_CREAT | os.O_EXCL))
+                    os._exit(0)
+                except FileExistsError:
+                    pass
+        counts = main.job_queue.stats()["jobs"]
+        if counts.get("done", 0) + counts.get("failed", 0) == len(games):
+            break
+        time.sleep(0.2)
+    main.job_runner.stop()
+    if main.leader.is_leader():
+        main.leader.release()
+        print(f"RELEASED {time.time()}", file=report, flush=True)
+    print(f"RAN {main.job_queue.ran} {main.job_queue.failed}", file=report, flush=True)
+
+def bench_jobs(args):
+    """Several worker processes share one database: one leader polls, every process settles, one leader crashes"""
+    if os.environ.get("BENCH_JOBS_CRASH"):
+        return jobs_worker(args)
+    main = load_app(args)
+    seed_book(main, args.users, args.bets, games=args.games, open_lines=0, open_props=0)
+    with main.engine.connect() as conn:
+        pending = conn.execute(text("SELECT count(*) FROM bets WHERE status = 'pending'")).scalar()
+    print(f"Seeded {pending} pending bets over {args.games} games; starting {args.workers} workers")
+    env = dict(os.environ, BENCH_JOBS_CRASH=os.path.join(tempfile.mkdtemp(prefix="bookieverse-jobs-"), "crashed"),
+               LEADER_LEASE_TTL="3", JOB_LEASE="5", JOB_POLL_INTERVAL="0.1")
+    command = [sys.executable, os.path.abspath(__file__), "jobs", "--database-url", str(main.engine.url),
+               "--games", str(args.games)]
+    started = time.perf_counter()
+    workers = [subprocess.Popen(command, env=env, stdout=subprocess.PIPE, text=True) for _ in range(args.workers)]
+    outputs = [worker.communicate()[0] for worker in workers]
+    elapsed = time.perf_counter() - started
+
+    terms, ran = [], 0
+    for i, output in enumerate(outputs):
+        for line in output.splitlines():
+            kind, *values = line.split()
+            if kind == "TERM":
+                terms.append((float(values[0]), float(values[1]), i))
+            elif kind == "RELEASED":  # a clean shutdown ends the last term early
+                terms[-1] = (terms[-1][0], min(terms[-1][1], float(values[0])), i)
+            elif kind == "RAN":
+                ran += int(values[0])
+    with main.engine.connect() as conn:
+        jobs = conn.execute(text("SELECT status, attempts FROM jobs")).all()
+        left = conn.execute(text("SELECT count(*) FROM bets WHERE status = 'pending'")).scalar()
+        double_paid = conn.execute(text("SELECT count(*) FROM (SELECT ref_id FROM ledger_entries WHERE kind = 'payout' "
+                                        "GROUP BY ref_id HAVING count(*) > 1) paid")).scalar()
+    terms.sort()
+    overlaps = sum(1 for a, b in zip(terms, terms[1:]) if a[2] != b[2] and b[0] < a[1])
+    leaders = len({i for _, _, i in terms})
+    print(f"{len(jobs)} jobs in {elapsed:.1f}s across {args.workers} processes, {ran} run by surviving workers, "
+          f"{sum(1 for _, a in jobs if a > 1)} re-run after the crash, {leaders} processes led")
+    check = Checks()
+    check("one job per game despite every leader re-reporting", len(jobs) == args.games)
+    check("every job done", all(status == "done" for status, _ in jobs))
+    check("every pending bet settled", left == 0)
+    check("no bet paid twice", double_paid == 0)
+    check("leader terms never overlap", overlaps == 0)
+    check("leadership failed over after the crash", leaders >= 2)
+    check("ledger reconciles", not main.ledger.reconcile()["overdrawn"])
+    check.exit()
+
+def events_worker(args):
+    """One publisher process of bench_events: publish --requests events at about 1000/s, then flush on the way out"""
+    main = load_app(args)
+    main.event_bus.start()
+    worker = int(os.environ["BENCH_EVENTS_WORKER"])
+    for i in range(args.requests):
+        main.event_bus.publish("bench", {"worker": worker, "i": i, "sent": time.time()}, sport="NBA")
+        if i % 10 == 9:
+            time.sleep(0.01)
+    main.event_bus.stop()
+
+def bench_events(args):
+    """Events published by other processes reach this process's streams in one shared order, and replay from it"""
+    if os.environ.get("BENCH_EVENTS_WORKER"):
+        return events_worker(args)
+    main = load_app(args)
+    main.event_bus.start()
+    total = args.workers * args.requests
+    main.event_bus.queue_size = main.event_bus.history = total + 1
+    command = [sys.executable, os.path.abspath(__file__), "events", "--database-url", str(main.engine.url),
+               "--requests", str(args.requests)]
+
+    async def receive():
+        queue = main.event_bus.subscribe()
+        workers = [subprocess.Popen(command, env=dict(os.environ, BENCH_EVENTS_WORKER=str(i))) for i in range(args.workers)]
+        received, latencies = [], []
+        started = time.perf_counter()
+        try:
+            while len(received) < total:
+                message = await asyncio.wait_for(queue.get(), 30)
+                data = json.loads(message["data"])
+                latencies.append((time.time() - data["sent"]) * 1000)
+                received.append((message["seq"], data["worker"], data["i"]))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            main.event_bus.unsubscribe(queue)
+            for worker in workers:
+                worker.wait()
+        return received, latencies, time.perf_counter() - started
+
+    received, latencies, elapsed = asyncio.run(receive())
+    print(f"{len(received)} of {total} events from {args.workers} processes in {elapsed:.1f}s  "
+          f"publish-to-subscriber {summary(latencies)}")
+    with main.SessionLocal() as db:
+        replay, complete = main.event_bus.since(db, 0)
+    by_worker = {}
+    for _, worker, i in received:
+        by_worker.setdefault(worker, []).append(i)
+    check = Checks()
+    check("every event from every process delivered here", len(received) == total)
+    check("in one increasing sequence", all(a[0] < b[0] for a, b in zip(received, received[1:])))
+    check("each process's events in the order it published them",
+          all(ids == list(range(args.requests)) for ids in by_worker.values()))
+    check("replaying from 0 returns the same sequence", complete and [m["seq"] for m in replay] == [r[0] for r in received])
+    check.exit()
+
+def bench_scores(args):
+    """A simulated day of score polling against a fake feed: the pending-games poller vs polling every sport every 5 minutes"""
+    os.environ.setdefault("ODDS_SPORTS", "basketball_nba:NBA,americanfootball_nfl:NFL,icehockey_nhl:NHL,baseball_mlb:MLB")
+    main = load_app(args)
+    rnd = random.Random(14)
+    start = datetime(2026, 1, 10, 12, 0)
+    sports = list(main.SPORTS.items())
+    games = {}  # game_id -> (sport_key, commence, finish or None when postponed)
+    for i in range(args.games):
+        # Each sport's games tip off in three slots through the afternoon and evening
+        sport_key, sport = sports[i % len(sports)]
+        slot = 60 + 180 * (i // len(sports) % 3) + 30 * (i % len(sports))
+        commence = start + timedelta(minutes=slot + rnd.choice([0, 0, 5, 10]))
+        finish = commence + timedelta(minutes=main.GAME_DURATIONS.get(sport, 180) + rnd.randint(-15, 30),
+                                      seconds=rnd.randint(0, 59))
+        games[f"game_{i}"] = (sport_key, commence, None if i % 50 == 7 else finish)
+    # Only NBA and NFL games get action, a third of those only shortly before kick-off
+    bet_on = [g for g, (key, _, _) in games.items() if main.SPORTS[key] in ("NBA", "NFL") and rnd.random() < 0.6]
+    late = {g: games[g][1] - timedelta(minutes=30) for g in bet_on if rnd.random() < 0.33}
+    seed_users(main, [{"username": f"user{i}", "password": "x", "balance": 1e6, "profit": 0.0, "wins": 0, "losses": 0,
+                       "lines_created": 0, "is_admin": False} for i in range(100)])
+    bulk_insert(main, main.Line, [{"id": i + 1, "bookie_id": 1, "bookie_name": "bookie", "game_id": g, "game": "Away @ Home",
+                                   "sport": main.SPORTS[games[g][0]], "commence_time": games[g][1], "type": "moneyline",
+                                   "side": "home", "value": 0.0, "amount": 25.0, "status": "matched", "current_bettors": 1,
+                                   "is_private": False} for i, g in enumerate(bet_on)])
+    line_ids = {g: i + 1 for i, g in enumerate(bet_on)}
+
+    def bets(game_ids, count):
+        return [{"line_id": line_ids[g], "bookie_id": 1, "bookie_name": "bookie", "bettor_id": 2, "bettor_name": "bettor",
+                 "game_id": g, "game": "Away @ Home", "commence_time": games[g][1], "type": "moneyline",
+                 "bookie_side": "home", "bettor_side": "away", "value": 0.0, "amount": 25.0, "status": "pending"}
+                for g in (rnd.choice(game_ids) for _ in range(count))]
+
+    early = [g for g in bet_on if g not in late]
+    bulk_insert(main, main.Bet, bets(early, args.bets))
+    print(f"{len(games)} games over {len(sports)} sports, {len(bet_on)} with pending bets ({len(late)} only bet late), "
+          f"{args.bets} bets")
+
+    def feed(sport_keys, days_from):
+        return {key: [{"id": g, "home_team": "Home", "away_team": "Away",
+                       "completed": finish is not None and now >= finish,
+                       "scores": [{"name": "Home", "score": "101"}, {"name": "Away", "score": "99"}] if now >= commence else None,
+                       "last_update": (min(now, finish) if finish else now).isoformat() + "Z"}
+                      for g, (k, commence, finish) in games.items() if k == key and now >= commence]
+                for key in sport_keys}
+
+    poller = main.ScorePoller(fetch=feed)
+    main.score_poller = poller
+    now = start
+    end = start + timedelta(hours=20)
+    tick = timedelta(seconds=main.SCORE_POLL_TICK)
+    started = time.perf_counter()
+    while now <= end:
+        arrived = [g for g, at in late.items() if at <= now]
+        if arrived:
+            bulk_insert(main, main.Bet, bets(arrived, 5 * len(arrived)))
+            for g in arrived:
+                del late[g]
+        poller.tick(now)
+        now += tick
+    elapsed = time.perf_counter() - started
+    stats = poller.stats()
+
+    # Baseline: every sport polled every 5 minutes all day, settling whatever finished
+    polls = int((end - start) / timedelta(minutes=5)) + 1
+    baseline = [(timedelta(minutes=5) - (finish - start) % timedelta(minutes=5)).total_seconds() % 300
+                for g in bet_on for _, _, finish in [games[g]] if finish and finish <= end]
+    latency = stats["settle_latency_seconds"]
+    print(f"{'every 5 min, every sport':26s} {polls * len(sports):6d} API calls  "
+          f"latency avg {statistics.mean(baseline):6.1f}s  max {max(baseline):6.1f}s")
+    print(f"{'pending-games poller':26s} {stats['api_calls']:6d} API calls  "
+          f"latency avg {latency['avg']:6.1f}s  max {latency['max']:6.1f}s  ({elapsed:.1f}s for {stats['ticks']} ticks)")
+    print(f"  calls by sport: {stats['api_calls_by_sport']}")
+
+    with main.engine.connect() as conn:
+        queued = {key.split(":", 1)[1] for key, in conn.execute(text("SELECT key FROM jobs"))}
+    finished = {g for g in bet_on if games[g][2] and games[g][2] <= end}
+    check = Checks()
+    check("every finished game with bets queued for settlement", queued == finished)
+    check("postponed games still tracked", all(games[g][2] is None for g in poller.games))
+    check("no calls for sports without action", set(stats["api_calls_by_sport"]) <= {"NBA", "NFL"})
+    check("fewer API calls than fixed polling", stats["api_calls"] < polls * len(sports))
+    check("lower settlement latency than fixed polling", latency["avg"] < statistics.mean(baseline))
+
+    # Settle the finished games as their jobs would, then a bet lands on one of them afterwards
+    with main.engine.begin() as conn:
+        conn.execute(main.Bet.__table__.update().where(main.Bet.game_id.in_(finished)).values(status="settled"))
+        conn.execute(text("UPDATE jobs SET status = 'done'"))
+    straggler = sorted(finished)[0]
+    bulk_insert(main, main.Bet, bets([straggler], 1))
+    poller.tick(now)
+    with main.engine.connect() as conn:
+        requeued = [key for key, in conn.execute(text("SELECT key FROM jobs WHERE status = 'queued'"))]
+    check("a bet landing on a settled game re-runs its settle_game job", requeued == [f"settle_game:{straggler}"])
+    check.exit()
+
+def bench_bulk(args):
+    """Market makers posting lines and props one request at a time vs in batches, through the HTTP stack"""
+    main = load_app(args)
+    import httpx
+    bookies = args.users
+    seed_users(main, [{"username": f"user{i}", "password": "x", "balance": 1e9, "profit": 0.0, "wins": 0, "losses": 0,
+                       "lines_created": 0, "is_admin": False} for i in range(bookies)])
+    tokens = [main.create_token(i) for i in range(1, bookies + 1)]
+    rnd = random.Random(15)
+    games = [game["id"] for game in main.GAMES]
+
+    def line():
+        return {"game_id": rnd.choice(games), "type": rnd.choice(["spread", "total"]), "side": "home",
+                "value": rnd.choice([-3.5, 1.5, 210.5]), "amount": float(rnd.choice([10, 25, 50]))}
+
+    def prop():
+        return {"sport": "NBA", "player_name": f"Player {rnd.randrange(500)}", "prop_type": "Points", "line": 20.5,
+                "side": "over", "amount": 25.0}
+
+    async def post(requests):
+        transport = httpx.ASGITransport(app=main.app)
+        gate = asyncio.Semaphore(args.concurrency)
+        statuses = {}
+
+        async def send(client, path, body):
+            async with gate:
+                response = await client.post(path, json=body)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(send(client, path, body) for path, body in requests))
+            return time.perf_counter() - started, statuses
+
+    def run(label, path, make, key):
+        per_bookie = args.lines // bookies
+        singles = [(f"/api/{path}?token={token}", make()) for token in tokens for _ in range(per_bookie)]
+        batches = [(f"/api/{path}/batch?token={token}", {key: [make() for _ in range(args.batch)]})
+                   for token in tokens for _ in range(per_bookie // args.batch)]
+        single_time, single_statuses = asyncio.run(post(singles))
+        batch_time, batch_statuses = asyncio.run(post(batches))
+        posted = len(batches) * args.batch
+        print(f"{label + ' one by one':24s} {len(singles):6d} in {single_time:6.2f}s  {len(singles) / single_time:8.0f}/s  "
+              f"statuses {single_statuses}")
+        print(f"{label + f' in batches of {args.batch}':24s} {posted:6d} in {batch_time:6.2f}s  {posted / batch_time:8.0f}/s  "
+              f"statuses {batch_statuses}  ({single_time / len(singles) * posted / batch_time:.1f}x)")
+        return len(singles) + posted
+
+    check = Checks()
+    user_writes = count_user_writes(main)
+    expected_lines = run("lines", "lines", line, "lines")
+    expected_props = run("props", "props", prop, "props")
+    with main.engine.connect() as conn:
+        lines = conn.execute(text("SELECT count(*), coalesce(sum(amount), 0) FROM lines")).first()
+        props = conn.execute(text("SELECT count(*), coalesce(sum(amount), 0) FROM props")).first()
+        escrowed = -conn.execute(text("SELECT coalesce(sum(amount), 0) FROM ledger_entries WHERE kind IN ('line', 'prop')")).scalar()
+        entries = conn.execute(text("SELECT count(*) FROM ledger_entries WHERE kind IN ('line', 'prop')")).scalar()
+
+    check("every line and prop created", lines[0] == expected_lines and props[0] == expected_props)
+    check("one escrow entry per line and prop", entries == expected_lines + expected_props)
+    check("escrowed exactly what was posted", abs(escrowed - lines[1] - props[1]) < 1e-6)
+    check("posting never writes the bookie's users row", user_writes["updates"] == 0)
+    check("ledger reconciles", not main.ledger.reconcile()["mismatched"])
+    check.exit()
+
+def bench_history(args):
+    """A heavy user's bet history: the old load-everything query vs keyset pages and the streaming export"""
+    main = load_app(args)
+    users = args.users
+    seed_users(main, [{"username": f"user{i}", "password": "x", "balance": 1000.0, "profit": 0.0, "wins": 0, "losses": 0,
+                       "lines_created": 0, "is_admin": False} for i in range(users)])
+    rnd = random.Random(16)
+    heavy = 1
+    rows = []
+    for i in range(args.bets):
+        # Half the bets involve the heavy user, on one side or the other
+        bookie, bettor = rnd.sample(range(2, users + 1), 2)
+        if i % 2 == 0:
+            bookie, bettor = (heavy, bettor) if rnd.random() < 0.5 else (bookie, heavy)
+        rows.append({"line_id": i + 1, "bookie_id": bookie, "bookie_name": "bookie", "bettor_id": bettor,
+                     "bettor_name": "bettor", "game_id": f"game_{i % 300}", "game": "Away @ Home",
+                     "type": rnd.choice(["spread", "moneyline", "total"]), "bookie_side": "home", "bettor_side": "away",
+                     "value": -3.5, "amount": 25.0, "status": rnd.choice(["pending", "settled", "settled", "settled"]),
+                     "created_at": datetime(2024, 1, 1) + timedelta(minutes=i)})
+        if len(rows) == 100000:
+            bulk_insert(main, main.Bet, rows)
+            rows = []
+    bulk_insert(main, main.Bet, rows)
+    history = (args.bets + 1) // 2
+    print(f"Seeded {args.bets} bets, {history} of them user {heavy}'s")
+
+    def measured(label, fn):
+        # Timed untraced; tracemalloc slows Python down too much to time under
+        started = time.perf_counter()
+        count = fn()
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label:36s} {count:8d} rows  {elapsed * 1000:9.1f} ms  peak {peak / 1e6:7.1f} MB")
+        return count
+
+    def load_everything():
+        with main.SessionLocal() as db:
+            return len(db.query(main.Bet).filter((main.Bet.bookie_id == heavy) | (main.Bet.bettor_id == heavy)).all())
+
+    def one_page(cursor=None, **filters):
+        def fetch():
+            with main.SessionLocal() as db:
+                return len(main.page(db, *main.bet_history("single", heavy, **filters), cursor, 100)[0])
+        return fetch
+
+    def export(render):
+        async def drain():
+            count = 0
+            query, id_column = main.bet_history("single", heavy)
+            async for chunk in render(main.export_rows(query, id_column)):
+                count += chunk.count(b"\n" if isinstance(chunk, bytes) else "\n")
+            return count
+        return lambda: asyncio.run(drain())
+
+    everything = measured("old /api/bets (every row)", load_everything)
+    measured("history, first page", one_page())
+    measured("history, page at the oldest end", one_page(cursor=args.bets // 100))
+    measured("history, settled spreads, first page", one_page(status="settled", type="spread"))
+    ndjson = measured("export ndjson", export(main.ndjson_lines))
+    csv_rows = measured("export csv", export(lambda rows: main.csv_lines(rows, [c.key for c in main.BET_COLUMNS])))
+    check = Checks()
+    check("exports have every row of the history", everything == history and ndjson == history and csv_rows == history + 1)
+    check.exit()
+
+def bench_serialize(args):
+    """JSON encoding of each list endpoint's rows at 1k/10k/100k: dicts through jsonable_encoder and json vs APIResponse"""
+    main = load_app(args)
+    from fastapi.encoders import jsonable_encoder
+    sizes = [1000, 10000, 100000]
+    seed_book(main, 1000, sizes[-1], open_lines=sizes[-1], open_props=sizes[-1])
+    bulk_insert(main, main.LedgerEntry, [{"user_id": 1 + i % 1000, "amount": -25.0, "kind": "line", "ref_id": i,
+                                          "created_at": datetime(2026, 1, 1)} for i in range(sizes[-1])])
+    rnd = random.Random(17)
+    shapes = {
+        "lines": lambda n: main.select(*main.LINE_COLUMNS).limit(n),
+        "props": lambda n: main.select(*main.PROP_COLUMNS).limit(n),
+        "bets": lambda n: main.select(*main.BET_COLUMNS).limit(n),
+        "ledger": lambda n: main.select(main.LedgerEntry.id, main.LedgerEntry.amount, main.LedgerEntry.kind,
+                                        main.LedgerEntry.ref_id, main.LedgerEntry.created_at).limit(n),
+        # Built in Python by their endpoints rather than selected
+        "leaderboard": lambda n: [{"id": i, "username": f"user{i}", "balance": rnd.uniform(0, 5000), "profit": rnd.uniform(-500, 500),
+                                   "wins": rnd.randint(0, 50), "losses": rnd.randint(0, 50), "rank": i + 1} for i in range(n)],
+        "users/search": lambda n: [{"id": i, "username": f"user{i}", "wins": 10, "losses": 5, "profit": 12.5, "win_rate": 66.7,
+                                    "rating": 0, "followers": 0} for i in range(n)],
+    }
+
+    def old(rows):
+        # What the endpoints did before: a dict per row, then FastAPI's jsonable_encoder and JSONResponse
+        if rows and not isinstance(rows[0], dict):
+            rows = [dict(row._mapping) for row in rows]
+        return json.dumps(jsonable_encoder(rows), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+    def new(rows):
+        return main.APIResponse(rows).body
+
+    print(f"{'endpoint':14s} {'rows':>7s} {'dicts+jsonable+json':>20s} {'APIResponse':>12s} {'speedup':>8s}")
+    differs = []
+    with main.engine.connect() as conn:
+        for name, make in shapes.items():
+            for n in sizes:
+                rows = make(n)
+                if not isinstance(rows, list):
+                    rows = conn.execute(rows).all()
+                repeat = max(1, args.repeat * 1000 // n)
+                before = statistics.median(timed(lambda: old(rows), repeat))
+                after = statistics.median(timed(lambda: new(rows), repeat))
+                print(f"{name:14s} {len(rows):7d} {before:17.2f} ms {after:9.2f} ms {before / after:7.1f}x")
+                if json.loads(old(rows)) != json.loads(new(rows)):
+                    differs.append(f"{name} at {n} rows")
+    check = Checks()
+    check("every endpoint encodes the same rows either way" + (f" ({', '.join(differs)} differ)" if differs else ""), not differs)
+    check.exit()
+
+def bench_static(args):
+    """The frontend read from disk on every request vs served from memory (identity, gzip, 304), and gzip on big API responses"""
+    main = load_app(args)
+    import gzip
+    seed_book(main, 100, 0, open_lines=1000, open_props=0)
+
+    @main.app.get("/bench/old-app", response_class=main.HTMLResponse)
+    def old_app():
+        # What /app did before: open and read index.html on every request, never compressed or cached
+        with open(os.path.join(main.FRONTEND_DIR, "index.html"), "r") as f:
+            return f.read()
+
+    async def run(path, headers, n):
+        response = await asgi_get(main.app, path, headers)
+        started = time.perf_counter()
+        for _ in range(n):
+            await asgi_get(main.app, path, headers)
+        return response, n / (time.perf_counter() - started)
+
+    etag = asyncio.run(run("/app", {"Accept-Encoding": "gzip"}, 0))[0][1][b"etag"].decode()
+    cases = [
+        ("old /app, read per request", "/bench/old-app", {"Accept-Encoding": "identity"}),
+        ("/app identity", "/app", {"Accept-Encoding": "identity"}),
+        ("/app gzip", "/app", {"Accept-Encoding": "gzip"}),
+        ("/app revalidate (304)", "/app", {"Accept-Encoding": "gzip", "If-None-Match": etag}),
+        ("/api/lines?limit=500 identity", "/api/lines?limit=500", {"Accept-Encoding": "identity"}),
+        ("/api/lines?limit=500 gzip", "/api/lines?limit=500", {"Accept-Encoding": "gzip"}),
+    ]
+    print(f"{'request':32s} {'status':>6s} {'encoding':>9s} {'bytes':>8s} {'req/s':>8s}")
+    results = {}
+    for label, path, headers in cases:
+        n = args.requests // 10 if path.startswith("/api/") else args.requests
+        response, rate = asyncio.run(run(path, headers, n))
+        results[label] = response
+        status, response_headers, body = response
+        print(f"{label:32s} {status:6d} {response_headers.get(b'content-encoding', b'-').decode():>9s} "
+              f"{len(body):8d} {rate:8.0f}")
+
+    # An event stream must reach the client as each event is written, so the gzip middleware has to pass it through
+    sent = []
+
+    async def events(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+        await send({"type": "http.response.body", "body": b"data: {}\n\n" * 200, "more_body": True})
+
+    async def capture(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": "/api/stream", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(main.APIGZipMiddleware(events, minimum_size=main.GZIP_MIN_SIZE)(scope, None, capture))
+
+    check = Checks()
+
+    old, plain, zipped = results["old /app, read per request"], results["/app identity"], results["/app gzip"]
+    revalidated, api_plain, api_zipped = (results["/app revalidate (304)"], results["/api/lines?limit=500 identity"],
+                                          results["/api/lines?limit=500 gzip"])
+    check("same page whether read per request or from memory", old[2] == plain[2])
+    check("gzip variant decodes to the page", zipped[1].get(b"content-encoding") == b"gzip" and gzip.decompress(zipped[2]) == plain[2])
+    check("gzip and identity carry different ETags", zipped[1][b"etag"] != plain[1][b"etag"])
+    check("matching If-None-Match answers 304 with no body", revalidated[0] == 304 and not revalidated[2])
+    check("large API responses gzipped", api_zipped[1].get(b"content-encoding") == b"gzip"
+          and gzip.decompress(api_zipped[2]) == api_plain[2])
+    check("identity-only clients get identity", b"content-encoding" not in api_plain[1])
+    check("event stream passed through uncompressed",
+          b"content-encoding" not in dict(sent[0]["headers"]) and sent[1]["body"].startswith(b"data: "))
+    check.exit()
+
+class OddsStub:
+    """An in-process Odds API: every game closes to betting at kick-off and goes final on demand"""
+    def __init__(self, sports, games, started):
+        self.sports = sports  # sport key -> label
+        self.games = {key: [] for key in sports}
+        for i in range(games):
+            key = list(sports)[i % len(sports)]
+            self.games[key].append({"id": f"{sports[key].lower()}_{i}", "sport_key": key, "home_team": f"Home {i}",
+                                    "away_team": f"Away {i}", "commence_time": started.isoformat() + "Z"})
+        self.closed = set()
+        self.final = {}  # game_id -> {"scores": [...], "last_update": ...}
+        self.hits = {"odds": 0, "scores": 0}
+        self.server = None
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                _, key, kind = self.path.split("?")[0].strip("/").split("/")
+                body = json.dumps(stub.feed(key, kind)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def close(self):
+        self.server.shutdown()
+
+    def feed(self, key, kind):
+        self.hits[kind] += 1
+        if kind == "odds":
+            return [game for game in self.games[key] if game["id"] not in self.closed]
+        return [dict(game, completed=game["id"] in self.final, **self.final.get(game["id"], {"scores": None}))
+                for game in self.games[key] if game["id"] in self.closed]
+
+    def kick_off(self, game_ids):
+        self.closed.update(game_ids)
+
+    def finish(self, game_ids, rnd):
+        for game in (g for games in self.games.values() for g in games if g["id"] in game_ids):
+            self.final[game["id"]] = {"scores": [{"name": game["home_team"], "score": str(rnd.randint(80, 130))},
+                                                 {"name": game["away_team"], "score": str(rnd.randint(80, 130))}],
+                                      "last_update": datetime.utcnow().isoformat() + "Z"}
+
+LIFECYCLE_MIX = {"get_lines": 35, "get_bets": 20, "take_line": 20, "create_line": 15, "login": 5, "register": 5}
+
+def bench_lifecycle(args):
+    """The whole bet lifecycle: a concurrent request mix while games kick off and settle through check_game_scores"""
+    rnd = random.Random(11)
+    sports = {"basketball_nba": "NBA", "americanfootball_nfl": "NFL"}
+    # Every game starts a day from now, so lines can be taken until their cohort kicks off; settlement passes run
+    # the score poller as of two and a half hours after that, when every game is due to finish
+    kickoff = datetime.utcnow() + timedelta(days=1)
+    stub = OddsStub(sports, args.games, kickoff)
+    os.environ.update({"ODDS_API_KEY": "bench", "ODDS_API_BASE": stub.start(), "GAME_CACHE_TTL": "3600",
+                       "ODDS_SPORTS": ",".join(f"{key}:{label}" for key, label in sports.items()),
+                       "SCORE_POLL_FAST": "0", "SCORE_POLL_SLOW": "0"})
+    main = load_app(args)
+    import httpx
+    games = [game for key in sports for game in stub.games[key]]
+    game_sport = {game["id"]: sports[game["sport_key"]] for game in games}
+    commence = main.parse_time(games[0]["commence_time"])
+
+    # Seed
+    started = time.perf_counter()
+    seed_users(main, [{"username": f"user{i}", "password": "x", "balance": 1e6, "profit": 0.0, "wins": 0, "losses": 0,
+                       "lines_created": 0, "is_admin": False} for i in range(args.users)])
+    bulk_insert(main, main.Group, [{"name": f"group {i}", "creator_id": 1, "creator_name": "user0", "members": "[]"}
+                                   for i in range(args.groups)])
+    bulk_insert(main, main.GroupMember, [{"group_id": g + 1, "user_id": u} for g in range(args.groups)
+                                         for u in rnd.sample(range(1, args.users + 1), min(args.users, rnd.randint(2, 20)))])
+
+    def line_row(i, status):
+        game = games[i % len(games)]
+        private = args.groups and rnd.random() < 0.1
+        return {"bookie_id": rnd.randint(1, args.users), "bookie_name": "bookie", "game_id": game["id"],
+                "game": f"{game['away_team']} @ {game['home_team']}", "sport": game_sport[game["id"]],
+                "commence_time": commence, "type": rnd.choice(["spread", "moneyline", "total"]), "side": "home",
+                "value": -3.5, "amount": rnd.choice([10.0, 25.0, 50.0, 100.0]), "status": status,
+                "current_bettors": 0, "total_action": 0.0, "is_private": bool(private),
+                "group_id": rnd.randint(1, args.groups) if private else None, "created_at": datetime.utcnow()}
+
+    matched = max(1, args.bets // 10)
+    bulk_insert(main, main.Line, [line_row(i, "matched") for i in range(matched)])
+    bulk_insert(main, main.Line, [line_row(i, "open") for i in range(args.lines)])
+    bulk_insert(main, main.Prop, [{"bookie_id": rnd.randint(1, args.users), "bookie_name": "bookie", "sport": "NBA",
+                                   "player_name": f"Player {i % 500}", "prop_type": "Points", "line": 20.5,
+                                   "side": "over", "amount": 25.0, "status": "open"} for i in range(args.lines // 2)])
+    rows = []
+    for i in range(args.bets):
+        line_id = rnd.randint(1, matched)
+        game = games[(line_id - 1) % len(games)]
+        rows.append({"line_id": line_id, "bookie_id": rnd.randint(1, args.users), "bookie_name": "bookie",
+                     "bettor_id": rnd.randint(1, args.users), "bettor_name": "bettor", "game_id": game["id"],
+                     "game": "Away @ Home", "commence_time": commence, "type": rnd.choice(["spread", "moneyline", "total"]),
+                     "bookie_side": "home", "bettor_side": "away", "value": -3.5, "amount": 25.0, "status": "pending"})
+        if len(rows) == 100000:
+            bulk_insert(main, main.Bet, rows)
+            rows = []
+    bulk_insert(main, main.Bet, rows)
+    with main.engine.connect() as conn:
+        open_lines = {}  # game_id -> public open line ids
+        for line_id, game_id in conn.execute(text("SELECT id, game_id FROM lines WHERE status = 'open' AND is_private = false")):
+            open_lines.setdefault(game_id, []).append(line_id)
+    print(f"Seeded {args.users} users, {args.groups} groups, {args.lines} lines, {args.lines // 2} props and "
+          f"{args.bets} pending bets over {len(games)} games in {time.perf_counter() - started:.1f}s")
+
+    # Every SQL statement is charged to the endpoint whose request (or settlement pass) ran it
+    endpoint = contextvars.ContextVar("endpoint", default=None)
+    queries = {}
+    counting = threading.Lock()
+
+    def count_query(*_):
+        name = endpoint.get()
+        if name:
+            with counting:
+                queries[name] = queries.get(name, 0) + 1
+
+    for engine in filter(None, [main.engine, main.async_engine and main.async_engine.sync_engine]):
+        event.listen(engine, "before_cursor_execute", count_query)
+
+    # Games kick off in cohorts, one per round; each cohort goes final and is settled while the next round's load
+    # runs. The last cohort never kicks off, so there is always something left to bet on.
+    cohorts = [[game["id"] for game in games[r::args.rounds + 1]] for r in range(args.rounds + 1)]
+    tokens = [main.create_token(i) for i in range(1, args.users + 1)]
+    registered = []
+    latencies, statuses = {}, {}
+    settle_latencies = []
+    kinds, weights = list(LIFECYCLE_MIX), list(LIFECYCLE_MIX.values())
+
+    def request_for(kind, token):
+        if kind == "get_lines":
+            sport = rnd.choice([None, "NBA", "NFL"])
+            query = "&".join(filter(None, [f"sport={sport}" if sport else "", f"token={token}" if rnd.random() < 0.5 else ""]))
+            return "GET", f"/api/lines?{query}", None
+        if kind == "get_bets":
+            return "GET", f"/api/bets?token={token}", None
+        if kind == "take_line":
+            candidates = [game_id for game_id in live if open_lines.get(game_id)]
+            if candidates:
+                lines = open_lines[rnd.choice(candidates)]
+                return "POST", f"/api/lines/take?token={token}", {"line_id": lines.pop(rnd.randrange(len(lines)))}
+            kind = "create_line"
+        if kind == "create_line":
+            return "POST", f"/api/lines?token={token}", {"game_id": rnd.choice(live), "type": rnd.choice(["spread", "total"]),
+                                                         "side": "home", "value": -3.5, "amount": rnd.choice([10.0, 25.0, 50.0])}
+        if kind == "login" and registered:
+            return "POST", "/api/auth/login", {"username": rnd.choice(registered), "password": "secret1"}
+        return "POST", "/api/auth/register", {"username": f"load_{rnd.getrandbits(48):x}",
+                                              "password": "secret1"}
+
+    def record(name, status, elapsed_ms):
+        latencies.setdefault(name, []).append(elapsed_ms)
+        by_status = statuses.setdefault(name, {})
+        by_status[status] = by_status.get(status, 0) + 1
+
+    async def send(client, gate, kind):
+        async with gate:
+            method, path, body = request_for(kind, rnd.choice(tokens))
+            name = {"/api/auth/register": "register", "/api/auth/login": "login"}.get(path, kind)
+            if method == "POST" and path.startswith("/api/lines?"):
+                name = "create_line"
+            endpoint.set(name)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                status = response.status_code
+            except Exception as e:
+                print(f"  {name}: {type(e).__name__}: {e}")
+                status = "exception"
+            record(name, status, (time.perf_counter() - started) * 1000)
+            if status != 200:
+                return
+            if name == "create_line":
+                open_lines.setdefault(body["game_id"], []).append(response.json()["line_id"])
+            elif name == "register":
+                registered.append(body["username"])
+
+    def settle(cohort):
+        # A settlement pass is what the scheduler's check_game_scores tick does once the cohort is due to finish,
+        # plus draining the jobs it queued
+        endpoint.set("check_game_scores")
+        finished = time.perf_counter()
+        stub.finish(set(cohort), rnd)
+        pending = 1
+        while pending:
+            started = time.perf_counter()
+            main.score_poller.tick(kickoff + timedelta(minutes=150))
+            while (job := main.job_queue.claim()) is not None:
+                main.job_queue.run(job)
+            record("check_game_scores", 200, (time.perf_counter() - started) * 1000)
+            with main.engine.connect() as conn:
+                pending = conn.execute(select(func.count()).select_from(main.Bet).where(
+                    main.Bet.status == "pending", main.Bet.game_id.in_(cohort))).scalar()
+            if pending and time.perf_counter() - finished > 60:
+                print(f"  {pending} bets on a finished cohort still pending after 60s")
+                break
+        settle_latencies.append((time.perf_counter() - finished) * 1000)
+
+    async def run_rounds():
+        transport = httpx.ASGITransport(app=main.app)
+        gate = asyncio.Semaphore(args.concurrency)
+        per_round = args.requests // args.rounds
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for r in range(args.rounds):
+                stub.kick_off(cohorts[r])
+                # New lines can only go on games in the feed, which lists a limited number per sport
+                feed = {game["id"] for game in await asyncio.to_thread(main.game_cache.refresh)}
+                live[:] = [game_id for cohort in cohorts[r + 1:] for game_id in cohort if game_id in feed]
+                load = [rnd.choices(kinds, weights)[0] for _ in range(per_round)]
+                await asyncio.gather(asyncio.to_thread(settle, cohorts[r]), *(send(client, gate, kind) for kind in load))
+        await main.shutdown()
+
+    live = []
+    started = time.perf_counter()
+    asyncio.run(run_rounds())
+    elapsed = time.perf_counter() - started
+    stub.close()
+
+    total = sum(len(samples) for name, samples in latencies.items() if name != "check_game_scores")
+    db_mode = main.db_stats()["mode"]
+    print(f"== {main.engine.dialect.name} ({db_mode}), {total} requests in {elapsed:.1f}s = {total / elapsed:.0f} req/s, "
+          f"concurrency {args.concurrency} ==")
+    print(f"{'endpoint':18s} {'count':>6s} {'req/s':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'queries/req':>11s}  statuses")
+    endpoints = {}
+    for name in kinds + ["check_game_scores"]:
+        samples = latencies.get(name)
+        if not samples:
+            continue
+        endpoints[name] = {"count": len(samples), "rps": round(len(samples) / elapsed, 1),
+                           "p50_ms": round(percentile(samples, 50), 2), "p95_ms": round(percentile(samples, 95), 2),
+                           "p99_ms": round(percentile(samples, 99), 2), "mean_ms": round(statistics.mean(samples), 2),
+                           "max_ms": round(max(samples), 2), "queries": queries.get(name, 0),
+                           "queries_per_request": round(queries.get(name, 0) / len(samples), 2),
+                           "statuses": {str(k): v for k, v in sorted(statuses[name].items(), key=str)}}
+        e = endpoints[name]
+        print(f"{name:18s} {e['count']:6d} {e['rps']:7.1f} {e['p50_ms']:8.2f} {e['p95_ms']:8.2f} {e['p99_ms']:8.2f} "
+              f"{e['queries_per_request']:11.2f}  {e['statuses']}")
+    print(f"settlement: {len(settle_latencies)} cohorts, finish to settled {summary(settle_latencies)}, "
+          f"{stub.hits['scores']} score polls, {stub.hits['odds']} odds fetches")
+
+    with main.engine.connect() as conn:
+        finished_ids = [game_id for cohort in cohorts[:args.rounds] for game_id in cohort]
+        left = conn.execute(select(func.count()).select_from(main.Bet).where(
+            main.Bet.status == "pending", main.Bet.game_id.in_(finished_ids))).scalar()
+        still_open = conn.execute(select(func.count()).select_from(main.Line).where(
+            main.Line.status == "open", main.Line.game_id.in_(finished_ids))).scalar()
+    check = Checks()
+    check("no 5xx or transport errors", not any(status == "exception" or status >= 500
+                                               for by_status in statuses.values() for status in by_status))
+    check("every bet on a finished game settled", left == 0)
+    check("no line on a finished game left open", still_open == 0)
+    check("ledger reconciles", not main.ledger.reconcile()["mismatched"])
+
+    results = {"benchmark": "lifecycle", "at": datetime.utcnow().isoformat() + "Z", "database": main.engine.dialect.name,
+               "mode": db_mode, "python": platform.python_version(),
+               "config": {key: getattr(args, key) for key in ("users", "groups", "lines", "bets", "games", "rounds",
+                                                               "requests", "concurrency")},
+               "seconds": round(elapsed, 2), "requests": total, "throughput_rps": round(total / elapsed, 1),
+               "endpoints": endpoints,
+               "settlement": {"cohorts": len(settle_latencies), "p50_ms": round(percentile(settle_latencies, 50), 2),
+                              "max_ms": round(max(settle_latencies), 2), "score_polls": stub.hits["scores"]},
+               "failures": check.failures}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+    if args.baseline:
+        check.failures += compare_results(args.baseline, results, args.tolerance)
+    check.exit()
+
+def compare_results(path, results, tolerance):
+    """Print how results moved against a saved run and return the regressions beyond tolerance"""
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline["config"] != results["config"] or baseline["database"] != results["database"]:
+        print(f"  note: {path} ran with {baseline['database']} {baseline['config']}; comparing anyway")
+    regressions = []
+
+    def moved(label, before, after, higher_is_worse=True):
+        change = (after - before) / before if before else 0.0
+        worse = change > tolerance if higher_is_worse else change < -tolerance
+        print(f"  {label:40s} {before:10.2f} -> {after:10.2f} {change * 100:+7.1f}%{'  REGRESSED' if worse else ''}")
+        if worse:
+            regressions.append(f"{label} regressed {change * 100:+.1f}%")
+
+    print(f"\n== against {path} (tolerance {tolerance * 100:.0f}%) ==")
+    moved("throughput req/s", baseline["throughput_rps"], results["throughput_rps"], higher_is_worse=False)
+    for name, after in results["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before:
+            moved(f"{name} p95 ms", before["p95_ms"], after["p95_ms"])
+            moved(f"{name} queries/request", before["queries_per_request"], after["queries_per_request"])
+    return regressions
+
+def parse_metrics(body):
+    """Prometheus text as {(name, ((label, value), ...)): value}"""
+    samples = {}
+    for line in body.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, value = line.rsplit(" ", 1)
+        name, _, labels = series.partition("{")
+        pairs = tuple(tuple(pair.split("=", 1)) for pair in labels.rstrip("}").split(",") if pair)
+        samples[(name, tuple((k, v.strip('"')) for k, v in pairs))] = float(value)
+    return samples
+
+def bench_metrics(args):
+    """What /metrics records for requests, SQL, the Odds API, jobs and settlement, what it costs, and the slow-request profiler"""
+    sports = {"basketball_nba": "NBA"}
+    stub = OddsStub(sports, 4, datetime.utcnow() - timedelta(minutes=150))
+    os.environ.update({"ODDS_API_KEY": "bench", "ODDS_API_BASE": stub.start(), "ODDS_SPORTS": "basketball_nba:NBA",
+                       "SCORE_POLL_FAST": "0", "SCORE_POLL_SLOW": "0"})
+    main = load_app(args)
+    seed_book(main, 100, 0, open_lines=1000, open_props=0)
+    game_ids = [game["id"] for game in stub.games["basketball_nba"]]
+    commence = main.parse_time(stub.games["basketball_nba"][0]["commence_time"])
+    bulk_insert(main, main.Line, [{"bookie_id": 1, "bookie_name": "bookie", "game_id": game_id, "game": "Away @ Home",
+                                   "sport": "NBA", "commence_time": commence, "type": "moneyline", "side": "home",
+                                   "value": 0.0, "amount": 25.0, "status": "matched", "current_bettors": 1,
+                                   "is_private": False} for game_id in game_ids])
+    bulk_insert(main, main.Bet, [{"line_id": 1001 + i % len(game_ids), "bookie_id": 1, "bookie_name": "bookie",
+                                  "bettor_id": 2 + i % 50, "bettor_name": "bettor", "game_id": game_ids[i % len(game_ids)],
+                                  "game": "Away @ Home", "commence_time": commence, "type": "moneyline", "bookie_side": "home",
+                                  "bettor_side": "away", "value": 0.0, "amount": 25.0, "status": "pending"}
+                                 for i in range(2000)])
+    statements = [0]
+
+    def count_statement(*_):
+        statements[0] += 1
+
+    event.listen(main.engine, "before_cursor_execute", count_statement)
+
+    async def load(app, paths, n):
+        started = time.perf_counter()
+        for i in range(n):
+            await asgi_get(app, paths[i % len(paths)])
+        return n / (time.perf_counter() - started)
+
+    # What a request costs with and without MetricsMiddleware (same app, middleware stack rebuilt without it)
+    paths = ["/api/lines?limit=20", "/api/lines?sport=NBA&limit=20", "/api/leaderboard?limit=20"]
+    before = parse_metrics(asyncio.run(asgi_get(main.app, "/metrics"))[2].decode())
+    statements[0] = 0
+    with_metrics = [asyncio.run(load(main.app, paths, args.requests))]
+    queried = statements[0]
+    after = parse_metrics(asyncio.run(asgi_get(main.app, "/metrics"))[2].decode())
+    instrumented = main.app.user_middleware
+    bare = [m for m in instrumented if m.cls is not main.MetricsMiddleware]
+    without_metrics = []
+    for _ in range(3):  # alternate, and keep the best of each, to even out noise
+        main.app.user_middleware, main.app.middleware_stack = bare, None
+        without_metrics.append(asyncio.run(load(main.app, paths, args.requests)))
+        main.app.user_middleware, main.app.middleware_stack = instrumented, None
+        with_metrics.append(asyncio.run(load(main.app, paths, args.requests)))
+    with_metrics, without_metrics = max(with_metrics), max(without_metrics)
+    print(f"requests: {with_metrics:8.0f} req/s with MetricsMiddleware, {without_metrics:8.0f} req/s without "
+          f"({(without_metrics / with_metrics - 1) * 100:+.1f}% time per request)")
+
+    # Statement counting: the instrumented engine vs a plain one on the same database
+    event.remove(main.engine, "before_cursor_execute", count_statement)
+    plain = main.create_engine(main.DATABASE_URL)
+    timings = {}
+    for label, engine in (("instrumented", main.engine), ("plain", plain)):
+        with engine.connect() as conn:
+            started = time.perf_counter()
+            for _ in range(args.requests * 4):
+                conn.execute(text("SELECT 1"))
+            timings[label] = (time.perf_counter() - started) / (args.requests * 4) * 1e6
+    print(f"SQL: {timings['instrumented']:.1f} us per statement instrumented, {timings['plain']:.1f} us plain")
+
+    # Settlement through check_game_scores against the stub
+    stub.kick_off(game_ids)
+    stub.finish(set(game_ids), random.Random(3))
+    main.check_game_scores()
+    while (job := main.job_queue.claim()) is not None:
+        main.job_queue.run(job)
+    main.timed_job(main.game_cache.refresh)()
+
+    # A slow request with the profiler on: its busy function shows up in the dumped stacks
+    profiles = tempfile.mkdtemp(prefix="bookieverse-profiles-")
+    atexit.register(shutil.rmtree, profiles, True)
+    main.profiler = main.SlowRequestProfiler(threshold_ms=50, interval_ms=2, directory=profiles)
+    main.profiler.start()
+
+    def burn_cpu_for_bench():
+        deadline = time.perf_counter() + 0.2
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+
+    @main.app.get("/bench/slow")
+    def slow():
+        burn_cpu_for_bench()
+        return {"ok": True}
+
+    main.app.middleware_stack = None
+    asyncio.run(asgi_get(main.app, "/bench/slow"))
+    asyncio.run(asgi_get(main.app, "/api/lines?limit=1"))
+    dumps = os.listdir(profiles)
+    folded = open(os.path.join(profiles, dumps[0])).read() if dumps else ""
+    final = parse_metrics(asyncio.run(asgi_get(main.app, "/metrics"))[2].decode())
+    stub.close()
+
+    def value(samples, name, **labels):
+        return samples.get((name, tuple(labels.items())), 0)
+
+    check = Checks()
+
+    served = sum(value(after, "http_requests_total", method="GET", route=route, status="200") -
+                 value(before, "http_requests_total", method="GET", route=route, status="200")
+                 for route in ("/api/lines", "/api/leaderboard"))
+    sql = sum(value(after, "http_request_sql_queries_sum", method="GET", route=route) -
+              value(before, "http_request_sql_queries_sum", method="GET", route=route)
+              for route in ("/api/lines", "/api/leaderboard"))
+    check("every request counted under its route template", served == args.requests)
+    check("per-request SQL counts add up to the statements executed", sql == queried)
+    line_requests = sum(paths[i % len(paths)].startswith("/api/lines") for i in range(args.requests))
+    check("latency histogram counts each route's requests",
+          value(after, "http_request_duration_seconds_count", method="GET", route="/api/lines") -
+          value(before, "http_request_duration_seconds_count", method="GET", route="/api/lines") == line_requests)
+    check("Odds API score polls recorded", value(final, "odds_api_requests_total", feed="scores", sport="NBA", outcome="200") > 0
+          and value(final, "odds_api_request_duration_seconds_count", feed="scores", sport="NBA") > 0)
+    check("one settle_game job timed per finished game",
+          value(final, "queue_job_duration_seconds_count", kind="settle_game", outcome="done") == len(game_ids))
+    check("settlement batch sizes add up to the bets settled", value(final, "settlement_batch_size_sum", kind="bets") == 2000)
+    check("scheduler job durations recorded", value(final, "scheduler_job_duration_seconds_count", job="GameFeedCache.refresh") > 0)
+    check("one profile dumped, for the slow request only", len(dumps) == 1 and "bench_slow" in dumps[0])
+    check("profile shows the slow request's busy function", "burn_cpu_for_bench" in folded)
+    check.exit()
+
+def bench_reads(args):
+    """Anonymous public listings on the primary with no cache vs the replica behind the read cache; fallback and invalidation"""
+    if not args.database_url:
+        tmp = tempfile.mkdtemp(prefix="bookieverse-bench-")
+        atexit.register(shutil.rmtree, tmp, True)
+        args.database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    # A replica that's really the primary: routing and fallback are what's measured, not replication
+    os.environ["DATABASE_READ_URL"] = os.environ.get("DATABASE_READ_URL", args.database_url)
+    main = load_app(args)
+    seed_book(main, args.users, 0, open_lines=args.lines, open_props=args.lines)
+    rnd = random.Random(5)
+    paths = ([f"/api/lines?sport={sport}&limit=50" for sport in ("NBA", "NFL")] + ["/api/lines?limit=50"] +
+             [f"/api/props?player_name=Player%20{i}" for i in range(10)] +
+             [f"/api/leaderboard?window=all&limit={n}" for n in (10, 50)] + [f"/api/users/search?q=user{i}" for i in range(5)])
+    load = [rnd.choice(paths) for _ in range(args.requests)]
+
+    # Everything runs on one event loop: with ASYNC_DB the pooled connections belong to it
+    async def run(ttl):
+        main.read_cache.ttl = ttl
+        gate = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def get(path):
+            async with gate:
+                started = time.perf_counter()
+                status, _, _ = await asgi_get(main.app, path)
+                latencies.append((time.perf_counter() - started) * 1000)
+                assert status == 200, (path, status)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(get(path) for path in load))
+        return len(load) / (time.perf_counter() - started), latencies
+
+    async def engine_statements():
+        samples = parse_metrics((await asgi_get(main.app, "/metrics"))[2].decode())
+        return {engine: samples.get(("sql_query_duration_seconds_count", (("engine", engine),)), 0)
+                for engine in ("sync", "replica")}
+
+    async def compare():
+        replica = main.ReadSessionLocal, main.AsyncReadSessionLocal
+        main.ReadSessionLocal = main.AsyncReadSessionLocal = None  # what the listings did before: the primary, every time
+        for label, ttl in (("primary, no cache:   ", 0), ("replica + read cache:", 1.0)):
+            before = await engine_statements()
+            rate, latencies = await run(ttl)
+            after = await engine_statements()
+            primary, on_replica = after["sync"] - before["sync"], after["replica"] - before["replica"]
+            print(f"{label} {rate:7.0f} req/s  {summary(latencies)}  primary {primary:.0f} / replica {on_replica:.0f} statements")
+            main.ReadSessionLocal, main.AsyncReadSessionLocal = replica
+        print(f"read cache: {main.read_cache.stats()}")
+        return on_replica > 0 and primary <= 2  # the /metrics scrapes
+
+    async def take_and_relist():
+        first = json.loads((await asgi_get(main.app, listing))[2])
+        taken = next(line for line in first if line["bookie_id"] != args.users)
+        with main.SessionLocal() as db:
+            main.match_line(db, taken["id"], main.fetch_principal(db, args.users))
+            db.commit()
+        return taken, await asgi_get(main.app, listing)
+
+    async def with_dead_replica():
+        main.ReadSessionLocal = main.sessionmaker(bind=main.create_engine("sqlite:////nonexistent/bench/replica.db"),
+                                                  info={"replica": True})
+        main.AsyncReadSessionLocal = None
+        main.read_cache.ttl = 0
+        return [(await asgi_get(main.app, "/api/props?limit=5"))[0] for _ in range(5)]
+
+    async def scenario():
+        try:
+            return await compare(), await take_and_relist(), await with_dead_replica()
+        finally:
+            for engine in (main.async_engine, main.async_read_engine):
+                if engine is not None:
+                    await engine.dispose()  # aiosqlite's worker threads would keep the process alive
+
+    listing = "/api/lines?sport=NBA&limit=50"
+    routed, (taken, (status, headers, body)), statuses = asyncio.run(scenario())
+
+    check = Checks()
+    check("cached listings read from the replica, not the primary", routed)
+
+    # A write invalidates this process's cached listing as soon as it commits
+    check("a taken line drops out of the cached listing straight away",
+          headers.get(b"x-cache") == b"miss" and taken["id"] not in [line["id"] for line in json.loads(body)])
+
+    # Concurrent misses on one key share a single load
+    loads = [0]
+
+    async def slow_load():
+        loads[0] += 1
+        await asyncio.sleep(0.05)
+        return [{"ok": True}]
+
+    async def stampede():
+        cache = main.ReadCache(ttl=1.0)
+        return await asyncio.gather(*(cache.response("bench", "key", slow_load) for _ in range(100)))
+
+    responses = asyncio.run(stampede())
+    check("100 concurrent misses, one load", loads[0] == 1 and all(r.body == b'[{"ok":true}]' for r in responses))
+
+    # A miss after a write doesn't join a load that started before it
+    rows = [["before"]]
+
+    async def load_rows():
+        current = rows[0]
+        await asyncio.sleep(0.05)
+        return current
+
+    async def write_during_load():
+        cache = main.ReadCache(ttl=1.0)
+        first = asyncio.create_task(cache.response("bench", "key", load_rows))
+        await asyncio.sleep(0.01)
+        rows[0] = ["after"]
+        cache.invalidate(["bench"])
+        return await asyncio.gather(first, cache.response("bench", "key", load_rows))
+
+    before, after = asyncio.run(write_during_load())
+    check("a miss after a write loads again instead of joining the older load",
+          before.body == b'["before"]' and after.body == b'["after"]')
+
+    # Two workers sharing a backend: the second is served the first's load, and an invalidation reaches it
+    shared = main.MemoryCacheBackend()
+    worker_a, worker_b = main.ReadCache(ttl=0.2, shared=shared), main.ReadCache(ttl=0.2, shared=shared)
+    loads[0] = 0
+
+    async def count_load():
+        loads[0] += 1
+        return [loads[0]]
+
+    async def two_workers():
+        a = await worker_a.response("lines", "k", count_load)
+        b = await worker_b.response("lines", "k", count_load)
+        worker_a.invalidate(["lines"])
+        await asyncio.sleep(0.25)  # worker_b's local copy expires
+        c = await worker_b.response("lines", "k", count_load)
+        return a.body, b.body, c.body
+
+    a, b, c = asyncio.run(two_workers())
+    check("second worker served from the shared backend", a == b == b"[1]" and worker_b.shared_hits == 1)
+    check("invalidation in one worker reaches the other within the TTL", c == b"[2]")
+
+    # The replica may lag settlement, so a leaderboard read there doesn't become the board ranks are served from
+    main.leaderboards.boards.clear()
+    with main.sessionmaker(bind=main.engine, info={"replica": True})() as db:
+        main._leaderboard(db, "all", None, 0, 10)
+    check("a leaderboard read on the replica isn't kept as the shared board", not main.leaderboards.boards)
+
+    # A settlement applied while a board reloads may or may not be in the rows read, so that load isn't kept either
+    class SettledDuringLoad:
+        def __init__(self, db):
+            self.db, self.info = db, db.info
+
+        def execute(self, *args, **kwargs):
+            main.leaderboards.apply([("all", "ALL", 1, 100.0)])  # another session's after_commit
+            return self.db.execute(*args, **kwargs)
+
+    with main.SessionLocal() as db:
+        main.leaderboards.board(SettledDuringLoad(db))
+    check("a board reloaded while a settlement is applied isn't kept", not main.leaderboards.boards)
+
+    # Past daily and weekly boards are pruned; the current ones and all-time stay
+    now = datetime.utcnow()
+    current, old = main.board_keys(now), main.board_keys(now - timedelta(weeks=main.LEADERBOARD_KEEP_WEEKS + 1))
+    bulk_insert(main, main.LeaderboardEntry, [{"board": board, "sport": "ALL", "user_id": user_id, "profit": 1.0,
+                                               "wins": 1, "losses": 0}
+                                              for board in (old["day"], old["week"], current["day"], current["week"])
+                                              for user_id in range(1, 11)])
+    pruned = main.leaderboards.prune(now)
+    with main.engine.connect() as conn:
+        boards = set(conn.execute(text("SELECT DISTINCT board FROM leaderboard_entries")).scalars())
+    check("past day and week boards are pruned, current ones kept",
+          pruned["boards_pruned"] == 2 and not {old["day"], old["week"]} & boards
+          and {current["day"], current["week"]} <= boards)
+
+    # A dead replica (the last scenario step): reads fall back to the primary and stay there for READ_REPLICA_RETRY
+    check("reads fall back to the primary when the replica is down",
+          statuses == [200] * 5 and main.read_replica.fallbacks == 1)
+    check.exit()
+
+def bench_parlays(args):
+    """A slate of games settling --parlays parlays of 2-10 legs: the leg index vs re-evaluating every open ticket per game"""
+    main = load_app(args)
+    rnd = random.Random(22)
+    game_ids = [f"game_{i}" for i in range(args.games)]
+    scores = {g: (rnd.randint(80, 130), rnd.randint(80, 130)) for g in game_ids}
+    seed_users(main, [{"username": f"user{i}", "password": "x", "balance": 1e6, "profit": 0.0, "wins": 0, "losses": 0,
+                       "lines_created": 0, "is_admin": False} for i in range(args.users)])
+    markets = [("spread", "home", -3.5), ("spread", "away", 2.5), ("moneyline", "home", 0.0), ("moneyline", "away", 0.0),
+               ("total", "over", 210.5), ("total", "under", 215.5)]
+    parlays, legs = [], []
+    for parlay_id in range(1, args.parlays + 1):
+        picked = rnd.sample(game_ids, rnd.randint(2, min(10, len(game_ids))))
+        bettor, bookie = rnd.sample(range(1, args.users + 1), 2)
+        taken = rnd.random() >= 0.05  # the rest were never taken and are voided by their first decided leg
+        parlays.append({"id": parlay_id, "bettor_id": bettor, "bettor_name": "bettor", "bookie_id": bookie if taken else None,
+                        "bookie_name": "bookie" if taken else None, "amount": 10.0, "payout": 10.0 * 2 ** len(picked),
+                        "leg_count": len(picked), "legs_pending": len(picked), "status": "pending" if taken else "open"})
+        for game_id in picked:
+            market, side, value = rnd.choice(markets)
+            legs.append({"id": len(legs) + 1, "parlay_id": parlay_id, "sport": "NBA", "game_id": game_id,
+                         "game": "Away @ Home", "type": market, "value": value, "bookie_side": side,
+                         "bettor_side": main.OPPOSITE_SIDES[side], "status": "pending"})
+    bulk_insert(main, main.Parlay, parlays)
+    bulk_insert(main, main.ParlayLeg, legs)
+    print(f"Seeded {len(parlays)} parlays with {len(legs)} legs over {args.games} games")
+
+    # What settling the slate in order should do: each ticket is decided by its first losing leg, or its last leg
+    order = {g: i for i, g in enumerate(game_ids)}
+    leg_won = {leg["id"]: main.determine_winner(SimpleNamespace(**leg), *scores[leg["game_id"]]) == "bettor" for leg in legs}
+    by_parlay = {}
+    for leg in legs:
+        by_parlay.setdefault(leg["parlay_id"], []).append(leg)
+    expected, expected_legs = {}, 0
+    for p in parlays:
+        ticket = sorted(by_parlay[p["id"]], key=lambda leg: order[leg["game_id"]])
+        if p["status"] == "open":
+            expected[p["id"]] = ("void", None)
+            expected_legs += 1
+            continue
+        decided = next((i for i, leg in enumerate(ticket) if not leg_won[leg["id"]]), None)
+        expected[p["id"]] = ("settled", "bettor" if decided is None else "bookie")
+        expected_legs += len(ticket) if decided is None else decided + 1
+
+    def full_rescan(finished):
+        """The unindexed way: after a game, reload every live ticket's legs and re-evaluate them all"""
+        with main.SessionLocal() as db:
+            rows = db.execute(select(main.ParlayLeg.__table__).join(main.Parlay, main.Parlay.id == main.ParlayLeg.parlay_id)
+                              .where(main.Parlay.status.in_(["open", "pending"]))).all()
+        tickets = {}
+        for leg in rows:
+            if leg.game_id in finished:
+                won = main.determine_winner(leg, *finished[leg.game_id]) == "bettor"
+                tickets[leg.parlay_id] = tickets.get(leg.parlay_id, True) and won
+        return tickets
+
+    # An untaken ticket whose games are under way can't be covered any more
+    late = next(p for p in parlays if p["status"] == "open")
+    with main.engine.begin() as conn:
+        conn.execute(update(main.ParlayLeg).where(main.ParlayLeg.parlay_id == late["id"])
+                     .values(commence_time=datetime.utcnow() - timedelta(hours=2)))
+    with main.SessionLocal() as db:
+        try:
+            main._take_parlay(db, main.TakeParlay(parlay_id=late["id"]), main.fetch_principal(db, late["bettor_id"] % args.users + 1))
+            late_take = "Parlay taken"
+        except main.HTTPException as e:
+            late_take = e.detail
+
+    rescans = timed(lambda: full_rescan({g: scores[g] for g in game_ids[:1]}), 3)
+    user_writes = count_user_writes(main)
+    per_game = []
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for game_id in game_ids:
+            game_started = time.perf_counter()
+            main.settle_game(game_id, *scores[game_id], sport="NBA")
+            per_game.append((time.perf_counter() - game_started) * 1000)
+    elapsed = time.perf_counter() - started
+    print(f"{'re-evaluate every ticket':26s} {statistics.mean(rescans):9.1f} ms per finished game, reads only "
+          f"(~{statistics.mean(rescans) * args.games / 1000:.1f}s for the slate)")
+    print(f"{'leg index + short-circuit':26s} {statistics.mean(per_game):9.1f} ms per finished game, settling "
+          f"({elapsed:.1f}s for the slate, {len(parlays) / elapsed:.0f} parlays/s)  {summary(per_game)}")
+
+    with main.engine.connect() as conn:
+        outcomes = {id: (status, winner) for id, status, winner in conn.execute(text("SELECT id, status, winner FROM parlays"))}
+        leg_counts = dict(conn.execute(text("SELECT status, count(*) FROM parlay_legs GROUP BY status")).all())
+        paid = conn.execute(text("SELECT count(*), count(DISTINCT ref_id), coalesce(sum(amount), 0) FROM ledger_entries "
+                                 "WHERE kind = 'parlay_payout'")).one()
+        refunds = conn.execute(text("SELECT count(*) FROM ledger_entries WHERE kind = 'parlay_refund'")).scalar()
+    decided_legs = leg_counts.get("won", 0) + leg_counts.get("lost", 0)
+    settled = [p for p in parlays if expected[p["id"]][0] == "settled"]
+    print(f"  legs decided {decided_legs} of {len(legs)}, {leg_counts.get('void', 0)} voided without being read; "
+          f"{sum(1 for o in outcomes.values() if o == ('settled', 'bettor'))} tickets won, "
+          f"{sum(1 for o in outcomes.values() if o == ('settled', 'bookie'))} lost, {refunds} voided")
+    check = Checks()
+    check("a parlay can't be taken once its games have started", late_take == "Game has already started")
+    check("every ticket decided as a full re-evaluation would", outcomes == expected)
+    check("a ticket stops being evaluated at its first losing leg", decided_legs == expected_legs)
+    check("no pending legs left", leg_counts.get("pending", 0) == 0)
+    check("each settled ticket paid once, the whole pot", paid[0] == paid[1] == len(settled)
+          and abs(paid[2] - sum(p["payout"] for p in settled)) < 0.01)
+    check("untaken tickets refunded", refunds == len(parlays) - len(settled))
+    check("ledger reconciles", not main.ledger.reconcile()["overdrawn"])
+    check("settlement never writes users rows", user_writes["updates"] == 0)
+    check.exit()
+
+BENCHMARKS = {
+    "odds": bench_odds,
+    "indexes": bench_indexes,
+    "take": bench_take,
+    "book": bench_book,
+    "groups": bench_groups,
+    "auth": bench_auth,
+    "db": bench_db,
+    "ledger": bench_ledger,
+    "jobs": bench_jobs,
+    "events": bench_events,
+    "scores": bench_scores,
+    "bulk": bench_bulk,
+    "history": bench_history,
+    "serialize": bench_serialize,
+    "static": bench_static,
+    "lifecycle": bench_lifecycle,
+    "metrics": bench_metrics,
+    "reads": bench_reads,
+    "parlays": bench_parlays,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BookieVerse benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--database-url", help="scratch database to use instead of a temporary SQLite file")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--bets", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=50000, help="open lines/props to seed")
+    parser.add_argument("--groups", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--takers", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4, help="worker processes")
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--sports", type=int, default=20, help="odds: sport feeds fetched at once")
+    parser.add_argument("--parlays", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=100, help="items per bulk request")
+    parser.add_argument("--concurrency", type=int, default=64, help="worker threads / in-flight requests")
+    parser.add_argument("--rounds", type=int, default=5, help="lifecycle: cohorts of games kicked off and settled under load")
+    parser.add_argument("--output", help="lifecycle: write the results as JSON here")
+    parser.add_argument("--baseline", help="lifecycle: results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="lifecycle: relative change that counts as a regression")
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    BENCHMARKS[args.benchmark](args)
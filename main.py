@@ -1,45 +1,247 @@
 # main.py - BookieVerse with PostgreSQL - ALL FEATURES
 
-from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi import FastAPI, HTTPException, Request, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, StreamingResponse, ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List, Union
 import hashlib
+import hmac
+import secrets
+import gzip
 import jwt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import uvicorn
 import os
 import stripe
-import requests
+import httpx
+import asyncio
+import threading
+import time
+import socket
+import sys
+import uuid
+import contextvars
+import fcntl
+from contextlib import contextmanager
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left, insort
 from apscheduler.schedulers.background import BackgroundScheduler
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, Text
+from sqlalchemy import create_engine, make_url, Column, Integer, String, Float, Boolean, DateTime, Text, Index, select, update, bindparam, inspect, text, func, case, or_, and_, exists, literal, union_all
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import Row
+from sqlalchemy import exc as sa_exc
 import json
+import orjson
+try:
+    import brotli  # optional: static pages are also served brotli-compressed when it's installed
+except ImportError:
+    brotli = None
+try:
+    import redis  # optional: READ_CACHE_URL shares cached public reads between workers
+except ImportError:
+    redis = None
+import csv
+import io
 
-app = FastAPI(title="BookieVerse Complete")
+ROW_KEYS = {}  # result metadata -> column names; Row._fields rebuilds the tuple on every access
 
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+def encode_default(value):
+    """orjson fallback: rows from column-projected queries encode as objects keyed by column"""
+    if isinstance(value, Row):
+        keys = ROW_KEYS.get(value._parent)
+        if keys is None:
+            if len(ROW_KEYS) > 1000:
+                ROW_KEYS.clear()
+            keys = ROW_KEYS[value._parent] = value._fields
+        return dict(zip(keys, value))
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+class APIResponse(ORJSONResponse):
+    """JSON encoded by orjson, taking SQLAlchemy rows straight from the database.
+
+    List endpoints return this directly, which skips FastAPI's
+    jsonable_encoder pass over every row; their response_model only
+    documents the shape.
+    """
+    def render(self, content):
+        return orjson.dumps(content, default=encode_default, option=orjson.OPT_NON_STR_KEYS)
+
+app = FastAPI(title="BookieVerse Complete", default_response_class=APIResponse)
+
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
+                   expose_headers=["X-Next-Cursor"])
 
 SECRET_KEY = os.getenv("SECRET_KEY", "bookieverse-secret")
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./bookieverse.db")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+ASYNC_DB = os.getenv("ASYNC_DB", "").lower() in ("1", "true", "yes")  # run request queries on the asyncio engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))  # seconds a request waits for a free connection
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")  # read replica for anonymous public listings; the primary when unset
+if DATABASE_READ_URL.startswith("postgres://"):
+    DATABASE_READ_URL = DATABASE_READ_URL.replace("postgres://", "postgresql://", 1)
+READ_REPLICA_RETRY = int(os.getenv("READ_REPLICA_RETRY", 30))  # seconds reads stay on the primary after the replica fails
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", 1))  # seconds a cached public listing is served; 0 disables
+READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", 2000))  # cached responses kept per process
+READ_CACHE_URL = os.getenv("READ_CACHE_URL", "")  # redis:// URL sharing cached listings between workers (needs redis)
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
 ODDS_API_KEY = os.getenv("ODDS_API_KEY", "")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "")  # lets the admin panel post player stats; disabled when unset
+SETTLE_BATCH_SIZE = int(os.getenv("SETTLE_BATCH_SIZE", 500))  # bets settled per transaction
+EVENT_HISTORY = int(os.getenv("EVENT_HISTORY", 10000))  # events kept for streams resuming from a sequence number
+EVENT_POLL_INTERVAL = float(os.getenv("EVENT_POLL_INTERVAL", 0.25))  # seconds before events published by other processes reach this one's streams
+EVENT_GAP_WAIT = 2  # seconds to wait for an event id below the newest one to commit before skipping it
+EVENT_BATCH = 1000  # events read from the events table per poll
+EVENT_KEEPALIVE = 15  # seconds between keepalive comments on idle streams
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))  # cached user principals
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", 60))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 0))  # dump a sampled profile of requests slower than this; 0 = off
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))  # stack sampling interval while profiling
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")  # where slow-request profiles are written, as folded stacks
+PROFILE_COOLDOWN = int(os.getenv("PROFILE_COOLDOWN", 60))  # seconds between dumps for the same route
+# scrypt cost; hashes made with older settings are upgraded on the next login
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", 2 ** 14))
+PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", 8))
+PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", 1))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 4))
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE", 100000))  # hot balances kept in memory
+BALANCE_CACHE_TTL = int(os.getenv("BALANCE_CACHE_TTL", 30))
+LEDGER_SNAPSHOT_INTERVAL = int(os.getenv("LEDGER_SNAPSHOT_INTERVAL", 60))  # fold ledger tails into snapshots this often
+LEDGER_SNAPSHOT_LAG = int(os.getenv("LEDGER_SNAPSHOT_LAG", 60))  # only fold entries older than this, so no transaction is still writing below the fold
+LEDGER_SNAPSHOT_BATCH = 1000  # accounts per snapshot/reconcile transaction
+LEDGER_RECONCILE_INTERVAL = int(os.getenv("LEDGER_RECONCILE_INTERVAL", 3600))
+LEADER_LEASE_TTL = int(os.getenv("LEADER_LEASE_TTL", 30))  # seconds a scheduler leader holds its lease without renewing
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))  # background job threads per process
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 2))  # seconds an idle job worker waits before polling again
+JOB_LEASE = int(os.getenv("JOB_LEASE", 600))  # seconds before a claimed job whose worker died is handed out again
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+LEADERBOARD_RELOAD = int(os.getenv("LEADERBOARD_RELOAD", 60))  # reload in-memory boards this often to pick up other workers
+LEADERBOARD_KEEP_DAYS = int(os.getenv("LEADERBOARD_KEEP_DAYS", 7))  # past daily boards kept before pruning
+LEADERBOARD_KEEP_WEEKS = int(os.getenv("LEADERBOARD_KEEP_WEEKS", 4))  # past weekly boards kept before pruning
+LEADERBOARD_PRUNE_INTERVAL = int(os.getenv("LEADERBOARD_PRUNE_INTERVAL", 3600))
+GAME_CACHE_TTL = int(os.getenv("GAME_CACHE_TTL", 60))  # seconds a fetched game feed stays fresh
+GAME_CACHE_REFRESH = int(os.getenv("GAME_CACHE_REFRESH", 45))  # background refresh interval
+GAME_CACHE_RETRY = int(os.getenv("GAME_CACHE_RETRY", 15))  # how long to serve stale data after an upstream error
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", 1024))  # API responses at least this big are gzipped for clients that accept it
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+ODDS_API_BASE = os.getenv("ODDS_API_BASE", "https://api.the-odds-api.com/v4")
+ODDS_TIMEOUT = float(os.getenv("ODDS_TIMEOUT", 10))  # per-request timeout, each sport is fetched independently
+ODDS_RETRIES = int(os.getenv("ODDS_RETRIES", 2))
+ODDS_MAX_CONNECTIONS = int(os.getenv("ODDS_MAX_CONNECTIONS", 20))
+SCORE_POLL_TICK = int(os.getenv("SCORE_POLL_TICK", 30))  # how often the leader decides which sports' scores are due
+SCORE_POLL_FAST = int(os.getenv("SCORE_POLL_FAST", 60))  # poll interval for a sport with a game due to finish
+SCORE_POLL_SLOW = int(os.getenv("SCORE_POLL_SLOW", 300))  # ...with games in progress, running long, or of unknown start
+SCORE_FINISH_WINDOW = 20  # minutes before a game's expected finish to start polling fast
+SCORE_OVERDUE = 60  # minutes past expected finish (delayed, suspended) before falling back to slow polling
+SCORE_INDEX_REBUILD = 3600  # seconds between full rebuilds of the pending-games index
+GAME_DURATIONS = {"NBA": 150, "NFL": 195, "NHL": 150, "MLB": 180}  # minutes from commence to final, roughly
+# Odds API sport keys to track, as "sport_key:LABEL" pairs
+SPORTS = dict(pair.strip().split(":") for pair in
+              os.getenv("ODDS_SPORTS", "basketball_nba:NBA,americanfootball_nfl:NFL").split(",") if pair.strip())
 if STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
 
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+MAX_BATCH = 500  # lines or props per bulk create request
+MAX_PARLAY_LEGS = 10
+EXPORT_BATCH = MAX_PAGE_SIZE  # rows per query while streaming an export
+STARTING_BALANCE = 1000.0
+
 PROP_TYPES = {
     "NBA": ["Points", "Rebounds", "Assists", "3-Pointers Made"],
     "NFL": ["Passing Yards", "Rushing Yards", "Touchdowns"]
 }
+# Prop type -> key in the stats posted by the admin panel
+PROP_STATS = {"Points": "points", "Rebounds": "rebounds", "Assists": "assists", "3-Pointers Made": "threes",
+              "Passing Yards": "passing_yards", "Rushing Yards": "rushing_yards", "Touchdowns": "touchdowns"}
 
 # Database
-engine = create_engine(DATABASE_URL)
+class PoolMetrics:
+    """Connection checkouts, time spent waiting for a free connection, and pool timeouts"""
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, waited, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def stats(self, pool):
+        with self._lock:
+            return {"size": pool.size(), "checked_out": pool.checkedout(), "overflow": pool.overflow(),
+                    "checkouts": self.checkouts, "timeouts": self.timeouts,
+                    "wait_avg_ms": round(self.wait_total * 1000 / max(self.checkouts, 1), 3),
+                    "wait_max_ms": round(self.wait_max * 1000, 3)}
+
+def metered_pool(pool_class, metrics):
+    """Subclass of pool_class that records every checkout's wait in metrics"""
+    class MeteredPool(pool_class):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                conn = super()._do_get()
+            except sa_exc.TimeoutError:
+                metrics.record(time.perf_counter() - started, timed_out=True)
+                raise
+            metrics.record(time.perf_counter() - started)
+            return conn
+    return MeteredPool
+
+def async_url(url):
+    """url with its asyncio driver: aiosqlite for SQLite, asyncpg for Postgres"""
+    url = make_url(url)
+    return url.set(drivername="sqlite+aiosqlite" if url.get_backend_name() == "sqlite" else "postgresql+asyncpg")
+
+# SQLite serializes writers, so give contended writes time to wait for the lock
+connect_args = {"timeout": 30} if DATABASE_URL.startswith("sqlite") else {}
+pool_args = {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT,
+             "pool_pre_ping": True}
+pool_metrics = PoolMetrics()
+engine = create_engine(DATABASE_URL, connect_args=connect_args, poolclass=metered_pool(QueuePool, pool_metrics), **pool_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# With ASYNC_DB, request handlers run their queries on this engine instead (see run_db); the
+# scheduler, settlement and migrations always use the sync engine
+async_pool_metrics = PoolMetrics()
+async_engine = AsyncSessionLocal = None
+if ASYNC_DB:
+    async_engine = create_async_engine(async_url(DATABASE_URL), connect_args=connect_args,
+                                       poolclass=metered_pool(AsyncAdaptedQueuePool, async_pool_metrics), **pool_args)
+    # Same Session class as SessionLocal so its commit hooks (leaderboards, auth cache) still fire
+    AsyncSessionLocal = async_sessionmaker(async_engine, sync_session_class=SessionLocal.class_, autoflush=False)
+# With DATABASE_READ_URL, anonymous public listings read from the replica (see ReadReplica). Its
+# sessions are marked in info so caches shared with the primary's readers aren't filled from it.
+read_pool_metrics = PoolMetrics()
+read_engine = ReadSessionLocal = async_read_engine = AsyncReadSessionLocal = None
+if DATABASE_READ_URL:
+    read_connect_args = {"timeout": 30} if DATABASE_READ_URL.startswith("sqlite") else {}
+    read_engine = create_engine(DATABASE_READ_URL, connect_args=read_connect_args,
+                                poolclass=metered_pool(QueuePool, read_pool_metrics), **pool_args)
+    ReadSessionLocal = sessionmaker(bind=read_engine, autoflush=False, info={"replica": True})
+    if ASYNC_DB:
+        async_read_engine = create_async_engine(async_url(DATABASE_READ_URL), connect_args=read_connect_args,
+                                                poolclass=metered_pool(AsyncAdaptedQueuePool, read_pool_metrics), **pool_args)
+        AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, info={"replica": True})
 Base = declarative_base()
 
 class User(Base):
@@ -47,7 +249,8 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     username = Column(String, unique=True, index=True)
     password = Column(String)
-    balance = Column(Float, default=1000.0)
+    balance = Column(Float, default=STARTING_BALANCE)  # legacy, seeds the opening ledger entry; balances live in the ledger
+    # Legacy, seed the all-time leaderboard; stats are read from leaderboard_entries and lines_created is counted
     profit = Column(Float, default=0.0)
     wins = Column(Integer, default=0)
     losses = Column(Integer, default=0)
@@ -63,18 +266,26 @@ class Line(Base):
     game_id = Column(String)
     game = Column(String)
     sport = Column(String)
+    commence_time = Column(DateTime, nullable=True)  # from the game feed, drives score polling
     type = Column(String)
     side = Column(String)
     value = Column(Float)
     amount = Column(Float)
     status = Column(String, default="open")
     current_bettors = Column(Integer, default=0)
+    total_action = Column(Float, default=0.0)
     max_bettors = Column(Integer, nullable=True)
     max_bet_per_user = Column(Float, nullable=True)
     max_total_action = Column(Float, nullable=True)
     is_private = Column(Boolean, default=False)
     group_id = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_lines_status_id", "status", "id"),  # open book listing
+        Index("ix_lines_status_sport_id", "status", "sport", "id"),
+        Index("ix_lines_game_id", "game_id"),
+        Index("ix_lines_bookie_id", "bookie_id"),  # lines_created
+    )
 
 class Bet(Base):
     __tablename__ = "bets"
@@ -84,7 +295,9 @@ class Bet(Base):
     bookie_name = Column(String)
     bettor_id = Column(Integer)
     bettor_name = Column(String)
+    game_id = Column(String)  # copied from the line so settlement doesn't need a join
     game = Column(String)
+    commence_time = Column(DateTime, nullable=True)
     type = Column(String)
     bookie_side = Column(String)
     bettor_side = Column(String)
@@ -93,6 +306,11 @@ class Bet(Base):
     status = Column(String, default="pending")
     winner = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_bets_game_status", "game_id", "status"),  # settlement
+        Index("ix_bets_bookie_id", "bookie_id", "id"),  # bet history
+        Index("ix_bets_bettor_id", "bettor_id", "id"),
+    )
 
 class Prop(Base):
     __tablename__ = "props"
@@ -107,6 +325,11 @@ class Prop(Base):
     amount = Column(Float)
     status = Column(String, default="open")
     created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_props_status_id", "status", "id"),
+        Index("ix_props_status_sport_id", "status", "sport", "id"),
+        Index("ix_props_bookie_id", "bookie_id"),  # lines_created
+    )
 
 class PropBet(Base):
     __tablename__ = "prop_bets"
@@ -125,6 +348,57 @@ class PropBet(Base):
     status = Column(String, default="pending")
     winner = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_prop_bets_player_status", "player_name", "status"),  # settlement
+        Index("ix_prop_bets_bookie_id", "bookie_id", "id"),
+        Index("ix_prop_bets_bettor_id", "bettor_id", "id"),
+    )
+
+class Parlay(Base):
+    """A multi-leg ticket: the bettor's stake wins the pot only if every leg wins; a bookie covers it at even odds per leg"""
+    __tablename__ = "parlays"
+    id = Column(Integer, primary_key=True)
+    bettor_id = Column(Integer)
+    bettor_name = Column(String)
+    bookie_id = Column(Integer, nullable=True)  # whoever took it
+    bookie_name = Column(String, nullable=True)
+    amount = Column(Float)  # the bettor's stake; the bookie covers payout - amount
+    payout = Column(Float)  # the pot: amount * 2 ** leg_count
+    leg_count = Column(Integer)
+    legs_pending = Column(Integer)  # legs not yet won; settlement counts it down and pays the bettor at 0
+    status = Column(String, default="open")  # open, pending (taken), settled, void
+    winner = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_parlays_status_id", "status", "id"),  # open parlay listing
+        Index("ix_parlays_bookie_id", "bookie_id", "id"),  # bet history
+        Index("ix_parlays_bettor_id", "bettor_id", "id"),
+    )
+
+class ParlayLeg(Base):
+    """One leg of a parlay: the bettor's side of a line or prop, its terms copied so settlement needs no joins"""
+    __tablename__ = "parlay_legs"
+    id = Column(Integer, primary_key=True)
+    parlay_id = Column(Integer)
+    line_id = Column(Integer, nullable=True)
+    prop_id = Column(Integer, nullable=True)
+    sport = Column(String)
+    game_id = Column(String, nullable=True)  # line legs
+    game = Column(String, nullable=True)
+    commence_time = Column(DateTime, nullable=True)
+    type = Column(String, nullable=True)
+    value = Column(Float, nullable=True)
+    player_name = Column(String, nullable=True)  # prop legs
+    prop_type = Column(String, nullable=True)
+    line = Column(Float, nullable=True)
+    bookie_side = Column(String)
+    bettor_side = Column(String)
+    status = Column(String, default="pending")  # pending, won, lost, void (its parlay was decided without it)
+    __table_args__ = (
+        Index("ix_parlay_legs_game_status", "game_id", "status"),  # settlement: a finished game's pending legs
+        Index("ix_parlay_legs_player_status", "player_name", "status"),
+        Index("ix_parlay_legs_parlay_id", "parlay_id"),
+    )
 
 class Group(Base):
     __tablename__ = "groups"
@@ -133,18 +407,659 @@ class Group(Base):
     description = Column(Text, nullable=True)
     creator_id = Column(Integer)
     creator_name = Column(String)
-    members = Column(Text, default="[]")
+    members = Column(Text, default="[]")  # legacy JSON member list, superseded by group_members
+    invite_code = Column(String)  # joining needs this; only the creator sees it
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class LeaderboardEntry(Base):
+    """Materialized per-window, per-sport profit totals maintained by settlement"""
+    __tablename__ = "leaderboard_entries"
+    id = Column(Integer, primary_key=True)
+    board = Column(String)  # "all", "day:2026-02-14" or "week:2026-W07"
+    sport = Column(String)  # a sport label or "ALL"
+    user_id = Column(Integer)
+    profit = Column(Float, default=0.0)
+    wins = Column(Integer, default=0)
+    losses = Column(Integer, default=0)
+    __table_args__ = (
+        Index("ix_leaderboard_board_user", "board", "sport", "user_id", unique=True),
+        Index("ix_leaderboard_board_profit", "board", "sport", "profit"),
+    )
+
+class LedgerEntry(Base):
+    """Append-only balance movements: escrow debits for lines, props and takes, payout credits from settlement"""
+    __tablename__ = "ledger_entries"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    amount = Column(Float, nullable=False)  # credits positive, debits negative
+    kind = Column(String, nullable=False)  # opening, line, line_refund, prop, prop_refund, take, prop_take, payout, prop_payout, parlay, parlay_take, parlay_payout, parlay_refund
+    ref_id = Column(Integer)  # the line, prop, bet, prop bet or parlay the entry is for
     created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (Index("ix_ledger_entries_user_id", "user_id", "id"),)  # balance tails, a user's statement
 
-Base.metadata.create_all(bind=engine)
+class BalanceSnapshot(Base):
+    """A user's balance as of ledger entry entry_id; their balance is this plus their later entries"""
+    __tablename__ = "balance_snapshots"
+    user_id = Column(Integer, primary_key=True)
+    balance = Column(Float, nullable=False, default=0.0)
+    entry_id = Column(Integer, nullable=False, default=0)
+    taken_at = Column(DateTime, default=datetime.utcnow)
 
-def get_db():
-    db = SessionLocal()
+class SchemaMarker(Base):
+    """One-time data migrations that have already run"""
+    __tablename__ = "schema_markers"
+    name = Column(String, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+class SchedulerLease(Base):
+    """Leader lease: only the process holding an unexpired lease runs the periodic jobs"""
+    __tablename__ = "scheduler_leases"
+    name = Column(String, primary_key=True)
+    holder = Column(String)
+    expires_at = Column(DateTime)
+
+class Job(Base):
+    """Durable background job; key makes enqueueing idempotent"""
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    key = Column(String, nullable=False, unique=True)
+    payload = Column(Text, default="{}")  # JSON keyword arguments for the handler
+    status = Column(String, default="queued")  # queued, running, done, failed
+    attempts = Column(Integer, default=0)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    locked_by = Column(String)
+    locked_until = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)
+
+class StreamEvent(Base):
+    """Published order book events; the id is the sequence number streams resume from"""
+    __tablename__ = "events"
+    id = Column(Integer, primary_key=True)
+    type = Column(String, nullable=False)
+    sport = Column(String)
+    group_id = Column(Integer)
+    users = Column(Text)  # JSON list of the only user ids who may see it
+    data = Column(Text, nullable=False)  # JSON payload, sent to streams as is
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class GroupMember(Base):
+    __tablename__ = "group_members"
+    id = Column(Integer, primary_key=True)
+    group_id = Column(Integer)
+    user_id = Column(Integer)
+    joined_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_group_members_group_user", "group_id", "user_id", unique=True),
+        Index("ix_group_members_user_group", "user_id", "group_id"),  # a user's groups, private line visibility
+    )
+
+def new_invite_code():
+    return secrets.token_urlsafe(12)
+
+def migrate_schema():
+    """Bring an existing database up to the models: add missing columns, backfill them, create missing indexes"""
+    inspector = inspect(engine)
+    added = set()
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    ddl += f" DEFAULT {column.default.arg!r}"
+                conn.execute(text(ddl))
+                added.add((table.name, column.name))
+        if ("bets", "game_id") in added:
+            conn.execute(text("UPDATE bets SET game_id = (SELECT lines.game_id FROM lines WHERE lines.id = bets.line_id)"))
+        if ("bets", "commence_time") in added:
+            conn.execute(text("UPDATE bets SET commence_time = (SELECT lines.commence_time FROM lines WHERE lines.id = bets.line_id)"))
+        if ("groups", "invite_code") in added:
+            ids = conn.execute(select(Group.id)).scalars().all()
+            if ids:
+                conn.execute(Group.__table__.update().where(Group.id == bindparam("group_id")).values(invite_code=bindparam("code")),
+                             [{"group_id": group_id, "code": new_invite_code()} for group_id in ids])
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        # Move the legacy JSON member lists into group_members once; a database that already has
+        # memberships was migrated before the marker existed, and copying again would re-add leavers
+        if not conn.execute(select(SchemaMarker.name).where(SchemaMarker.name == "group_members_from_json")).first():
+            if not conn.execute(select(GroupMember.id).limit(1)).first():
+                rows = [{"group_id": group_id, "user_id": user_id}
+                        for group_id, members in conn.execute(select(Group.id, Group.members))
+                        for user_id in set(json.loads(members or "[]"))]
+                if rows:
+                    conn.execute(GroupMember.__table__.insert(), rows)
+            conn.execute(SchemaMarker.__table__.insert().values(name="group_members_from_json", applied_at=datetime.utcnow()))
+        seed_missing_stats(conn)
+        open_missing_accounts(conn)
+
+def seed_missing_stats(conn):
+    """Give every user without an all-time board entry one from their legacy users stats"""
+    entries = LeaderboardEntry.__table__
+    missing = ~exists().where(entries.c.board == "all", entries.c.sport == "ALL", entries.c.user_id == User.id)
+    conn.execute(entries.insert().from_select(
+        ["board", "sport", "user_id", "profit", "wins", "losses"],
+        select(literal("all"), literal("ALL"), User.id, func.coalesce(User.profit, 0.0),
+               func.coalesce(User.wins, 0), func.coalesce(User.losses, 0)).where(missing)))
+
+def open_missing_accounts(conn):
+    """Open a ledger account for every user without one, with their legacy users.balance as the opening entry"""
+    missing = ~exists().where(BalanceSnapshot.user_id == User.id)
+    now = datetime.utcnow()
+    conn.execute(LedgerEntry.__table__.insert().from_select(
+        ["user_id", "amount", "kind", "created_at"],
+        select(User.id, func.coalesce(User.balance, 0.0), literal("opening"), literal(now)).where(missing)))
+    conn.execute(BalanceSnapshot.__table__.insert().from_select(
+        ["user_id", "balance", "entry_id", "taken_at"], select(User.id, literal(0.0), literal(0), literal(now)).where(missing)))
+
+@contextmanager
+def schema_lock():
+    """Serialize schema setup between worker processes that start together"""
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(hashtext('bookieverse_schema'))"))
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(hashtext('bookieverse_schema'))"))
+                conn.commit()
+    elif engine.url.database and engine.url.database != ":memory:":
+        with open(engine.url.database + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+    else:
+        yield
+
+with schema_lock():
+    Base.metadata.create_all(bind=engine)
+    migrate_schema()
+
+def _in_session(fn, *args, sessions=SessionLocal):
+    db = sessions()
     try:
-        yield db
+        return fn(db, *args)
     finally:
         db.close()
 
+async def run_db(fn, *args):
+    """Run fn(db, *args) in a session of its own without blocking the event loop.
+
+    With ASYNC_DB, fn runs on the asyncio engine through run_sync, so its
+    queries are awaited and no worker thread is held while they wait;
+    otherwise it runs on the sync engine in the threadpool.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(fn, *args)
+    return await run_in_threadpool(_in_session, fn, *args)
+
+def fetch(db, query):
+    return [dict(r) for r in db.execute(query).mappings()]
+
+def db_stats():
+    return {"mode": "async" if ASYNC_DB else "sync", "sync": pool_metrics.stats(engine.pool),
+            "async": async_pool_metrics.stats(async_engine.pool) if ASYNC_DB else None,
+            "replica": read_pool_metrics.stats((async_read_engine or read_engine).pool) if read_engine else None}
+
+# Metrics
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+class Metrics:
+    """Counters, histograms and gauges, rendered in the Prometheus text format for /metrics"""
+    def __init__(self):
+        self.meta = {}  # name -> (type, help, buckets, label names, collector or None)
+        self.values = {}  # name -> {label values: count, or [bucket counts..., sum, count]}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        self.meta[name] = ("counter", help, None, labels, None)
+        self.values[name] = {}
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.meta[name] = ("histogram", help, buckets, labels, None)
+        self.values[name] = {}
+
+    def collected(self, name, help, labels, collect, kind="gauge"):
+        """A gauge (or counter kept elsewhere) read by collect() -> {label values: value} when /metrics is scraped"""
+        self.meta[name] = (kind, help, None, labels, collect)
+
+    def inc(self, name, *labels, value=1):
+        series = self.values[name]
+        with self._lock:
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, value, *labels):
+        buckets = self.meta[name][2]
+        series = self.values[name]
+        with self._lock:
+            counts = series.get(labels)
+            if counts is None:
+                counts = series[labels] = [0] * (len(buckets) + 2)
+            counts[bisect_left(buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        out = []
+        for name, (kind, help, buckets, label_names, collect) in self.meta.items():
+            out.append(f"# HELP {name} {help}")
+            out.append(f"# TYPE {name} {kind}")
+            if collect is not None:
+                try:
+                    samples = collect().items()
+                except Exception as e:
+                    print(f"Error collecting {name}: {e}")
+                    continue
+                out.extend(f"{name}{label_set(label_names, labels)} {value}" for labels, value in samples)
+                continue
+            with self._lock:
+                series = {labels: list(v) if kind == "histogram" else v for labels, v in self.values[name].items()}
+            for labels, value in sorted(series.items()):
+                if kind == "counter":
+                    out.append(f"{name}{label_set(label_names, labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), value):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    out.append(f"{name}_bucket{label_set(label_names + ('le',), labels + (le,))} {cumulative}")
+                out.append(f"{name}_sum{label_set(label_names, labels)} {value[-2]}")
+                out.append(f"{name}_count{label_set(label_names, labels)} {value[-1]}")
+        return "\n".join(out) + "\n"
+
+def label_set(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+metrics = Metrics()
+metrics.counter("http_requests_total", "Requests by route template and status", ("method", "route", "status"))
+metrics.histogram("http_request_duration_seconds", "Request latency by route template", ("method", "route"))
+metrics.histogram("http_request_sql_queries", "SQL statements run per request", ("method", "route"), COUNT_BUCKETS)
+metrics.histogram("http_request_sql_seconds", "Time per request spent executing SQL", ("method", "route"))
+metrics.histogram("sql_query_duration_seconds", "SQL statement latency by engine; _count is the statements executed", ("engine",))
+metrics.counter("odds_api_requests_total", "Odds API requests by feed, sport and outcome (HTTP status or error)",
+                ("feed", "sport", "outcome"))
+metrics.histogram("odds_api_request_duration_seconds", "Odds API request latency, retries counted separately",
+                  ("feed", "sport"))
+metrics.histogram("scheduler_job_duration_seconds", "Periodic scheduler job run time", ("job",))
+metrics.counter("scheduler_job_errors_total", "Periodic scheduler jobs that raised", ("job",))
+metrics.histogram("queue_job_duration_seconds", "Job queue handler run time", ("kind", "outcome"))
+metrics.histogram("settlement_batch_size", "Bets settled per settlement transaction", ("kind",), COUNT_BUCKETS)
+metrics.counter("profiles_written_total", "Slow-request profiles dumped to PROFILE_DIR", ("route",))
+
+# The SQL run on behalf of the current request: [statements, seconds]. Worker threads share the list
+# through the copied context, so queries run via run_db/run_in_threadpool are counted too.
+request_sql = contextvars.ContextVar("request_sql", default=None)
+
+def instrument_engine(sync_engine, label):
+    """Count and time every statement sync_engine executes, globally and against the current request"""
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.query_started
+        metrics.observe("sql_query_duration_seconds", elapsed, label)
+        stats = request_sql.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+instrument_engine(engine, "sync")
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine, "async")
+if read_engine is not None:
+    instrument_engine(async_read_engine.sync_engine if async_read_engine else read_engine, "replica")
+
+def timed_job(fn):
+    """Wrap a periodic job to record its run time and errors under its (qualified) name"""
+    name = fn.__qualname__
+    def run():
+        started = time.perf_counter()
+        try:
+            return fn()
+        except Exception:
+            metrics.inc("scheduler_job_errors_total", name)
+            raise
+        finally:
+            metrics.observe("scheduler_job_duration_seconds", time.perf_counter() - started, name)
+    run.__name__ = name
+    return run
+
+class SlowRequestProfiler:
+    """Opt-in sampling profiler for slow requests (PROFILE_SLOW_MS).
+
+    A daemon thread samples every thread's stack each PROFILE_INTERVAL_MS
+    into a short ring buffer. When a request takes longer than the
+    threshold, the busy samples taken while it ran are written to
+    PROFILE_DIR as folded stacks (flamegraph.pl / speedscope input), at most
+    once per route per PROFILE_COOLDOWN. Concurrent requests share threads,
+    so a dump shows everything the process did during the slow request.
+    """
+    IDLE = {("threading.py", "wait"), ("selectors.py", "select"), ("socket.py", "accept"), ("queue.py", "get")}
+
+    def __init__(self, threshold_ms=PROFILE_SLOW_MS, interval_ms=PROFILE_INTERVAL_MS, directory=PROFILE_DIR):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self.samples = deque(maxlen=max(1, int(60 / self.interval)))  # (when, [stacks]) for the last minute
+        self.labels = {}  # code object -> frame label
+        self.last_dump = {}  # route -> when its last profile was written
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def start(self):
+        with self._lock:
+            if self.enabled and self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+                self._thread.start()
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _sample(self):
+        me = threading.get_ident()
+        while True:
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                code = frame.f_code
+                if thread_id == me or (os.path.basename(code.co_filename), code.co_name) in self.IDLE:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(stack)))
+            self.samples.append((time.perf_counter(), stacks))
+            time.sleep(self.interval)
+
+    def finished(self, method, route, started, elapsed):
+        """Dump a profile if the request that ran from started for elapsed seconds was slow"""
+        if elapsed < self.threshold or time.monotonic() - self.last_dump.get(route, -PROFILE_COOLDOWN) < PROFILE_COOLDOWN:
+            return None
+        self.last_dump[route] = time.monotonic()
+        counts = {}
+        for when, stacks in list(self.samples):
+            if started <= when <= started + elapsed:
+                for stack in stacks:
+                    counts[stack] = counts.get(stack, 0) + 1
+        if not counts:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{method}-{route.strip('/').replace('/', '_') or 'root'}-{elapsed * 1000:.0f}ms.folded"
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+        metrics.inc("profiles_written_total", route)
+        return path
+
+profiler = SlowRequestProfiler()
+
+class MetricsMiddleware:
+    """Records each request's latency, status and SQL under its route template, and hands slow ones to the profiler"""
+    STREAMS = {"/api/stream"}  # open for as long as the client listens, so their latency means nothing
+
+    def __init__(self, app):
+        self.app = app
+        profiler.start()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.STREAMS:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        sql = [0, 0.0]
+        token = request_sql.set(sql)
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_sql.reset(token)
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"  # raw paths would be unbounded label values
+            method = scope["method"]
+            metrics.inc("http_requests_total", method, route, str(status))
+            metrics.observe("http_request_duration_seconds", elapsed, method, route)
+            metrics.observe("http_request_sql_queries", sql[0], method, route)
+            metrics.observe("http_request_sql_seconds", sql[1], method, route)
+            if profiler.enabled and elapsed >= profiler.threshold:
+                await run_in_threadpool(profiler.finished, method, route, started, elapsed)
+
+# Public reads
+class ReadReplica:
+    """Runs anonymous public reads on DATABASE_READ_URL.
+
+    When the replica can't be reached, the read is retried on the primary
+    and reads stay there for READ_REPLICA_RETRY seconds, so a dead replica
+    doesn't cost every request a connection timeout. Without a replica
+    this is just run_db.
+    """
+    FAILURES = (sa_exc.OperationalError, sa_exc.InterfaceError, sa_exc.TimeoutError, OSError)
+
+    def __init__(self, retry=READ_REPLICA_RETRY):
+        self.retry = retry
+        self.down_until = 0.0
+        self.reads = 0
+        self.fallbacks = 0
+        self.last_error = None
+
+    async def run(self, fn, *args):
+        if ReadSessionLocal is None or time.monotonic() < self.down_until:
+            return await run_db(fn, *args)
+        try:
+            if AsyncReadSessionLocal is not None:
+                async with AsyncReadSessionLocal() as db:
+                    result = await db.run_sync(fn, *args)
+            else:
+                result = await run_in_threadpool(_in_session, fn, *args, sessions=ReadSessionLocal)
+        except self.FAILURES as e:
+            self.fallbacks += 1
+            self.last_error = type(e).__name__
+            self.down_until = time.monotonic() + self.retry
+            print(f"Read replica unavailable ({self.last_error}), reading from the primary for {self.retry}s")
+            return await run_db(fn, *args)
+        self.reads += 1
+        return result
+
+    def stats(self):
+        return {"configured": ReadSessionLocal is not None, "reads": self.reads, "fallbacks": self.fallbacks,
+                "last_error": self.last_error, "on_primary_for": round(max(0.0, self.down_until - time.monotonic()), 1)}
+
+read_replica = ReadReplica()
+
+class MemoryCacheBackend:
+    """In-process stand-in for the shared cache backend (get/set/incr), e.g. for tests"""
+    def __init__(self):
+        self.values = {}  # key -> (expires_at or None, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= time.monotonic()):
+                return None
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self.values[key] = (time.monotonic() + ttl, value)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self.values.get(key, (None, 0))[1]) + 1
+            self.values[key] = (None, value)
+            return value
+
+class RedisCacheBackend:
+    """READ_CACHE_URL: the shared cache backend on Redis"""
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, socket_timeout=0.1, socket_connect_timeout=0.1)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+class ReadCache:
+    """Short-TTL cache of rendered public listings, per namespace ("lines", "props", ...).
+
+    Writes call invalidate_reads_after_commit, which bumps the namespace's
+    generation once they commit, so this process never serves a listing
+    older than its own last write. Concurrent misses for the same key and
+    generation share one load. With a shared backend, misses check it before loading and
+    invalidations bump the generation there too; other processes may keep
+    serving their local copy for up to the TTL.
+    """
+    PREFIX = "bookieverse:read:"
+
+    def __init__(self, ttl=READ_CACHE_TTL, maxsize=READ_CACHE_SIZE, shared=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.shared = shared
+        self.entries = OrderedDict()  # (namespace, key) -> (expires_at, generation, (body, headers))
+        self.generations = {}  # namespace -> generation
+        self.loading = {}  # (namespace, key, generation) -> future of the load in flight
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.shared_errors = 0
+        self._lock = threading.Lock()
+
+    async def response(self, namespace, key, load, render=APIResponse):
+        """The cached listing for (namespace, key), or render(await load()) cached for next time"""
+        if self.ttl <= 0:
+            return render(await load())
+        entry_key = (namespace, key)
+        with self._lock:
+            generation = self.generations.get(namespace, 0)
+            entry = self.entries.get(entry_key)
+            if entry is not None and entry[0] > time.monotonic() and entry[1] == generation:
+                self.entries.move_to_end(entry_key)
+                self.hits += 1
+                return self._response(entry[2], "hit")
+        # A load started before a write may have read the old rows, so only join one of this generation
+        load_key = (namespace, key, generation)
+        in_flight = self.loading.get(load_key)
+        if in_flight is not None:
+            self.hits += 1
+            return self._response(await asyncio.shield(in_flight), "hit")
+        future = self.loading[load_key] = asyncio.get_running_loop().create_future()
+        try:
+            payload = shared_key = None
+            if self.shared is not None:
+                shared_key, payload = await run_in_threadpool(self._shared_get, namespace, key)
+            if payload is None:
+                self.misses += 1
+                response = render(await load())
+                payload = (bytes(response.body), {k: v for k, v in response.headers.items()
+                                                  if k.lower() not in ("content-length", "content-type")} or None)
+                if shared_key is not None:
+                    await run_in_threadpool(self._shared_set, shared_key, payload)
+            else:
+                self.shared_hits += 1
+            self._store(entry_key, generation, payload)
+            future.set_result(payload)
+            return self._response(payload, "miss")
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved, so an unawaited failure isn't logged
+            raise
+        finally:
+            del self.loading[load_key]
+
+    @staticmethod
+    def _response(payload, status):
+        body, headers = payload
+        return Response(body, media_type=APIResponse.media_type, headers={**(headers or {}), "X-Cache": status})
+
+    def _store(self, entry_key, generation, payload):
+        with self._lock:
+            # A write that committed while this was loading has already moved the generation on
+            if self.generations.get(entry_key[0], 0) != generation:
+                return
+            self.entries[entry_key] = (time.monotonic() + self.ttl, generation, payload)
+            self.entries.move_to_end(entry_key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def _shared_get(self, namespace, key):
+        """(versioned key, payload or None) from the shared backend; (None, None) when it's unavailable"""
+        try:
+            generation = int(self.shared.get(f"{self.PREFIX}gen:{namespace}") or 0)
+            shared_key = f"{self.PREFIX}{namespace}:{generation}:{key!r}"
+            value = self.shared.get(shared_key)
+        except Exception as e:
+            self.shared_errors += 1
+            print(f"Shared read cache unavailable: {e}")
+            return None, None
+        if value is None:
+            return shared_key, None
+        headers, _, body = value.partition(b"\n")
+        return shared_key, (body, orjson.loads(headers))
+
+    def _shared_set(self, shared_key, payload):
+        body, headers = payload
+        try:
+            self.shared.set(shared_key, orjson.dumps(headers) + b"\n" + body, self.ttl)
+        except Exception as e:
+            self.shared_errors += 1
+            print(f"Shared read cache unavailable: {e}")
+
+    def invalidate(self, namespaces):
+        with self._lock:
+            for namespace in namespaces:
+                self.generations[namespace] = self.generations.get(namespace, 0) + 1
+        if self.shared is not None:
+            for namespace in namespaces:
+                try:
+                    self.shared.incr(f"{self.PREFIX}gen:{namespace}")
+                except Exception as e:
+                    self.shared_errors += 1
+                    print(f"Shared read cache unavailable: {e}")
+
+    def stats(self):
+        return {"ttl": self.ttl, "entries": len(self.entries), "hits": self.hits, "shared_hits": self.shared_hits,
+                "misses": self.misses, "shared": type(self.shared).__name__ if self.shared else None,
+                "shared_errors": self.shared_errors}
+
+if READ_CACHE_URL and redis is None:
+    print("READ_CACHE_URL is set but redis isn't installed; caching public reads per process only")
+read_cache = ReadCache(shared=RedisCacheBackend(READ_CACHE_URL) if READ_CACHE_URL and redis is not None else None)
+
+def invalidate_reads_after_commit(db, *namespaces):
+    """Drop cached public listings in namespaces once db's transaction commits"""
+    db.info.setdefault("read_invalidate", set()).update(namespaces)
+
 GAMES = [
     {"id": "demo_1", "home": "Lakers", "away": "Warriors", "sport": "NBA", "date": "2026-02-14"},
     {"id": "demo_2", "home": "Celtics", "away": "Heat", "sport": "NBA", "date": "2026-02-14"},
@@ -156,90 +1071,547 @@ FUTURES = [
     {"id": "f2", "market_name": "Super Bowl", "sport": "NFL", "options": ["Chiefs", "Bills", "49ers"]},
 ]
 
+# Live events
+class EventBus:
+    """Pub/sub for order book events, shared by every process through the events table.
+
+    publish() is thread-safe and only queues the event in an outbox, so it
+    can be called after commit from request handlers and jobs. A relay
+    thread per process writes the outbox to the events table, whose ids are
+    the sequence numbers streams resume from, and hands every new row, from
+    whichever process published it, to this process's subscribers (asyncio
+    queues on the server's event loop). A local publish wakes the relay at
+    once; other processes' events arrive within EVENT_POLL_INTERVAL. The
+    leader keeps the last EVENT_HISTORY events for replay.
+    """
+    LAGGED = object()  # sent to a subscriber whose queue overflowed
+
+    def __init__(self, history=EVENT_HISTORY, queue_size=1000, poll_interval=EVENT_POLL_INTERVAL):
+        self.history = history
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.seq = 0  # id of the last event handed to subscribers here
+        self.outbox = []
+        self.subscribers = {}  # queue -> loop
+        self.gap_since = None  # when the relay first waited on an id that hasn't committed
+        self.relayed = 0
+        self.gaps = 0  # ids skipped after EVENT_GAP_WAIT
+        self.errors = 0
+        self.thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def publish(self, type, data, sport=None, group_id=None, users=None):
+        """Publish an event; group_id limits it to that group's members and users to those user ids"""
+        row = {"type": type, "sport": sport, "group_id": group_id, "users": json.dumps(users) if users is not None else None,
+               "data": json.dumps(data, default=str), "created_at": datetime.utcnow()}
+        with self._lock:
+            self.outbox.append(row)
+        self._wake.set()
+
+    def start(self):
+        """Start relaying from the newest event; earlier ones are only replayed through since()"""
+        with engine.connect() as conn:
+            self.seq = conn.execute(select(func.max(StreamEvent.id))).scalar() or 0
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._relay, daemon=True, name="event-relay")
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+        try:
+            self.pump()  # whatever was published on the way down
+        except Exception as e:
+            print(f"Error relaying events: {e}")
+
+    def _relay(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.pump()
+            except Exception as e:
+                self.errors += 1
+                print(f"Error relaying events: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def pump(self):
+        """Write the outbox to the events table, then hand the rows this process hasn't seen to its subscribers"""
+        events = StreamEvent.__table__
+        with self._lock:
+            outbox, self.outbox = self.outbox, []
+        try:
+            if outbox:
+                with engine.begin() as conn:
+                    conn.execute(events.insert(), outbox)
+        except Exception:
+            with self._lock:
+                self.outbox[:0] = outbox
+            raise
+        with engine.connect() as conn:
+            rows = conn.execute(select(events).where(events.c.id > self.seq).order_by(events.c.id).limit(EVENT_BATCH)).all()
+        messages = []
+        for row in rows:
+            if row.id != self.seq + 1:
+                # A lower id may still be committing on another connection; skip it only once it's clearly gone
+                if self.gap_since is None:
+                    self.gap_since = time.monotonic()
+                if time.monotonic() - self.gap_since < EVENT_GAP_WAIT:
+                    break
+                self.gaps += 1
+            self.gap_since = None
+            self.seq = row.id
+            messages.append(self._message(row))
+        if len(rows) == EVENT_BATCH or self.gap_since is not None:
+            self._wake.set()
+        if not messages:
+            return
+        self.relayed += len(messages)
+        with self._lock:
+            subscribers = list(self.subscribers.items())
+        for queue, loop in subscribers:
+            loop.call_soon_threadsafe(self._deliver, queue, messages)
+
+    @staticmethod
+    def _message(row):
+        return {"seq": row.id, "type": row.type, "sport": row.sport, "group_id": row.group_id,
+                "users": json.loads(row.users) if row.users is not None else None, "data": row.data}
+
+    def _deliver(self, queue, messages):
+        for message in messages:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slow consumer: drop its backlog and tell it to resync from the API
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.LAGGED)
+                return
+
+    def subscribe(self):
+        queue = asyncio.Queue(self.queue_size)
+        with self._lock:
+            self.subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self.subscribers.pop(queue, None)
+
+    def since(self, db, seq):
+        """Events after seq that this process has relayed, and whether the history still reaches back that far"""
+        events = StreamEvent.__table__
+        oldest, newest = db.execute(select(func.min(events.c.id), func.max(events.c.id))).one()
+        rows = db.execute(select(events).where(events.c.id > seq, events.c.id <= self.seq)
+                          .order_by(events.c.id).limit(self.history)).all()
+        complete = seq >= (newest or 0) or (oldest is not None and oldest <= seq + 1)
+        return [self._message(row) for row in rows], complete
+
+    def prune(self):
+        """Delete all but the last EVENT_HISTORY events"""
+        events = StreamEvent.__table__
+        with engine.begin() as conn:
+            newest = conn.execute(select(func.max(events.c.id))).scalar()
+            pruned = conn.execute(events.delete().where(events.c.id <= newest - self.history)).rowcount if newest else 0
+        return {"events_pruned": pruned}
+
+    def stats(self):
+        return {"seq": self.seq, "outbox": len(self.outbox), "relayed": self.relayed, "gaps": self.gaps, "errors": self.errors,
+                "subscribers": len(self.subscribers)}
+
+event_bus = EventBus()
+
+def publish_balances(db, user_ids):
+    """Publish balance_changed for each user, reading the committed balances in one query"""
+    for user_id, balance in ledger.balances(db, user_ids).items():
+        event_bus.publish("balance_changed", {"user_id": user_id, "balance": balance}, users=[user_id])
+
+def publish_settlements(db, model, outcomes):
+    kind = "prop_bet" if model is PropBet else "bet"
+    for bet_id, bookie_id, bettor_id, amount, winner in outcomes:
+        event_bus.publish("bet_settled", {"kind": kind, "bet_id": bet_id, "winner": winner, "amount": amount,
+                                          "bookie_id": bookie_id, "bettor_id": bettor_id}, users=[bookie_id, bettor_id])
+    publish_balances(db, [uid for o in outcomes for uid in (o[1], o[2])])
+
 # Odds API Integration
+class OddsClient:
+    """Pooled async client for the Odds API.
+
+    Runs on its own event loop thread so the sync scheduler jobs and route
+    handlers can share one connection pool. Every sport is fetched
+    concurrently with its own timeout, transient failures are retried with
+    exponential backoff and ETags are replayed as If-None-Match.
+    """
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url=ODDS_API_BASE, api_key=ODDS_API_KEY, timeout=ODDS_TIMEOUT,
+                 retries=ODDS_RETRIES, backoff=0.5, max_connections=ODDS_MAX_CONNECTIONS):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self.etags = {}  # request key -> (etag, parsed body)
+        self._client = None
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="odds-client", daemon=True).start()
+                self._client = httpx.AsyncClient(
+                    timeout=self.timeout,
+                    limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections))
+                self._loop = loop
+        return self._loop
+
+    def run(self, coro):
+        """Run a coroutine on the client loop from sync code"""
+        return asyncio.run_coroutine_threadsafe(coro, self._start()).result()
+
+    def close(self):
+        if self._loop is not None:
+            self.run(self._client.aclose())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = self._client = None
+
+    async def get_json(self, path, params=None):
+        params = dict(params or {})
+        key = (path, tuple(sorted(params.items())))
+        params["apiKey"] = self.api_key
+        parts = path.strip("/").split("/")  # sports/<sport key>/<feed>
+        feed, sport = parts[-1], SPORTS.get(parts[-2], parts[-2]) if len(parts) > 1 else ""
+        for attempt in range(self.retries + 1):
+            cached = self.etags.get(key)
+            headers = {"If-None-Match": cached[0]} if cached else {}
+            started = time.perf_counter()
+            try:
+                try:
+                    response = await self._client.get(f"{self.base_url}{path}", params=params, headers=headers)
+                except httpx.TransportError as e:
+                    metrics.inc("odds_api_requests_total", feed, sport, type(e).__name__)
+                    raise
+                finally:
+                    metrics.observe("odds_api_request_duration_seconds", time.perf_counter() - started, feed, sport)
+                metrics.inc("odds_api_requests_total", feed, sport, str(response.status_code))
+                if response.status_code == 304 and cached:
+                    return cached[1]
+                if response.status_code in self.RETRY_STATUSES and attempt < self.retries:
+                    raise httpx.HTTPStatusError(f"{response.status_code} from {path}", request=response.request, response=response)
+                response.raise_for_status()
+                body = response.json()
+                if response.headers.get("ETag"):
+                    self.etags[key] = (response.headers["ETag"], body)
+                return body
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                retryable = not isinstance(e, httpx.HTTPStatusError) or e.response.status_code in self.RETRY_STATUSES
+                if not retryable or attempt == self.retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def _fetch_sports(self, kind, sports, params):
+        # Bound each sport by its own deadline so one slow feed can't hold up the rest
+        deadline = self.timeout * (self.retries + 1) + self.backoff * (2 ** self.retries)
+        tasks = [asyncio.wait_for(self.get_json(f"/sports/{sport_key}/{kind}/", params), deadline) for sport_key in sports]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return dict(zip(sports, results))
+
+    @staticmethod
+    def describe(error):
+        """Short error description that doesn't leak the apiKey query param"""
+        if isinstance(error, httpx.HTTPStatusError):
+            return f"HTTP {error.response.status_code}"
+        return type(error).__name__
+
+    def odds(self, sports=None):
+        """Odds for each sport key, or the exception that sport failed with"""
+        return self.run(self._fetch_sports("odds", list(sports or SPORTS), {"regions": "us", "markets": "h2h,spreads,totals"}))
+
+    def scores(self, sports=None, days_from=1):
+        """Scores for each sport key, or the exception that sport failed with"""
+        return self.run(self._fetch_sports("scores", list(sports or SPORTS), {"daysFrom": days_from}))
+
+odds_client = OddsClient()
+
 def fetch_live_games():
-    """Fetch real games from Odds API"""
+    """Fetch real games for every tracked sport from Odds API, raising if all of them fail"""
     if not ODDS_API_KEY:
         return GAMES  # Return demo games if no API key
     
-    try:
-        # Fetch NBA games
-        nba_url = f"https://api.the-odds-api.com/v4/sports/basketball_nba/odds/?apiKey={ODDS_API_KEY}&regions=us&markets=h2h,spreads,totals"
-        nba_response = requests.get(nba_url, timeout=10)
-        
-        # Fetch NFL games
-        nfl_url = f"https://api.the-odds-api.com/v4/sports/americanfootball_nfl/odds/?apiKey={ODDS_API_KEY}&regions=us&markets=h2h,spreads,totals"
-        nfl_response = requests.get(nfl_url, timeout=10)
-        
-        games = []
-        
-        # Process NBA games
-        if nba_response.status_code == 200:
-            nba_data = nba_response.json()
-            for game in nba_data[:10]:  # Limit to 10 games
-                games.append({
-                    "id": game["id"],
-                    "home": game["home_team"],
-                    "away": game["away_team"],
-                    "sport": "NBA",
-                    "date": game["commence_time"][:10],
-                    "commence_time": game["commence_time"],
-                    "status": "upcoming"
-                })
-        
-        # Process NFL games
-        if nfl_response.status_code == 200:
-            nfl_data = nfl_response.json()
-            for game in nfl_data[:10]:
-                games.append({
-                    "id": game["id"],
-                    "home": game["home_team"],
-                    "away": game["away_team"],
-                    "sport": "NFL",
-                    "date": game["commence_time"][:10],
-                    "commence_time": game["commence_time"],
-                    "status": "upcoming"
-                })
-        
-        return games if games else GAMES
-    except Exception as e:
-        print(f"Error fetching games: {e}")
-        return GAMES
-
-def check_game_scores():
-    """Check scores and auto-settle bets"""
-    if not ODDS_API_KEY:
-        return
+    games = []
+    errors = []
+    for sport_key, data in odds_client.odds().items():
+        sport = SPORTS[sport_key]
+        if isinstance(data, BaseException):
+            print(f"Error fetching {sport} games: {odds_client.describe(data)}")
+            errors.append(data)
+            # Keep serving what we last had for this sport
+            games.extend(g for g in (game_cache.games or []) if g.get("sport") == sport and g not in GAMES)
+            continue
+        for game in data[:10]:  # Limit to 10 games per sport
+            games.append({
+                "id": game["id"],
+                "home": game["home_team"],
+                "away": game["away_team"],
+                "sport": sport,
+                "date": game["commence_time"][:10],
+                "commence_time": game["commence_time"],
+                "status": "upcoming"
+            })
     
+    if errors and len(errors) == len(SPORTS):
+        raise errors[0]
+    return games if games else GAMES
+
+class GameFeedCache:
+    """TTL cache over the game feed, refreshed in the background.
+
+    Concurrent misses wait on a single upstream fetch, and upstream errors keep
+    serving the last good feed (or the demo games) until the next retry.
+    """
+    def __init__(self, fetch, ttl=GAME_CACHE_TTL, retry=GAME_CACHE_RETRY):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.retry = retry
+        self.games = None
+        self.by_id = {}
+        self.fetched_at = None
+        self.expires_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.games is not None and time.monotonic() < self.expires_at:
+            self.hits += 1
+            return self.games
+        self.misses += 1
+        return self.refresh(force=False)
+
+    def find(self, game_id):
+        self.get()
+        return self.by_id.get(game_id)
+
+    def refresh(self, force=True):
+        with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            if not force and self.games is not None and time.monotonic() < self.expires_at:
+                return self.games
+            try:
+                games = self.fetch()
+            except Exception as e:
+                error = odds_client.describe(e)
+                print(f"Error fetching games: {error}")
+                self.errors += 1
+                self.last_error = error
+                if self.games is None:
+                    self._store(GAMES)
+                    self.fetched_at = None
+                self.expires_at = time.monotonic() + min(self.retry, self.ttl)
+                return self.games
+            self._store(games)
+            self.refreshes += 1
+            self.last_error = None
+            return games
+
+    def _store(self, games):
+        self.by_id = {g["id"]: g for g in games}
+        self.games = games
+        self.fetched_at = time.monotonic()
+        self.expires_at = self.fetched_at + self.ttl
+
+    def stats(self):
+        age = time.monotonic() - self.fetched_at if self.fetched_at is not None else None
+        return {"hits": self.hits, "misses": self.misses, "refreshes": self.refreshes, "errors": self.errors,
+                "last_error": self.last_error, "games": len(self.by_id), "ttl": self.ttl,
+                "age_seconds": round(age, 1) if age is not None else None,
+                "stale": self.games is not None and time.monotonic() >= self.expires_at}
+
+game_cache = GameFeedCache(fetch_live_games)
+
+# Score polling
+def parse_time(value):
+    """An Odds API timestamp (ISO 8601) as a naive UTC datetime, or None"""
+    if not value:
+        return None
     try:
-        # Fetch scores from Odds API
-        scores_url = f"https://api.the-odds-api.com/v4/sports/basketball_nba/scores/?apiKey={ODDS_API_KEY}&daysFrom=1"
-        response = requests.get(scores_url, timeout=10)
-        
-        if response.status_code == 200:
-            scores_data = response.json()
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None) if parsed.tzinfo else parsed
+
+class ScorePoller:
+    """Polls the scores feed only for games with pending bets or parlay legs.
+
+    games indexes every such game by sport and commence time; tick() tops
+    it up from bets and legs newer than the last ones it saw and rebuilds
+    it every SCORE_INDEX_REBUILD. A sport is fetched only when one of its
+    games is due: every SCORE_POLL_SLOW after kick-off, every
+    SCORE_POLL_FAST from SCORE_FINISH_WINDOW before its expected finish
+    (GAME_DURATIONS), and slow again once it is SCORE_OVERDUE. Finished
+    games are queued for settlement once and dropped from the index; a
+    pending bet or leg that still turns up on one later (or on a game a
+    previous leader settled) re-runs its settle_game job with the stored
+    score.
+    """
+    def __init__(self, fetch=None, fast=SCORE_POLL_FAST, slow=SCORE_POLL_SLOW):
+        self.fetch = fetch or (lambda sport_keys, days_from: odds_client.scores(sport_keys, days_from))
+        self.fast = timedelta(seconds=fast)
+        self.slow = timedelta(seconds=slow)
+        self.games = {}  # game_id -> (sport, commence_time or None)
+        self.settled = OrderedDict()  # game_ids already queued for settlement, oldest first
+        self.late = set()  # settled game_ids seen with pending bets or legs since the last tick
+        self.last_bet_id = 0
+        self.last_leg_id = 0
+        self.rebuilt_at = None
+        self.last_poll = {}  # sport -> when its scores were last fetched
+        self.ticks = 0
+        self.calls = 0
+        self.calls_by_sport = {}
+        self.errors = 0
+        self.queued = 0
+        self.requeued = 0
+        self.latencies = deque(maxlen=1000)  # seconds from the feed's last update on a final score to queueing it
+        self._lock = threading.Lock()
+
+    def _track(self, rows):
+        for game_id, sport, commence_time in rows:
+            if game_id in self.settled:
+                self.late.add(game_id)
+            elif game_id:
+                self.games[game_id] = (sport, commence_time)
+
+    def refresh(self, db, now):
+        """Add games that picked up pending bets or legs since the last call; rebuild from scratch every SCORE_INDEX_REBUILD"""
+        pending = (select(Bet.game_id, Line.sport, Bet.commence_time).join(Line, Line.id == Bet.line_id)
+                   .where(Bet.status == "pending"))
+        legs = (select(ParlayLeg.game_id, ParlayLeg.sport, ParlayLeg.commence_time)
+                .where(ParlayLeg.status == "pending", ParlayLeg.game_id.isnot(None)))
+        if self.rebuilt_at is None or now - self.rebuilt_at >= timedelta(seconds=SCORE_INDEX_REBUILD):
+            last_id = db.execute(select(func.max(Bet.id))).scalar() or 0
+            last_leg_id = db.execute(select(func.max(ParlayLeg.id))).scalar() or 0
+            self.games = {}
+            self._track(db.execute(pending.group_by(Bet.game_id, Line.sport, Bet.commence_time)).all())
+            self._track(db.execute(legs.group_by(ParlayLeg.game_id, ParlayLeg.sport, ParlayLeg.commence_time)).all())
+            self.last_bet_id = last_id
+            self.last_leg_id = last_leg_id
+            self.rebuilt_at = now
+            return
+        # Overlap the last scan a little: ids can commit out of order under concurrent inserts
+        rows = db.execute(pending.add_columns(Bet.id).where(Bet.id > self.last_bet_id - 100).order_by(Bet.id)).all()
+        if rows:
+            self.last_bet_id = max(self.last_bet_id, rows[-1].id)
+            self._track((game_id, sport, commence) for game_id, sport, commence, _ in rows)
+        rows = db.execute(legs.add_columns(ParlayLeg.id).where(ParlayLeg.id > self.last_leg_id - 100)
+                          .order_by(ParlayLeg.id)).all()
+        if rows:
+            self.last_leg_id = max(self.last_leg_id, rows[-1].id)
+            self._track((game_id, sport, commence) for game_id, sport, commence, _ in rows)
+
+    def next_due(self, sport, commence_time, now):
+        """When a game next needs its sport polled"""
+        last = self.last_poll.get(sport)
+        if commence_time is None:
+            return last + self.slow if last else now
+        finish = commence_time + timedelta(minutes=GAME_DURATIONS.get(sport, 180))
+        if finish - timedelta(minutes=SCORE_FINISH_WINDOW) <= now <= finish + timedelta(minutes=SCORE_OVERDUE):
+            return max(last or commence_time, commence_time) + self.fast
+        return max(last or commence_time, commence_time) + self.slow
+
+    def due(self, now):
+        """Sports with a game due for a poll"""
+        due = set()
+        for sport, commence_time in self.games.values():
+            if sport not in due and self.next_due(sport, commence_time, now) <= now:
+                due.add(sport)
+        return due
+
+    def tick(self, now=None):
+        with self._lock:
+            now = now or datetime.utcnow()
+            self.ticks += 1
             db = SessionLocal()
-            
-            for game_data in scores_data:
-                if game_data.get("completed") and game_data.get("scores"):
+            try:
+                self.refresh(db, now)
+            finally:
+                db.close()
+            # Their jobs may still be queued, in which case this is a no-op and the job picks the bets up
+            for game_id in self.late:
+                self.requeued += job_queue.requeue(f"settle_game:{game_id}")
+            self.late.clear()
+            keys = {label: key for key, label in SPORTS.items()}
+            sport_keys = [keys[sport] for sport in self.due(now) if sport in keys]
+            if not sport_keys:
+                return 0
+            oldest = min((c for s, c in self.games.values() if c and keys.get(s) in sport_keys), default=None)
+            days_from = 3 if oldest and now - oldest > timedelta(hours=20) else 1
+            self.calls += len(sport_keys)
+            queued = 0
+            for sport_key, scores_data in self.fetch(sport_keys, days_from).items():
+                sport = SPORTS[sport_key]
+                self.calls_by_sport[sport] = self.calls_by_sport.get(sport, 0) + 1
+                if isinstance(scores_data, BaseException):
+                    self.errors += 1
+                    print(f"Error checking {sport} scores: {odds_client.describe(scores_data)}")
+                    continue
+                self.last_poll[sport] = now
+                for game_data in scores_data:
                     game_id = game_data["id"]
+                    if game_id not in self.games or not (game_data.get("completed") and game_data.get("scores")):
+                        continue
                     scores = game_data["scores"]
-                    
                     home_score = next((s["score"] for s in scores if s["name"] == game_data["home_team"]), None)
                     away_score = next((s["score"] for s in scores if s["name"] == game_data["away_team"]), None)
-                    
-                    if home_score and away_score:
-                        # Find all bets for this game
-                        bets = db.query(Bet).filter(Bet.game_id == game_id, Bet.status == "pending").all()
-                        
-                        for bet in bets:
-                            # Auto-settle based on bet type
-                            winner = determine_winner(bet, int(home_score), int(away_score))
-                            if winner:
-                                settle_bet(db, bet, winner)
-            
-            db.commit()
-            db.close()
+                    if home_score is None or away_score is None:
+                        continue
+                    key = f"settle_game:{game_id}"
+                    if not job_queue.enqueue("settle_game", key, {"game_id": game_id, "home_score": int(home_score),
+                                                                  "away_score": int(away_score), "sport": sport}):
+                        self.requeued += job_queue.requeue(key)  # settled before this process led
+                    del self.games[game_id]
+                    self.settled[game_id] = now
+                    if len(self.settled) > 10000:
+                        self.settled.popitem(last=False)
+                    updated = parse_time(game_data.get("last_update"))
+                    if updated:
+                        self.latencies.append(max(0.0, (now - updated).total_seconds()))
+                    queued += 1
+            self.queued += queued
+            return queued
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        by_sport = {}
+        for sport, _ in list(self.games.values()):
+            by_sport[sport] = by_sport.get(sport, 0) + 1
+        return {"tracked_games": len(self.games), "tracked_by_sport": by_sport, "ticks": self.ticks,
+                "api_calls": self.calls, "api_calls_by_sport": self.calls_by_sport, "errors": self.errors,
+                "games_queued": self.queued, "games_requeued": self.requeued,
+                "settle_latency_seconds": {
+                    "avg": round(sum(latencies) / len(latencies), 1) if latencies else None,
+                    "p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+                    "max": latencies[-1] if latencies else None},
+                "last_poll": {sport: at.isoformat() for sport, at in self.last_poll.items()}}
+
+score_poller = ScorePoller()
+
+def check_game_scores():
+    """Poll scores for the sports with pending bets that are due, and queue settlement of finished games"""
+    if not ODDS_API_KEY:
+        return
+    try:
+        score_poller.tick()
     except Exception as e:
         print(f"Error checking scores: {e}")
 
@@ -267,304 +1639,2142 @@ def determine_winner(bet, home_score, away_score):
             return "bookie" if total < bet.value else "bettor"
     return None
 
-def settle_bet(db, bet, winner):
-    """Auto-settle a bet"""
-    payout = bet.amount * 2  # 0% rake
-    
-    bookie = db.query(User).filter(User.id == bet.bookie_id).first()
-    bettor = db.query(User).filter(User.id == bet.bettor_id).first()
-    
-    if winner == "bookie":
-        bookie.balance += payout
-        bookie.profit += bet.amount
-        bookie.wins += 1
-        bettor.profit -= bet.amount
-        bettor.losses += 1
-    else:
-        bettor.balance += payout
-        bettor.profit += bet.amount
-        bettor.wins += 1
-        bookie.profit -= bet.amount
-        bookie.losses += 1
-    
-    bet.status = "settled"
-    bet.winner = winner
+def determine_prop_winner(prop_bet, actual):
+    """Determine prop bet winner from the player's actual stat"""
+    if prop_bet.bookie_side == "over":
+        return "bookie" if actual > prop_bet.line else "bettor"
+    return "bookie" if actual < prop_bet.line else "bettor"
 
-# Initialize scheduler
-scheduler = BackgroundScheduler()
-scheduler.add_job(check_game_scores, 'interval', minutes=5)  # Check scores every 5 minutes
-scheduler.start()
+def settle_bets(db, model, outcomes, sport=None):
+    """Settle a batch of bets with bulk UPDATEs.
 
-# Models
-class UserCreate(BaseModel):
-    username: str
-    password: str
+    outcomes are (bet_id, bookie_id, bettor_id, amount, winner) tuples; the
+    winners are paid out in the same transaction (see pay_out). Only bets
+    still pending are settled and paid, so a job re-run while its first run
+    is still going can't pay a bet twice. The caller commits.
+    """
+    bets = model.__table__
+    settled = set()
+    for winner in ("bookie", "bettor"):
+        ids = [o[0] for o in outcomes if o[4] == winner]
+        if ids:
+            settled.update(db.execute(bets.update().where(bets.c.id.in_(ids), bets.c.status == "pending")
+                                      .values(status="settled", winner=winner).returning(bets.c.id)).scalars())
+    outcomes = [o for o in outcomes if o[0] in settled]
+    if not outcomes:
+        return 0
+    metrics.observe("settlement_batch_size", len(outcomes), model.__tablename__)
+    # 0% rake: the winner takes both stakes
+    pay_out(db, "prop_payout" if model is PropBet else "payout",
+            [(bet_id, bookie_id, bettor_id, amount * 2, amount) if winner == "bookie"
+             else (bet_id, bettor_id, bookie_id, amount * 2, amount)
+             for bet_id, bookie_id, bettor_id, amount, winner in outcomes], sport)
+    return len(outcomes)
 
-class LineCreate(BaseModel):
-    game_id: str
-    type: str
-    side: str
-    value: float
-    amount: float
-    max_bettors: Optional[int] = None
-    max_bet_per_user: Optional[float] = None
-    max_total_action: Optional[float] = None
-    is_private: Optional[bool] = False
-    group_id: Optional[int] = None
+def pay_out(db, kind, results, sport=None):
+    """Pay out (ref_id, winner_id, loser_id, pot, stake) results as kind ledger credits of the pot to each winner.
 
-class PropCreate(BaseModel):
-    sport: str
-    player_name: str
-    prop_type: str
-    line: float
-    side: str
-    amount: float
+    stake is what the loser lost: it goes on the winner's profit and off the
+    loser's. profit/wins/losses deltas are summed per user and go to the
+    leaderboards, whose all-time board is where a user's stats are read
+    from; users rows aren't touched, so settlement never queues behind a
+    bookie's escrow on them. The caller commits.
+    """
+    credits = []
+    deltas = {}  # user_id -> [profit, wins, losses]
+    for ref_id, winner_id, loser_id, pot, stake in results:
+        credits.append((winner_id, pot, kind, ref_id))
+        won = deltas.setdefault(winner_id, [0.0, 0, 0])
+        won[0] += stake
+        won[1] += 1
+        lost = deltas.setdefault(loser_id, [0.0, 0, 0])
+        lost[0] -= stake
+        lost[2] += 1
+    ledger.credit(db, credits)
+    leaderboards.record(db, {uid: tuple(d) for uid, d in deltas.items()}, sport)
+    invalidate_after_commit(db, deltas)
+    invalidate_reads_after_commit(db, "leaderboard", "users")
 
-class TakeLine(BaseModel):
-    line_id: int
+def _settle_pending(db, model, filters, decide, label, sport=None):
+    """Walk pending bets matching filters in id order, settling SETTLE_BATCH_SIZE per transaction"""
+    started = time.perf_counter()
+    settled = 0
+    last_id = 0
+    while True:
+        rows = db.execute(select(model.__table__).where(*filters, model.status == "pending", model.id > last_id)
+                          .order_by(model.id).limit(SETTLE_BATCH_SIZE).with_for_update()).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        outcomes = [(b.id, b.bookie_id, b.bettor_id, b.amount, w) for b, w in ((b, decide(b)) for b in rows) if w]
+        settled += settle_bets(db, model, outcomes, sport)
+        db.commit()
+        if outcomes:
+            publish_settlements(db, model, outcomes)
+    elapsed = time.perf_counter() - started
+    rate = settled / elapsed if elapsed > 0 else 0.0
+    if settled:
+        print(f"Settled {settled} bets for {label} in {elapsed:.2f}s ({rate:.0f} bets/s)")
+    return {"settled": settled, "seconds": round(elapsed, 3), "bets_per_second": round(rate, 1)}
 
-class TakeProp(BaseModel):
-    prop_id: int
+def resolve_parlay_legs(db, decided):
+    """Apply a batch of decided (parlay_id, leg_id, won) legs to their parlays; the caller commits.
 
-class GroupCreate(BaseModel):
-    name: str
-    description: Optional[str] = None
+    Only the parlays with a leg in the batch are touched. An open parlay
+    can't be taken once one of its legs is decided, so it is voided and the
+    bettor refunded. A lost leg settles its parlay for the bookie at once
+    and voids the rest of its legs, so later games never look at them; won
+    legs count legs_pending down and the parlays that reach 0 pay the
+    bettor. Every parlay UPDATE is conditional on its status, so jobs
+    settling different games of the same parlays pay each one exactly once.
+    Returns the settled (id, bookie_id, bettor_id, amount, payout, winner)
+    and voided (id, bettor_id, amount) parlays.
+    """
+    parlays, legs = Parlay.__table__, ParlayLeg.__table__
+    metrics.observe("settlement_batch_size", len(decided), legs.name)
+    ids = sorted({parlay_id for parlay_id, _, _ in decided})
+    # Lock the parlays in id order so concurrent settlements sharing them can't deadlock (Postgres)
+    db.execute(select(parlays.c.id).where(parlays.c.id.in_(ids)).order_by(parlays.c.id).with_for_update())
+    for status, won in (("won", True), ("lost", False)):
+        leg_ids = [leg_id for _, leg_id, w in decided if w == won]
+        if leg_ids:
+            db.execute(legs.update().where(legs.c.id.in_(leg_ids)).values(status=status))
+    voided = db.execute(parlays.update().where(parlays.c.id.in_(ids), parlays.c.status == "open")
+                        .values(status="void").returning(parlays.c.id, parlays.c.bettor_id, parlays.c.amount)).all()
+    columns = (parlays.c.id, parlays.c.bookie_id, parlays.c.bettor_id, parlays.c.amount, parlays.c.payout, parlays.c.winner)
+    lost = sorted({parlay_id for parlay_id, _, won in decided if not won})
+    settled = db.execute(parlays.update().where(parlays.c.id.in_(lost), parlays.c.status == "pending")
+                         .values(status="settled", winner="bookie").returning(*columns)).all() if lost else []
+    wins = {}
+    for parlay_id, _, won in decided:
+        if won:
+            wins[parlay_id] = wins.get(parlay_id, 0) + 1
+    by_count = {}  # legs won in this batch -> parlays, so each count is one UPDATE
+    for parlay_id, count in wins.items():
+        by_count.setdefault(count, []).append(parlay_id)
+    complete = []
+    for count, group in by_count.items():
+        complete += [row.id for row in db.execute(
+            parlays.update().where(parlays.c.id.in_(group), parlays.c.status == "pending")
+            .values(legs_pending=parlays.c.legs_pending - count).returning(parlays.c.id, parlays.c.legs_pending))
+            if row.legs_pending <= 0]
+    if complete:
+        settled += db.execute(parlays.update().where(parlays.c.id.in_(complete), parlays.c.status == "pending")
+                              .values(status="settled", winner="bettor").returning(*columns)).all()
+    done = [row.id for row in settled] + [row.id for row in voided]
+    if done:
+        db.execute(legs.update().where(legs.c.parlay_id.in_(done), legs.c.status == "pending").values(status="void"))
+    if settled:
+        # Parlays can span sports, so they only count towards the overall boards
+        pay_out(db, "parlay_payout", [(p.id, p.bookie_id, p.bettor_id, p.payout, p.amount) if p.winner == "bookie"
+                                      else (p.id, p.bettor_id, p.bookie_id, p.payout, p.payout - p.amount) for p in settled])
+    if voided:
+        ledger.credit(db, [(p.bettor_id, p.amount, "parlay_refund", p.id) for p in voided])
+        invalidate_reads_after_commit(db, "parlays")
+    return settled, voided
 
-def hash_password(pw: str) -> str:
-    return hashlib.sha256(pw.encode()).hexdigest()
+def publish_parlays(db, settled, voided):
+    for p in settled:
+        event_bus.publish("bet_settled", {"kind": "parlay", "bet_id": p.id, "winner": p.winner, "amount": p.amount,
+                                          "payout": p.payout, "bookie_id": p.bookie_id, "bettor_id": p.bettor_id},
+                          users=[p.bookie_id, p.bettor_id])
+    for p in voided:
+        event_bus.publish("parlay_voided", {"parlay_id": p.id, "refund": p.amount}, users=[p.bettor_id])
+    publish_balances(db, [uid for p in settled for uid in (p.bookie_id, p.bettor_id)] + [p.bettor_id for p in voided])
 
-def create_token(user_id: int) -> str:
-    return jwt.encode({"user_id": user_id, "exp": datetime.utcnow() + timedelta(days=7)}, SECRET_KEY, algorithm="HS256")
+def settle_parlay_legs(db, filters, decide, label):
+    """Decide the pending parlay legs matching filters, SETTLE_BATCH_SIZE per transaction (see resolve_parlay_legs)"""
+    started = time.perf_counter()
+    decided = settled = voided = 0
+    last_id = 0
+    while True:
+        rows = db.execute(select(ParlayLeg.__table__).where(*filters, ParlayLeg.status == "pending", ParlayLeg.id > last_id)
+                          .order_by(ParlayLeg.id).limit(SETTLE_BATCH_SIZE).with_for_update()).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        batch = [(leg.parlay_id, leg.id, w == "bettor") for leg, w in ((leg, decide(leg)) for leg in rows) if w]
+        if not batch:
+            continue
+        done, void = resolve_parlay_legs(db, batch)
+        db.commit()
+        publish_parlays(db, done, void)
+        decided += len(batch)
+        settled += len(done)
+        voided += len(void)
+    elapsed = time.perf_counter() - started
+    if decided:
+        print(f"Decided {decided} parlay legs for {label} in {elapsed:.2f}s: {settled} parlays settled, {voided} voided")
+    return {"legs": decided, "settled": settled, "voided": voided, "seconds": round(elapsed, 3)}
 
-def verify_token(token: str) -> Optional[int]:
-    try:
-        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"]).get("user_id")
-    except:
-        return None
+def close_lines(db, filters):
+    """Close the open lines matching filters and refund their unmatched escrow; commits.
 
-@app.get("/")
-def home():
-    return {"message": "🎯 BookieVerse", "app": "/app"}
+    Taking a line is a conditional UPDATE on status = 'open', so once this
+    commits no new bet can land on them.
+    """
+    lines = Line.__table__
+    closed = db.execute(lines.update().where(*filters, lines.c.status == "open").values(status="closed").returning(
+        lines.c.id, lines.c.bookie_id, lines.c.sport, lines.c.amount, lines.c.max_total_action, lines.c.total_action,
+        lines.c.is_private, lines.c.group_id)).all()
+    refund_unmatched(db, [(line.id, line.bookie_id, line_escrow(line.amount, line.max_total_action), line.total_action)
+                          for line in closed])
+    if closed:
+        invalidate_reads_after_commit(db, "lines")
+    db.commit()
+    for line in closed:
+        event_bus.publish("line_closed", {"line_id": line.id}, sport=line.sport, group_id=line.group_id if line.is_private else None)
+    publish_balances(db, {line.bookie_id for line in closed})
+    return len(closed)
 
-@app.post("/api/auth/register")
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    if len(user.password) < 6:
-        raise HTTPException(400, "Password 6+ chars")
-    if db.query(User).filter(User.username == user.username).first():
-        raise HTTPException(400, "Username taken")
-    
-    is_admin = db.query(User).count() == 0
-    new_user = User(username=user.username, password=hash_password(user.password), is_admin=is_admin)
-    db.add(new_user)
+def close_props(db, filters):
+    """Close the open props matching filters and refund their escrow; commits"""
+    props = Prop.__table__
+    closed = db.execute(props.update().where(*filters, props.c.status == "open").values(status="closed")
+                        .returning(props.c.id, props.c.bookie_id, props.c.sport, props.c.amount)).all()
+    ledger.credit(db, [(prop.bookie_id, prop.amount, "prop_refund", prop.id) for prop in closed])
+    if closed:
+        invalidate_reads_after_commit(db, "props")
     db.commit()
-    db.refresh(new_user)
-    return {"token": create_token(new_user.id), "user": {"id": new_user.id, "username": new_user.username, "balance": new_user.balance}}
+    for prop in closed:
+        event_bus.publish("prop_closed", {"prop_id": prop.id}, sport=prop.sport)
+    publish_balances(db, {prop.bookie_id for prop in closed})
+    return len(closed)
 
-@app.post("/api/auth/login")
-def login(user: UserCreate, db: Session = Depends(get_db)):
-    u = db.query(User).filter(User.username == user.username).first()
-    if not u or u.password != hash_password(user.password):
-        raise HTTPException(401, "Invalid credentials")
-    return {"token": create_token(u.id), "user": {"id": u.id, "username": u.username, "balance": u.balance}}
+def settle_game(game_id, home_score, away_score, sport=None):
+    """Close a finished game's open lines, then settle every pending bet and parlay leg on it"""
+    db = SessionLocal()
+    try:
+        if sport is None:
+            sport = db.execute(select(Line.sport).where(Line.game_id == game_id).limit(1)).scalar()
+        closed = close_lines(db, [Line.game_id == game_id])
+        result = _settle_pending(db, Bet, [Bet.game_id == game_id],
+                                 lambda b: determine_winner(b, home_score, away_score), game_id, sport)
+        result["parlays"] = settle_parlay_legs(db, [ParlayLeg.game_id == game_id],
+                                               lambda leg: determine_winner(leg, home_score, away_score), game_id)
+        result["lines_closed"] = closed
+        return result
+    finally:
+        db.close()
 
-@app.get("/api/games")
-def get_games():
-    return fetch_live_games()
+def settle_player_props(player_name, stats):
+    """Close a player's open props on the posted stats, then settle every pending prop bet and parlay leg on them"""
+    db = SessionLocal()
+    try:
+        prop_types = [t for t, key in PROP_STATS.items() if key in stats]
+        sport = db.execute(select(Prop.sport).where(Prop.player_name == player_name).limit(1)).scalar()
+        closed = close_props(db, [Prop.player_name == player_name, Prop.prop_type.in_(prop_types)])
+        result = _settle_pending(db, PropBet, [PropBet.player_name == player_name, PropBet.prop_type.in_(prop_types)],
+                                 lambda p: determine_prop_winner(p, stats[PROP_STATS[p.prop_type]]), player_name, sport)
+        result["parlays"] = settle_parlay_legs(db, [ParlayLeg.player_name == player_name, ParlayLeg.prop_type.in_(prop_types)],
+                                               lambda leg: determine_prop_winner(leg, stats[PROP_STATS[leg.prop_type]]),
+                                               player_name)
+        result["props_closed"] = closed
+        return result
+    finally:
+        db.close()
 
-@app.get("/api/futures")
-def get_futures():
-    return FUTURES
+# Leaderboards
+def board_keys(now=None):
+    """Board keys for each window, as of now"""
+    now = now or datetime.utcnow()
+    year, week, _ = now.isocalendar()
+    return {"all": "all", "day": f"day:{now:%Y-%m-%d}", "week": f"week:{year}-W{week:02d}"}
 
-@app.get("/api/prop-types")
-def get_prop_types():
-    return PROP_TYPES
+class SortedBoard:
+    """One board's users ordered by profit, so rank lookups are a bisect"""
+    def __init__(self, scores):
+        self.scores = dict(scores)
+        self.order = sorted((-profit, user_id) for user_id, profit in self.scores.items())
+        self.loaded_at = time.monotonic()
 
-@app.get("/api/lines")
-def get_lines(db: Session = Depends(get_db)):
-    lines = db.query(Line).filter(Line.status == "open").all()
-    return [{"id": l.id, "bookie_id": l.bookie_id, "bookie_name": l.bookie_name, "game": l.game, "sport": l.sport,
-             "type": l.type, "side": l.side, "value": l.value, "amount": l.amount, "status": l.status,
-             "current_bettors": l.current_bettors, "is_private": l.is_private} for l in lines]
+    def add(self, user_id, delta):
+        old = self.scores.get(user_id)
+        if old is not None:
+            del self.order[bisect_left(self.order, (-old, user_id))]
+        new = (old or 0.0) + delta
+        self.scores[user_id] = new
+        insort(self.order, (-new, user_id))
 
-@app.post("/api/lines")
-def create_line(line: LineCreate, token: str, db: Session = Depends(get_db)):
-    user_id = verify_token(token)
-    if not user_id:
-        raise HTTPException(401, "Invalid token")
-    user = db.query(User).filter(User.id == user_id).first()
-    if user.balance < line.amount:
-        raise HTTPException(400, "Insufficient balance")
-    
-    game = next((g for g in GAMES if g["id"] == line.game_id), None)
-    if not game:
-        raise HTTPException(404, "Game not found")
-    
-    new_line = Line(bookie_id=user.id, bookie_name=user.username, game_id=line.game_id,
-                   game=f"{game['away']} @ {game['home']}", sport=game["sport"],
-                   type=line.type, side=line.side, value=line.value, amount=line.amount,
-                   max_bettors=line.max_bettors, max_bet_per_user=line.max_bet_per_user,
-                   max_total_action=line.max_total_action, is_private=line.is_private, group_id=line.group_id)
-    user.balance -= line.amount
-    user.lines_created += 1
-    db.add(new_line)
-    db.commit()
-    db.refresh(new_line)
-    return {"message": "Line created", "line_id": new_line.id}
+    def rank(self, user_id):
+        """1-based rank, shared by users on the same profit"""
+        if user_id not in self.scores:
+            return None
+        return bisect_left(self.order, (-self.scores[user_id],)) + 1
 
-@app.post("/api/lines/take")
-def take_line(take: TakeLine, token: str, db: Session = Depends(get_db)):
-    user_id = verify_token(token)
+    def page(self, offset, limit):
+        """(user_id, profit, rank) for a slice of the board"""
+        return [(user_id, -neg_profit, bisect_left(self.order, (neg_profit,)) + 1)
+                for neg_profit, user_id in self.order[offset:offset + limit]]
+
+class Leaderboards:
+    """Daily, weekly and all-time boards, overall and per sport.
+
+    leaderboard_entries is the source of truth and is updated in the
+    settlement transaction, so boards survive restarts. Boards are loaded
+    into SortedBoards on first use, kept current from this process's
+    settlements after commit, and reloaded every LEADERBOARD_RELOAD seconds
+    to pick up settlements made by other workers. Boards read from a replica
+    are served but never kept, since the replica may lag the settlements
+    already applied in memory, and so is a reload that raced an apply():
+    its rows may or may not include that settlement. Past daily and weekly
+    boards are pruned.
+    """
+    WINDOWS = ("all", "day", "week")
+
+    def __init__(self, reload_after=LEADERBOARD_RELOAD):
+        self.reload_after = reload_after
+        self.boards = {}  # (board key, sport) -> SortedBoard
+        self.generation = 0  # bumped by apply so a reload racing a settlement isn't kept
+        self._lock = threading.Lock()
+
+    def record(self, db, deltas, sport=None, windows=WINDOWS):
+        """Add {user_id: (profit, wins, losses)} deltas to the current boards in db's transaction"""
+        keys = [board_keys()[window] for window in windows]
+        sports = ["ALL"] + ([sport] if sport else [])
+        rows = [{"board": board, "sport": s, "user_id": user_id, "profit": d[0], "wins": d[1], "losses": d[2]}
+                for board in keys for s in sports for user_id, d in deltas.items()]
+        upsert = (postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert)(LeaderboardEntry)
+        db.execute(upsert.on_conflict_do_update(
+            index_elements=["board", "sport", "user_id"],
+            set_={"profit": LeaderboardEntry.profit + upsert.excluded.profit,
+                  "wins": LeaderboardEntry.wins + upsert.excluded.wins,
+                  "losses": LeaderboardEntry.losses + upsert.excluded.losses}), rows)
+        # Mirror into memory once the transaction commits
+        db.info.setdefault("leaderboard", []).extend((r["board"], r["sport"], r["user_id"], r["profit"]) for r in rows)
+
+    def apply(self, changes):
+        with self._lock:
+            self.generation += 1
+            for board, sport, user_id, delta in changes:
+                sorted_board = self.boards.get((board, sport))
+                if sorted_board is not None:
+                    sorted_board.add(user_id, delta)
+
+    def board(self, db, window="all", sport=None):
+        key = (board_keys()[window], sport or "ALL")
+        with self._lock:
+            sorted_board = self.boards.get(key)
+            if sorted_board is not None and time.monotonic() - sorted_board.loaded_at < self.reload_after:
+                return sorted_board
+            generation = self.generation
+        rows = db.execute(select(LeaderboardEntry.user_id, LeaderboardEntry.profit)
+                          .where(LeaderboardEntry.board == key[0], LeaderboardEntry.sport == key[1])).all()
+        sorted_board = SortedBoard(rows)
+        if db.info.get("replica"):
+            return sorted_board
+        with self._lock:
+            if generation != self.generation:
+                return sorted_board
+            # Drop boards for windows that have rolled over
+            current = set(board_keys().values())
+            for old in [k for k in self.boards if k[0] not in current]:
+                del self.boards[old]
+            self.boards[key] = sorted_board
+        return sorted_board
+
+    def rank(self, db, user_id, window="all", sport=None):
+        sorted_board = self.board(db, window, sport)
+        with self._lock:
+            return sorted_board.rank(user_id), sorted_board.scores.get(user_id), len(sorted_board.order)
+
+    def page(self, db, window="all", sport=None, offset=0, limit=10):
+        sorted_board = self.board(db, window, sport)
+        with self._lock:
+            return sorted_board.page(offset, limit)
+
+    def prune(self, now=None):
+        """Delete daily and weekly boards older than LEADERBOARD_KEEP_DAYS / LEADERBOARD_KEEP_WEEKS, a board per transaction"""
+        now = now or datetime.utcnow()
+        # Keys sort by date within a window, so the boards to drop are a range of the board index
+        cutoffs = {"day": board_keys(now - timedelta(days=LEADERBOARD_KEEP_DAYS))["day"],
+                   "week": board_keys(now - timedelta(weeks=LEADERBOARD_KEEP_WEEKS))["week"]}
+        entries = LeaderboardEntry.__table__
+        started = time.perf_counter()
+        boards = rows = 0
+        db = SessionLocal()
+        try:
+            for window, cutoff in cutoffs.items():
+                for board in db.execute(select(entries.c.board).distinct()
+                                        .where(entries.c.board > f"{window}:", entries.c.board < cutoff)).scalars().all():
+                    rows += db.execute(entries.delete().where(entries.c.board == board)).rowcount
+                    db.commit()
+                    boards += 1
+        finally:
+            db.close()
+        return {"boards_pruned": boards, "rows_pruned": rows, "seconds": round(time.perf_counter() - started, 3)}
+
+leaderboards = Leaderboards()
+
+# Ledger
+class Ledger:
+    """Append-only ledger of balance movements.
+
+    A balance is the user's snapshot plus the sum of their entries after it;
+    a periodic job folds those tails into the snapshots and another checks
+    every snapshot against the entries it covers. Credits are plain inserts,
+    so settlement never locks a row a debit needs. Debits for one user
+    serialize on their snapshot row (on Postgres; SQLite serializes all
+    writers) and only land if the balance covers them. Balances read for
+    display are cached and dropped when a write commits.
+    """
+    def __init__(self, cache_size=BALANCE_CACHE_SIZE, ttl=BALANCE_CACHE_TTL):
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.cache = OrderedDict()  # user_id -> (expires_at, balance)
+        self.generation = 0  # bumped by invalidate so reads racing a commit don't cache the old balance
+        self.folded_to = None  # horizon of this process's last complete snapshot run
+        self._lock = threading.Lock()
+        # Built once: debits are the hot path and building these per call costs more than running them
+        snapshots, entries = BalanceSnapshot.__table__, LedgerEntry.__table__
+        self._lock_account = select(snapshots.c.user_id).where(snapshots.c.user_id == bindparam("user_id")).with_for_update()
+        balance = select(self.balance_expr()).where(snapshots.c.user_id == bindparam("user_id")).scalar_subquery()
+        self._debit = entries.insert().from_select(
+            ["user_id", "amount", "kind", "ref_id", "created_at"],
+            select(bindparam("user_id", type_=Integer), bindparam("debit", type_=Float), bindparam("kind", type_=String),
+                   bindparam("ref_id", type_=Integer), bindparam("created_at", type_=DateTime))
+            .where(balance >= bindparam("amount", type_=Float)))
+
+    def balance_expr(self):
+        """Snapshot balance plus the tail of entries after it, correlated to balance_snapshots"""
+        snapshots, entries = BalanceSnapshot.__table__, LedgerEntry.__table__
+        tail = (select(func.coalesce(func.sum(entries.c.amount), 0.0))
+                .where(entries.c.user_id == snapshots.c.user_id, entries.c.id > snapshots.c.entry_id)
+                .correlate(snapshots).scalar_subquery())
+        return snapshots.c.balance + tail
+
+    def open_account(self, db, user_id, balance=STARTING_BALANCE):
+        db.add(BalanceSnapshot(user_id=user_id, balance=0.0, entry_id=0))
+        db.add(LedgerEntry(user_id=user_id, amount=balance, kind="opening"))
+
+    def credit(self, db, entries):
+        """Append (user_id, amount, kind, ref_id) credits; the caller commits"""
+        if not entries:
+            return
+        db.execute(LedgerEntry.__table__.insert(), [{"user_id": user_id, "amount": amount, "kind": kind, "ref_id": ref_id}
+                                                    for user_id, amount, kind, ref_id in entries])
+        invalidate_after_commit(db, {e[0] for e in entries})
+
+    def debit(self, db, user_id, amount, kind, ref_id=None):
+        """Append a debit if user_id's balance covers it; False if it doesn't. The caller commits."""
+        db.execute(self._lock_account, {"user_id": user_id})
+        result = db.execute(self._debit, {"user_id": user_id, "debit": -amount, "amount": amount, "kind": kind,
+                                          "ref_id": ref_id, "created_at": datetime.utcnow()})
+        if result.rowcount != 1:
+            return False
+        invalidate_after_commit(db, [user_id])
+        return True
+
+    def debit_all(self, db, user_id, debits):
+        """Append (amount, kind, ref_id) debits if user_id's balance covers their total; False if it doesn't. The caller commits."""
+        db.execute(self._lock_account, {"user_id": user_id})
+        balance = db.execute(select(self.balance_expr()).where(BalanceSnapshot.user_id == user_id)).scalar()
+        if balance is None or balance < sum(amount for amount, _, _ in debits):
+            return False
+        now = datetime.utcnow()
+        db.execute(LedgerEntry.__table__.insert(), [{"user_id": user_id, "amount": -amount, "kind": kind, "ref_id": ref_id,
+                                                     "created_at": now} for amount, kind, ref_id in debits])
+        invalidate_after_commit(db, [user_id])
+        return True
+
+    def balances(self, db, user_ids):
+        """{user_id: balance}, from the cache where possible"""
+        user_ids = set(user_ids)
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                entry = self.cache.get(user_id)
+                if entry is not None and entry[0] > now:
+                    self.cache.move_to_end(user_id)
+                    found[user_id] = entry[1]
+            generation = self.generation
+        missing = user_ids - found.keys()
+        if missing:
+            snapshots = BalanceSnapshot.__table__
+            rows = db.execute(select(snapshots.c.user_id, self.balance_expr()).where(snapshots.c.user_id.in_(missing))).all()
+            found.update(rows)
+            if db.info.get("replica"):
+                return found  # may lag the primary, so don't let it outlive an invalidation in the cache
+            with self._lock:
+                if generation == self.generation:
+                    for user_id, balance in rows:
+                        self.cache[user_id] = (now + self.ttl, balance)
+                    while len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+        return found
+
+    def balance(self, db, user_id):
+        return self.balances(db, [user_id]).get(user_id)
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self.generation += 1
+            for user_id in user_ids:
+                self.cache.pop(user_id, None)
+
+    def _accounts(self, db, last_user_id, *filters):
+        snapshots = BalanceSnapshot.__table__
+        return db.execute(select(snapshots.c.user_id).where(snapshots.c.user_id > last_user_id, *filters)
+                          .order_by(snapshots.c.user_id).limit(LEDGER_SNAPSHOT_BATCH)).scalars().all()
+
+    def _active_accounts(self, db, last_user_id, since, horizon):
+        """Accounts with entries in (since, horizon], the only ones a run after a complete one can have to fold"""
+        entries = LedgerEntry.__table__
+        return db.execute(select(entries.c.user_id).distinct()
+                          .where(entries.c.id > since, entries.c.id <= horizon, entries.c.user_id > last_user_id)
+                          .order_by(entries.c.user_id).limit(LEDGER_SNAPSHOT_BATCH)).scalars().all()
+
+    def snapshot(self):
+        """Fold entries older than LEDGER_SNAPSHOT_LAG into the snapshots of the accounts that have them.
+
+        The first run in a process walks every account; later ones only the
+        accounts with entries since the previous run's horizon, so idle
+        accounts aren't rescanned every interval.
+        """
+        snapshots, entries = BalanceSnapshot.__table__, LedgerEntry.__table__
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            cutoff = datetime.utcnow() - timedelta(seconds=LEDGER_SNAPSHOT_LAG)
+            horizon = db.execute(select(entries.c.id).where(entries.c.created_at <= cutoff)
+                                 .order_by(entries.c.id.desc()).limit(1)).scalar()
+            since = self.folded_to
+            folded = checked = 0
+            last_user_id = 0
+            while horizon:
+                if since is None:
+                    user_ids = self._accounts(db, last_user_id, snapshots.c.entry_id < horizon)
+                else:
+                    user_ids = self._active_accounts(db, last_user_id, since, horizon)
+                if not user_ids:
+                    break
+                checked += len(user_ids)
+                last_user_id = user_ids[-1]
+                tail = (select(func.sum(entries.c.amount))
+                        .where(entries.c.user_id == snapshots.c.user_id, entries.c.id > snapshots.c.entry_id,
+                               entries.c.id <= horizon).correlate(snapshots).scalar_subquery())
+                folded += db.execute(snapshots.update().where(snapshots.c.user_id.in_(user_ids), tail.isnot(None))
+                                     .values(balance=snapshots.c.balance + tail, entry_id=horizon,
+                                             taken_at=datetime.utcnow())).rowcount
+                db.commit()
+            if horizon and (since is None or horizon > since):
+                self.folded_to = horizon
+        finally:
+            db.close()
+        return {"snapshotted": folded, "checked": checked, "seconds": round(time.perf_counter() - started, 3)}
+
+    def reconcile(self, limit=100):
+        """Check every snapshot against the sum of the entries it covers, and that no balance is negative"""
+        snapshots, entries = BalanceSnapshot.__table__, LedgerEntry.__table__
+        started = time.perf_counter()
+        covered = (select(func.coalesce(func.sum(entries.c.amount), 0.0))
+                   .where(entries.c.user_id == snapshots.c.user_id, entries.c.id <= snapshots.c.entry_id)
+                   .correlate(snapshots).scalar_subquery())
+        accounts = 0
+        mismatched, overdrawn = [], []
+        db = SessionLocal()
+        try:
+            last_user_id = 0
+            while True:
+                user_ids = self._accounts(db, last_user_id)
+                if not user_ids:
+                    break
+                last_user_id = user_ids[-1]
+                accounts += len(user_ids)
+                rows = db.execute(select(snapshots.c.user_id, snapshots.c.balance, covered, self.balance_expr())
+                                  .where(snapshots.c.user_id.in_(user_ids))).all()
+                for user_id, snapshot, total, balance in rows:
+                    if abs(snapshot - total) > 0.005 and len(mismatched) < limit:
+                        mismatched.append({"user_id": user_id, "snapshot": snapshot, "entries": total})
+                    if balance < -0.005 and len(overdrawn) < limit:
+                        overdrawn.append({"user_id": user_id, "balance": balance})
+        finally:
+            db.close()
+        elapsed = time.perf_counter() - started
+        if mismatched or overdrawn:
+            print(f"Ledger reconciliation: {len(mismatched)} snapshot mismatches, {len(overdrawn)} overdrawn accounts")
+        return {"accounts": accounts, "mismatched": mismatched, "overdrawn": overdrawn, "seconds": round(elapsed, 3)}
+
+ledger = Ledger()
+
+# Auth
+Principal = namedtuple("Principal", "id username balance profit wins losses lines_created is_admin")
+
+class AuthCache:
+    """LRU of user principals with a TTL, so authenticated requests skip the users lookup.
+
+    Writes that change a user's balance or stats invalidate their entry once
+    they commit (see invalidate_after_commit). Every invalidation bumps the
+    generation, and put() drops a principal read under an older one, so a
+    lookup that raced a commit can't cache what it read before it.
+    """
+    def __init__(self, maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # user_id -> (expires_at, principal)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, principal, generation):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self.entries[principal.id] = (time.monotonic() + self.ttl, principal)
+            self.entries.move_to_end(principal.id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self.generation += 1
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+auth_cache = AuthCache()
+
+def invalidate_after_commit(db, user_ids):
+    """Drop users' cached principals and balances once db's transaction commits"""
+    db.info.setdefault("auth_invalidate", set()).update(user_ids)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _after_commit(session):
+    changes = session.info.pop("leaderboard", None)
+    if changes:
+        leaderboards.apply(changes)
+    user_ids = session.info.pop("auth_invalidate", None)
+    if user_ids:
+        auth_cache.invalidate(user_ids)
+        ledger.invalidate(user_ids)
+    namespaces = session.info.pop("read_invalidate", None)
+    if namespaces:
+        read_cache.invalidate(namespaces)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("leaderboard", None)
+    session.info.pop("auth_invalidate", None)
+    session.info.pop("read_invalidate", None)
+
+# Jobs
+#
+# Every worker process runs the scheduler, but the periodic jobs that must
+# happen once per deployment (score polling, ledger snapshots) only run in
+# the process holding the leader lease. Work they discover goes into the
+# jobs table, which every process drains with its own pool of threads.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+class LeaderLease:
+    """Leader election over a lease row: renew() takes the lease if it is free or expired, or extends ours"""
+    def __init__(self, name="scheduler", holder=WORKER_ID, ttl=LEADER_LEASE_TTL):
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.valid_until = 0.0  # monotonic deadline, a renew interval short of the lease's expiry
+
+    def renew(self):
+        leases = SchedulerLease.__table__
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=self.ttl)
+        started = time.monotonic()
+        db = SessionLocal()
+        try:
+            result = db.execute(leases.update().where(leases.c.name == self.name,
+                                                      or_(leases.c.holder == self.holder, leases.c.expires_at < now))
+                                .values(holder=self.holder, expires_at=expires))
+            if result.rowcount == 0:
+                db.execute(leases.insert().values(name=self.name, holder=self.holder, expires_at=expires))
+            db.commit()
+            self.valid_until = started + self.ttl * 2 / 3
+        except IntegrityError:
+            self.valid_until = 0.0  # someone else holds it
+        except Exception as e:
+            print(f"Error renewing leader lease: {e}")
+            self.valid_until = 0.0
+        finally:
+            db.close()
+        return self.is_leader()
+
+    def is_leader(self):
+        return time.monotonic() < self.valid_until
+
+    def release(self):
+        if not self.is_leader():
+            return
+        self.valid_until = 0.0
+        leases = SchedulerLease.__table__
+        with engine.begin() as conn:
+            conn.execute(leases.update().where(leases.c.name == self.name, leases.c.holder == self.holder)
+                         .values(expires_at=datetime.utcnow()))
+
+leader = LeaderLease()
+
+def leader_only(fn):
+    """Wrap a periodic job so it only runs in the leader process"""
+    def run():
+        if leader.is_leader():
+            return fn()
+    run.__name__ = fn.__name__
+    return run
+
+class JobQueue:
+    """Durable queue in the jobs table.
+
+    enqueue() ignores a key it has seen before, so the leader can re-report
+    a finished game every poll. Workers claim a job with a conditional
+    UPDATE (SKIP LOCKED on Postgres), so each job runs once; a job whose
+    worker dies is handed out again after JOB_LEASE, which is safe because
+    handlers are idempotent. Failures retry with backoff up to
+    JOB_MAX_ATTEMPTS.
+    """
+    def __init__(self):
+        self.handlers = {}  # kind -> fn(**payload)
+        self.ran = 0
+        self.failed = 0
+
+    def enqueue(self, kind, key, payload=None, db=None):
+        """Queue a job unless one with key already exists; True if it was queued"""
+        insert = (postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert)(Job)
+        stmt = insert.values(kind=kind, key=key, payload=json.dumps(payload or {}), status="queued", attempts=0,
+                             run_after=datetime.utcnow(), created_at=datetime.utcnow()).on_conflict_do_nothing(
+            index_elements=["key"])
+        if db is not None:
+            return db.execute(stmt).rowcount == 1
+        with engine.begin() as conn:
+            return conn.execute(stmt).rowcount == 1
+
+    def requeue(self, key):
+        """Queue a finished or failed job again with its stored payload; True if there was one to requeue"""
+        jobs = Job.__table__
+        with engine.begin() as conn:
+            return conn.execute(jobs.update().where(jobs.c.key == key, jobs.c.status.in_(("done", "failed")))
+                                .values(status="queued", attempts=0, run_after=datetime.utcnow(), last_error=None,
+                                        finished_at=None)).rowcount == 1
+
+    def claim(self, worker_id=WORKER_ID):
+        """Claim the oldest runnable job: (id, kind, payload, attempts) or None"""
+        jobs = Job.__table__
+        now = datetime.utcnow()
+        runnable = or_(and_(jobs.c.status == "queued", jobs.c.run_after <= now),
+                       and_(jobs.c.status == "running", jobs.c.locked_until < now))
+        candidate = select(jobs.c.id).where(runnable).order_by(jobs.c.id).limit(1)
+        if engine.dialect.name == "postgresql":
+            candidate = candidate.with_for_update(skip_locked=True)
+        with engine.begin() as conn:
+            return conn.execute(jobs.update().where(jobs.c.id == candidate.scalar_subquery(), runnable)
+                                .values(status="running", locked_by=worker_id, attempts=jobs.c.attempts + 1,
+                                        locked_until=now + timedelta(seconds=JOB_LEASE))
+                                .returning(jobs.c.id, jobs.c.kind, jobs.c.payload, jobs.c.attempts)).first()
+
+    def run(self, job, worker_id=WORKER_ID):
+        job_id, kind, payload, attempts = job
+        jobs = Job.__table__
+        mine = and_(jobs.c.id == job_id, jobs.c.locked_by == worker_id)
+        started = time.perf_counter()
+        try:
+            self.handlers[kind](**json.loads(payload or "{}"))
+        except Exception as e:
+            metrics.observe("queue_job_duration_seconds", time.perf_counter() - started, kind, "failed")
+            self.failed += 1
+            print(f"Job {job_id} ({kind}) failed on attempt {attempts}: {e}")
+            retry = attempts < JOB_MAX_ATTEMPTS
+            with engine.begin() as conn:
+                conn.execute(jobs.update().where(mine).values(
+                    status="queued" if retry else "failed", last_error=str(e)[:1000], locked_by=None, locked_until=None,
+                    run_after=datetime.utcnow() + timedelta(seconds=10 * 2 ** attempts)))
+            return False
+        metrics.observe("queue_job_duration_seconds", time.perf_counter() - started, kind, "done")
+        self.ran += 1
+        with engine.begin() as conn:
+            conn.execute(jobs.update().where(mine).values(status="done", locked_by=None, locked_until=None,
+                                                          finished_at=datetime.utcnow()))
+        return True
+
+    def work(self, stop, worker_id=WORKER_ID):
+        """Worker thread: run jobs until stop is set, waiting JOB_POLL_INTERVAL whenever the queue is empty"""
+        while not stop.is_set():
+            try:
+                job = self.claim(worker_id)
+            except Exception as e:
+                print(f"Error claiming job: {e}")
+                job = None
+            if job is None:
+                stop.wait(JOB_POLL_INTERVAL)
+            else:
+                self.run(job, worker_id)
+
+    def stats(self):
+        with engine.connect() as conn:
+            counts = dict(conn.execute(select(Job.status, func.count()).group_by(Job.status)).all())
+        return {"worker": WORKER_ID, "leader": leader.is_leader(), "ran": self.ran, "failed": self.failed, "jobs": counts}
+
+job_queue = JobQueue()
+job_queue.handlers["settle_game"] = settle_game
+
+class JobRunner:
+    """JOB_WORKERS threads draining job_queue in this process"""
+    def __init__(self, queue, workers=JOB_WORKERS):
+        self.queue = queue
+        self.workers = workers
+        self.threads = []
+        self.stop_event = threading.Event()
+
+    def start(self):
+        self.stop_event.clear()
+        self.threads = [threading.Thread(target=self.queue.work, args=(self.stop_event,), daemon=True,
+                                         name=f"job-worker-{i}") for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.threads = []
+
+job_runner = JobRunner(job_queue)
+
+# Initialize scheduler
+scheduler = BackgroundScheduler()
+scheduler.add_job(timed_job(leader.renew), 'interval', seconds=max(1, LEADER_LEASE_TTL // 3), next_run_time=datetime.now())
+scheduler.add_job(leader_only(timed_job(check_game_scores)), 'interval', seconds=SCORE_POLL_TICK)  # fetches only sports that are due
+scheduler.add_job(timed_job(game_cache.refresh), 'interval', seconds=GAME_CACHE_REFRESH, next_run_time=datetime.now())  # Keep the game feed warm
+scheduler.add_job(leader_only(timed_job(ledger.snapshot)), 'interval', seconds=LEDGER_SNAPSHOT_INTERVAL)
+scheduler.add_job(leader_only(timed_job(ledger.reconcile)), 'interval', seconds=LEDGER_RECONCILE_INTERVAL)
+scheduler.add_job(leader_only(timed_job(leaderboards.prune)), 'interval', seconds=LEADERBOARD_PRUNE_INTERVAL)
+scheduler.add_job(leader_only(timed_job(event_bus.prune)), 'interval', minutes=1)
+scheduler.start()
+job_runner.start()
+event_bus.start()
+
+# Models
+class UserCreate(BaseModel):
+    username: str
+    password: str
+
+class LineCreate(BaseModel):
+    game_id: str
+    type: str
+    side: str
+    value: float
+    amount: float
+    max_bettors: Optional[int] = None
+    max_bet_per_user: Optional[float] = None
+    max_total_action: Optional[float] = None
+    is_private: Optional[bool] = False
+    group_id: Optional[int] = None
+
+class PropCreate(BaseModel):
+    sport: str
+    player_name: str
+    prop_type: str
+    line: float
+    side: str
+    amount: float
+
+class LineBatch(BaseModel):
+    lines: List[LineCreate]
+
+class PropBatch(BaseModel):
+    props: List[PropCreate]
+
+class TakeLine(BaseModel):
+    line_id: int
+    amount: Optional[float] = None  # defaults to whatever action is left on the line
+
+class TakeProp(BaseModel):
+    prop_id: int
+
+class ParlayLegCreate(BaseModel):
+    line_id: Optional[int] = None  # one of the two: the leg is the other side of that open line or prop
+    prop_id: Optional[int] = None
+
+class ParlayCreate(BaseModel):
+    legs: List[ParlayLegCreate]
+    amount: float
+
+class TakeParlay(BaseModel):
+    parlay_id: int
+
+class GroupCreate(BaseModel):
+    name: str
+    description: Optional[str] = None
+
+class GroupJoin(BaseModel):
+    invite_code: str
+
+class PlayerStats(BaseModel):
+    player_name: str
+    stats: Dict[str, float]
+    game_id: Optional[str] = None
+    admin_password: Optional[str] = None
+
+# Response models. List endpoints return APIResponse directly, so these
+# document the shapes in /docs without validating every row on the way out.
+class LineOut(BaseModel):
+    id: int
+    bookie_id: int
+    bookie_name: str
+    game_id: Optional[str]
+    game: str
+    sport: str
+    type: str
+    side: str
+    value: float
+    amount: float
+    status: str
+    current_bettors: int
+    is_private: bool
+
+class PropOut(BaseModel):
+    id: int
+    bookie_id: int
+    bookie_name: str
+    sport: str
+    player_name: str
+    prop_type: str
+    line: float
+    side: str
+    amount: float
+
+class BetOut(BaseModel):
+    id: int
+    line_id: int
+    bookie_id: int
+    bookie_name: str
+    bettor_id: int
+    bettor_name: str
+    game_id: Optional[str]
+    game: str
+    type: str
+    bookie_side: str
+    bettor_side: str
+    value: float
+    amount: float
+    status: str
+    winner: Optional[str]
+    created_at: datetime
+
+class PropBetOut(BaseModel):
+    id: int
+    prop_id: int
+    bookie_id: int
+    bookie_name: str
+    bettor_id: int
+    bettor_name: str
+    player_name: str
+    prop_type: str
+    line: float
+    bookie_side: str
+    bettor_side: str
+    amount: float
+    status: str
+    winner: Optional[str]
+    created_at: datetime
+
+class ParlayLegOut(BaseModel):
+    id: int
+    parlay_id: int
+    line_id: Optional[int]
+    prop_id: Optional[int]
+    sport: str
+    game_id: Optional[str]
+    game: Optional[str]
+    type: Optional[str]
+    value: Optional[float]
+    player_name: Optional[str]
+    prop_type: Optional[str]
+    line: Optional[float]
+    bettor_side: str
+    status: str
+
+class ParlayOut(BaseModel):
+    id: int
+    bettor_id: int
+    bettor_name: str
+    bookie_id: Optional[int]
+    bookie_name: Optional[str]
+    amount: float
+    payout: float
+    leg_count: int
+    legs_pending: int
+    status: str
+    winner: Optional[str]
+    created_at: datetime
+    legs: Optional[List[ParlayLegOut]] = None  # not included in history pages and exports
+
+class BetsOut(BaseModel):
+    single_bets: List[BetOut]
+    prop_bets: List[PropBetOut]
+    parlays: List[ParlayOut]
+
+class LedgerEntryOut(BaseModel):
+    id: int
+    amount: float
+    kind: str
+    ref_id: Optional[int]
+    created_at: datetime
+
+class GroupOut(BaseModel):
+    id: int
+    name: str
+    description: Optional[str]
+    creator_id: int
+    creator_name: str
+    member_count: int
+    is_creator: bool
+    invite_code: Optional[str] = None
+
+class MemberOut(BaseModel):
+    id: int
+    username: str
+    joined_at: datetime
+
+class LeaderboardRow(BaseModel):
+    id: int
+    username: str
+    balance: Optional[float]
+    profit: float
+    wins: int
+    losses: int
+    rank: int
+
+class UserSearchRow(BaseModel):
+    id: int
+    username: str
+    wins: int
+    losses: int
+    profit: float
+    win_rate: float
+    rating: int
+    followers: int
+
+password_pool = ThreadPoolExecutor(PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+def hash_password(pw: str, salt: Optional[bytes] = None) -> str:
+    salt = salt or os.urandom(16)
+    n, r, p = PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P
+    digest = hashlib.scrypt(pw.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=32)
+    return f"scrypt${n}${r}${p}${salt.hex()}${digest.hex()}"
+
+def verify_password(pw: str, stored: str):
+    """(matches, needs_rehash); legacy unsalted sha256 hashes always need a rehash"""
+    if stored.startswith("scrypt$"):
+        _, n, r, p, salt, digest = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        candidate = hashlib.scrypt(pw.encode(), salt=bytes.fromhex(salt), n=n, r=r, p=p,
+                                   maxmem=256 * n * r + 1024 * 1024, dklen=32).hex()
+        ok = hmac.compare_digest(candidate, digest)
+        return ok, ok and (n, r, p) != (PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+    ok = hmac.compare_digest(hashlib.sha256(pw.encode()).hexdigest(), stored)
+    return ok, ok
+
+# Compared against for unknown usernames so they take as long as a wrong password
+DUMMY_PASSWORD_HASH = hash_password("", salt=b"\0" * 16)
+
+async def run_hash(fn, *args):
+    """Run a password hash on its own pool so it neither blocks the event loop nor starves request threads"""
+    return await asyncio.get_running_loop().run_in_executor(password_pool, fn, *args)
+
+def create_token(user_id: int) -> str:
+    return jwt.encode({"user_id": user_id, "exp": datetime.utcnow() + timedelta(days=7)}, SECRET_KEY, algorithm="HS256")
+
+def verify_token(token: str) -> Optional[int]:
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"]).get("user_id")
+    except:
+        return None
+
+def user_stats(outer=True):
+    """(profit, wins, losses, users joined to them) from the all-time board, where settlement keeps them.
+
+    Every user has an all-time entry (registration and seed_missing_stats
+    create it); outer=True still answers for one that doesn't.
+    """
+    entries = LeaderboardEntry.__table__
+    joined = User.__table__.join(entries, and_(entries.c.board == "all", entries.c.sport == "ALL",
+                                               entries.c.user_id == User.id), isouter=outer)
+    if not outer:
+        return entries.c.profit, entries.c.wins, entries.c.losses, joined
+    return (func.coalesce(entries.c.profit, 0.0), func.coalesce(entries.c.wins, 0), func.coalesce(entries.c.losses, 0),
+            joined)
+
+def fetch_principal(db, user_id) -> Optional[Principal]:
+    generation = auth_cache.generation
+    profit, wins, losses, joined = user_stats()
+    lines_created = (select(func.count()).where(Line.bookie_id == User.id).scalar_subquery() +
+                     select(func.count()).where(Prop.bookie_id == User.id).scalar_subquery())
+    row = db.execute(select(User.id, User.username, profit.label("profit"), wins.label("wins"), losses.label("losses"),
+                            lines_created.label("lines_created"), User.is_admin)
+                     .select_from(joined).where(User.id == user_id)).first()
+    if row is None:
+        return None
+    principal = Principal(balance=ledger.balance(db, user_id), **row._mapping)
+    if not db.info.get("replica"):
+        auth_cache.put(principal, generation)
+    return principal
+
+def load_principal(db, user_id) -> Optional[Principal]:
+    return auth_cache.get(user_id) or fetch_principal(db, user_id)
+
+async def token_principal(token: Optional[str]) -> Optional[Principal]:
+    """The principal for a token, or None; cache hits never touch the database"""
+    user_id = verify_token(token) if token else None
     if not user_id:
+        return None
+    return auth_cache.get(user_id) or await run_db(fetch_principal, user_id)
+
+async def current_user(token: str) -> Principal:
+    """Dependency resolving ?token= to the caller's principal"""
+    principal = await token_principal(token)
+    if principal is None:
         raise HTTPException(401, "Invalid token")
-    
-    line = db.query(Line).filter(Line.id == take.line_id, Line.status == "open").first()
-    if not line:
+    return principal
+
+@app.on_event("shutdown")
+async def shutdown():
+    await run_in_threadpool(job_runner.stop)
+    await run_in_threadpool(event_bus.stop)
+    await run_in_threadpool(leader.release)
+    odds_client.close()
+    if async_engine is not None:
+        await async_engine.dispose()
+    if async_read_engine is not None:
+        await async_read_engine.dispose()
+
+# Matching engine
+#
+# Takers race on the same lines, so every check that decides who gets matched
+# lives in the WHERE clause of a single conditional UPDATE; the database
+# serializes those per row, and a taker who loses the race updates 0 rows.
+# On Postgres the line row is also locked FOR UPDATE up front so the
+# per-user limit subquery sees earlier takers' committed bets. Unrelated
+# lines never contend with each other.
+
+def debit(db, user_id, amount, kind, ref_id=None):
+    """Escrow amount from a user's balance in the ledger; False if they can't cover it"""
+    return ledger.debit(db, user_id, amount, kind, ref_id)
+
+def line_escrow(amount, max_total_action):
+    """What a bookie puts up for a line: the most action it can take"""
+    return amount if max_total_action is None else min(amount, max_total_action)
+
+def refund_unmatched(db, lines):
+    """Credit bookies the escrow their closed (line_id, bookie_id, escrowed, total_action) lines never matched; the caller commits"""
+    ledger.credit(db, [(bookie_id, escrowed - (total_action or 0), "line_refund", line_id)
+                       for line_id, bookie_id, escrowed, total_action in lines if escrowed > (total_action or 0)])
+
+def match_line(db, line_id, user, amount=None):
+    """Match user against an open line for amount (default: all remaining action, up to max_bet_per_user); the caller commits.
+
+    A match that closes the line early (max_bettors reached) refunds the
+    bookie's unmatched escrow. Returns the new bet and the line's status,
+    current_bettors and total_action after the match.
+    """
+    lines = Line.__table__
+    line = db.execute(select(lines).where(lines.c.id == line_id).with_for_update()).first()
+    if line and line.status == "closed":
+        raise HTTPException(400, "Game is over")
+    if not line or line.status != "open":
         raise HTTPException(404, "Line not available")
-    if line.bookie_id == user_id:
+    if line.bookie_id == user.id:
         raise HTTPException(400, "Can't bet your own line")
+    if line.is_private and not is_member(db, line.group_id, user.id):
+        raise HTTPException(404, "Line not available")
+    if line.commence_time is not None and line.commence_time <= datetime.utcnow():
+        raise HTTPException(400, "Game has already started")
+    cap = line.max_total_action if line.max_total_action is not None else line.amount
+    if amount is None:
+        amount = cap - (line.total_action or 0)
+        if line.max_bet_per_user is not None:
+            amount = min(amount, line.max_bet_per_user)
+    if amount <= 0:
+        raise HTTPException(400, "Amount must be positive")
+    if line.max_bet_per_user is not None and amount > line.max_bet_per_user:
+        raise HTTPException(400, f"Max bet per user is {line.max_bet_per_user}")
     
-    user = db.query(User).filter(User.id == user_id).first()
-    if user.balance < line.amount:
-        raise HTTPException(400, "Insufficient balance")
+    cap_col = func.coalesce(lines.c.max_total_action, lines.c.amount)
+    action = func.coalesce(lines.c.total_action, 0) + amount
+    user_action = (select(func.coalesce(func.sum(Bet.amount), 0))
+                   .where(Bet.line_id == line_id, Bet.bettor_id == user.id).scalar_subquery())
+    full = or_(action >= cap_col, and_(lines.c.max_bettors.isnot(None), lines.c.current_bettors + 1 >= lines.c.max_bettors))
+    result = db.execute(lines.update().where(
+        lines.c.id == line_id, lines.c.status == "open", lines.c.bookie_id != user.id,
+        action <= cap_col,
+        or_(lines.c.max_bettors.is_(None), lines.c.current_bettors < lines.c.max_bettors),
+        or_(lines.c.max_bet_per_user.is_(None), user_action + amount <= lines.c.max_bet_per_user),
+    ).values(current_bettors=lines.c.current_bettors + 1, total_action=action,
+             status=case((full, "matched"), else_="open"))
+      .returning(lines.c.status, lines.c.current_bettors, lines.c.total_action)).first()
+    if result is None:
+        db.rollback()
+        raise HTTPException(409, "Line no longer has that much action available")
+    if result.status != "open":
+        refund_unmatched(db, [(line.id, line.bookie_id, cap, result.total_action)])
+    invalidate_reads_after_commit(db, "lines")
     
     bet = Bet(line_id=line.id, bookie_id=line.bookie_id, bookie_name=line.bookie_name,
-             bettor_id=user.id, bettor_name=user.username, game=line.game, type=line.type,
+             bettor_id=user.id, bettor_name=user.username, game_id=line.game_id, game=line.game,
+             commence_time=line.commence_time, type=line.type,
              bookie_side=line.side, bettor_side="away" if line.side == "home" else "home",
-             value=line.value, amount=line.amount)
-    line.status = "matched"
-    line.current_bettors += 1
-    user.balance -= line.amount
+             value=line.value, amount=amount)
     db.add(bet)
+    db.flush()
+    if not debit(db, user.id, amount, "take", bet.id):
+        db.rollback()
+        raise HTTPException(400, "Insufficient balance")
+    return bet, line, result
+
+def match_prop(db, prop_id, user):
+    """Match user against an open prop; the caller commits"""
+    props = Prop.__table__
+    prop = db.execute(select(props).where(props.c.id == prop_id).with_for_update()).first()
+    if prop and prop.status == "closed":
+        raise HTTPException(400, "Player's stats are already in")
+    if not prop or prop.status != "open":
+        raise HTTPException(404, "Prop not available")
+    if prop.bookie_id == user.id:
+        raise HTTPException(400, "Can't bet your own prop")
+    result = db.execute(props.update().where(props.c.id == prop_id, props.c.status == "open").values(status="matched"))
+    if result.rowcount != 1:
+        db.rollback()
+        raise HTTPException(404, "Prop not available")
+    invalidate_reads_after_commit(db, "props")
+    
+    prop_bet = PropBet(prop_id=prop.id, bookie_id=prop.bookie_id, bookie_name=prop.bookie_name,
+                      bettor_id=user.id, bettor_name=user.username, player_name=prop.player_name,
+                      prop_type=prop.prop_type, line=prop.line, bookie_side=prop.side,
+                      bettor_side="under" if prop.side == "over" else "over", amount=prop.amount)
+    db.add(prop_bet)
+    db.flush()
+    if not debit(db, user.id, prop.amount, "prop_take", prop_bet.id):
+        db.rollback()
+        raise HTTPException(400, "Insufficient balance")
+    return prop_bet, prop
+
+@app.get("/")
+def home():
+    return {"message": "🎯 BookieVerse", "app": "/app"}
+
+def _create_user(db, username, password):
+    if db.execute(select(User.id).where(User.username == username)).first():
+        raise HTTPException(400, "Username taken")
+    is_admin = db.execute(select(User.id).limit(1)).first() is None
+    new_user = User(username=username, password=password, is_admin=is_admin)
+    db.add(new_user)
+    db.flush()
+    ledger.open_account(db, new_user.id)
+    leaderboards.record(db, {new_user.id: (0.0, 0, 0)}, windows=("all",))
+    invalidate_reads_after_commit(db, "leaderboard", "users")
+    try:
+        db.commit()
+    except IntegrityError:
+        raise HTTPException(400, "Username taken")
+    return {"id": new_user.id, "username": new_user.username, "balance": STARTING_BALANCE}
+
+def _credentials(db, username):
+    user = db.execute(select(User.id, User.username, User.password).where(User.username == username)).first()
+    return user and (user.id, user.username, user.password, ledger.balance(db, user.id))
+
+def _store_password(db, user_id, password):
+    db.execute(update(User).where(User.id == user_id).values(password=password))
     db.commit()
-    return {"message": "Bet placed"}
 
-@app.get("/api/props")
-def get_props(db: Session = Depends(get_db)):
-    props = db.query(Prop).filter(Prop.status == "open").all()
-    return [{"id": p.id, "bookie_id": p.bookie_id, "bookie_name": p.bookie_name, "sport": p.sport,
-             "player_name": p.player_name, "prop_type": p.prop_type, "line": p.line, "side": p.side,
-             "amount": p.amount} for p in props]
+@app.post("/api/auth/register")
+async def register(user: UserCreate):
+    if len(user.password) < 6:
+        raise HTTPException(400, "Password 6+ chars")
+    password = await run_hash(hash_password, user.password)
+    new_user = await run_db(_create_user, user.username, password)
+    return {"token": create_token(new_user["id"]), "user": new_user}
 
-@app.post("/api/props")
-def create_prop(prop: PropCreate, token: str, db: Session = Depends(get_db)):
-    user_id = verify_token(token)
-    if not user_id:
-        raise HTTPException(401, "Invalid token")
-    user = db.query(User).filter(User.id == user_id).first()
-    if user.balance < prop.amount:
-        raise HTTPException(400, "Insufficient balance")
+@app.post("/api/auth/login")
+async def login(user: UserCreate):
+    u = await run_db(_credentials, user.username)
+    user_id, username, stored, balance = u or (None, None, DUMMY_PASSWORD_HASH, None)
+    ok, rehash = await run_hash(verify_password, user.password, stored)
+    if not u or not ok:
+        raise HTTPException(401, "Invalid credentials")
+    if rehash:
+        # Upgrade legacy sha256 (or weaker scrypt) hashes now that we have the plaintext
+        await run_db(_store_password, user_id, await run_hash(hash_password, user.password))
+    return {"token": create_token(user_id), "user": {"id": user_id, "username": username, "balance": balance}}
+
+@app.get("/api/games")
+def get_games():
+    return game_cache.get()
+
+@app.get("/api/games/stats")
+def get_games_stats():
+    return game_cache.stats()
+
+@app.get("/api/db/stats")
+def get_db_stats():
+    return dict(db_stats(), read_replica=read_replica.stats(), read_cache=read_cache.stats(), events=event_bus.stats())
+
+@app.get("/api/scores/stats")
+def get_scores_stats():
+    return score_poller.stats()
+
+@app.get("/api/jobs/stats")
+def get_jobs_stats():
+    return job_queue.stats()
+
+def pool_gauges(stat):
+    def collect():
+        stats = db_stats()
+        return {(mode,): stats[mode][stat] for mode in ("sync", "async", "replica") if stats[mode]}
+    return collect
+
+def job_counts():
+    with engine.connect() as conn:
+        return {(status,): count for status, count in conn.execute(select(Job.status, func.count()).group_by(Job.status))}
+
+metrics.collected("db_pool_checked_out", "Connections currently checked out", ("engine",), pool_gauges("checked_out"))
+metrics.collected("db_pool_checkouts_total", "Connections checked out since start", ("engine",), pool_gauges("checkouts"),
+                  kind="counter")
+metrics.collected("db_pool_timeouts_total", "Checkouts that timed out waiting for a connection", ("engine",),
+                  pool_gauges("timeouts"), kind="counter")
+metrics.collected("jobs", "Jobs in the queue by status", ("status",), job_counts)
+metrics.collected("score_poller_tracked_games", "Games with pending bets the score poller watches", (),
+                  lambda: {(): len(score_poller.games)})
+metrics.collected("game_feed_age_seconds", "Age of the cached game feed", (),
+                  lambda: {(): round(time.monotonic() - game_cache.fetched_at, 1)} if game_cache.fetched_at else {})
+metrics.collected("read_cache_requests_total", "Cached public listings served, by result", ("result",),
+                  lambda: {("hit",): read_cache.hits, ("shared_hit",): read_cache.shared_hits, ("miss",): read_cache.misses},
+                  kind="counter")
+metrics.collected("read_replica_fallbacks_total", "Public reads retried on the primary because the replica failed", (),
+                  lambda: {(): read_replica.fallbacks}, kind="counter")
+metrics.collected("event_subscribers", "Open /api/stream connections", (), lambda: {(): len(event_bus.subscribers)})
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/futures")
+def get_futures():
+    return FUTURES
+
+@app.get("/api/prop-types")
+def get_prop_types():
+    return PROP_TYPES
+
+# Columns returned by the open book listings, selected directly so rows are never hydrated into ORM objects
+LINE_COLUMNS = (Line.id, Line.bookie_id, Line.bookie_name, Line.game_id, Line.game, Line.sport, Line.type, Line.side,
+                Line.value, Line.amount, Line.status, Line.current_bettors, Line.is_private)
+PROP_COLUMNS = (Prop.id, Prop.bookie_id, Prop.bookie_name, Prop.sport, Prop.player_name, Prop.prop_type, Prop.line,
+                Prop.side, Prop.amount)
+
+def page(db, query, id_column, cursor, limit):
+    """Run a keyset-paginated query newest first: (rows, the next page's cursor or None)"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor is not None:
+        query = query.where(id_column < cursor)
+    rows = db.execute(query.order_by(id_column.desc()).limit(limit + 1)).all()
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].id
+    return rows, None
+
+def page_response(result):
+    """A page() result as JSON, with the next page's cursor in X-Next-Cursor"""
+    rows, next_cursor = result
+    return APIResponse(rows, headers=None if next_cursor is None else {"X-Next-Cursor": str(next_cursor)})
+
+@app.get("/api/lines", response_model=List[LineOut])
+async def get_lines(token: Optional[str] = None, sport: Optional[str] = None, game_id: Optional[str] = None,
+                    type: Optional[str] = None, bookie_id: Optional[int] = None, group_id: Optional[int] = None,
+                    min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                    cursor: Optional[int] = None, limit: int = PAGE_SIZE):
+    # Private lines are only listed for members of their group
+    user_id = verify_token(token) if token else None
+    visible = Line.is_private.isnot(True)
+    if user_id:
+        visible = or_(visible, Line.group_id.in_(member_groups(user_id)))
+    query = select(*LINE_COLUMNS).where(Line.status == "open", visible)
+    if group_id is not None:
+        query = query.where(Line.group_id == group_id)
+    if sport:
+        query = query.where(Line.sport == sport)
+    if game_id:
+        query = query.where(Line.game_id == game_id)
+    if type:
+        query = query.where(Line.type == type)
+    if bookie_id is not None:
+        query = query.where(Line.bookie_id == bookie_id)
+    if min_amount is not None:
+        query = query.where(Line.amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(Line.amount <= max_amount)
+    if user_id is None:
+        # The anonymous listing is the same for everyone: serve it from the replica and the read cache
+        key = (sport, game_id, type, bookie_id, group_id, min_amount, max_amount, cursor, limit)
+        return await read_cache.response("lines", key, lambda: read_replica.run(page, query, Line.id, cursor, limit),
+                                         page_response)
+    return page_response(await run_db(page, query, Line.id, cursor, limit))
+
+def _create_line(db, line, user, game):
+    if line.is_private and (line.group_id is None or not is_member(db, line.group_id, user.id)):
+        raise HTTPException(403, "Private lines must be posted to a group you belong to")
     
+    new_line = Line(bookie_id=user.id, bookie_name=user.username, game_id=line.game_id,
+                   game=f"{game['away']} @ {game['home']}", sport=game["sport"],
+                   commence_time=parse_time(game.get("commence_time")),
+                   type=line.type, side=line.side, value=line.value, amount=line.amount,
+                   max_bettors=line.max_bettors, max_bet_per_user=line.max_bet_per_user,
+                   max_total_action=line.max_total_action, is_private=line.is_private, group_id=line.group_id)
+    db.add(new_line)
+    db.flush()
+    invalidate_reads_after_commit(db, "lines")
+    if not debit(db, user.id, line_escrow(line.amount, line.max_total_action), "line", new_line.id):
+        db.rollback()
+        raise HTTPException(400, "Insufficient balance")
+    db.commit()
+    db.refresh(new_line)
+    event_bus.publish("line_created", {c.key: getattr(new_line, c.key) for c in LINE_COLUMNS},
+                      sport=new_line.sport, group_id=new_line.group_id if new_line.is_private else None)
+    publish_balances(db, [user.id])
+    return {"message": "Line created", "line_id": new_line.id}
+
+def line_error(line, game=None):
+    """Why a new line's terms are invalid, or None; with its game, also whether that game has started"""
+    if line.amount <= 0:
+        return "Amount must be positive"
+    if line.max_total_action is not None and not 0 < line.max_total_action <= line.amount:
+        return "Max total action must be between 0 and the line amount"
+    if line.max_bettors is not None and line.max_bettors < 1:
+        return "Max bettors must be at least 1"
+    commence_time = parse_time(game.get("commence_time")) if game else None
+    if commence_time is not None and commence_time <= datetime.utcnow():
+        return "Game has already started"
+
+def bulk_create(db, user, table, columns, kind, rows, escrow=lambda row: row.amount):
+    """Insert rows into table and escrow their total from user in one transaction; the inserted rows' columns"""
+    created = db.execute(table.insert().returning(*columns, sort_by_parameter_order=True), rows).all()
+    if not ledger.debit_all(db, user.id, [(escrow(row), kind, row.id) for row in created]):
+        db.rollback()
+        raise HTTPException(400, "Insufficient balance")
+    invalidate_reads_after_commit(db, f"{kind}s")
+    db.commit()
+    publish_balances(db, [user.id])
+    return created
+
+def batch_results(errors, key, created):
+    """Per-item results in request order: the new id, or why the item was rejected"""
+    ids = iter(row.id for row in created)
+    return [{"index": i, "error": error} if error else {"index": i, key: next(ids)} for i, error in enumerate(errors)]
+
+@app.post("/api/lines")
+async def create_line(line: LineCreate, user: Principal = Depends(current_user)):
+    error = line_error(line)
+    if error:
+        raise HTTPException(400, error)
+    # A cold game cache fetches from the Odds API, so look the game up off the event loop
+    game = await run_in_threadpool(game_cache.find, line.game_id)
+    if not game:
+        raise HTTPException(404, "Game not found")
+    error = line_error(line, game)
+    if error:
+        raise HTTPException(400, error)
+    return await run_db(_create_line, line, user, game)
+
+def _create_lines(db, lines, user, games):
+    """Validate a batch in one pass, then insert the valid lines and escrow their total together; invalid ones are reported per item"""
+    groups = user_group_ids(db, user.id) if any(line.is_private for line in lines) else set()
+    errors, rows = [], []
+    now = datetime.utcnow()
+    for line in lines:
+        game = games.get(line.game_id)
+        error = line_error(line, game) if game else line_error(line) or "Game not found"
+        if not error and line.is_private and line.group_id not in groups:
+            error = "Private lines must be posted to a group you belong to"
+        errors.append(error)
+        if not error:
+            rows.append({"bookie_id": user.id, "bookie_name": user.username, "game_id": line.game_id,
+                         "game": f"{game['away']} @ {game['home']}", "sport": game["sport"],
+                         "commence_time": parse_time(game.get("commence_time")), "type": line.type, "side": line.side,
+                         "value": line.value, "amount": line.amount, "status": "open", "current_bettors": 0,
+                         "total_action": 0.0, "max_bettors": line.max_bettors, "max_bet_per_user": line.max_bet_per_user,
+                         "max_total_action": line.max_total_action, "is_private": bool(line.is_private),
+                         "group_id": line.group_id, "created_at": now})
+    created = bulk_create(db, user, Line.__table__, LINE_COLUMNS + (Line.group_id, Line.max_total_action), "line", rows,
+                          lambda row: line_escrow(row.amount, row.max_total_action)) if rows else []
+    for row in created:
+        event_bus.publish("line_created", {c.key: row._mapping[c.key] for c in LINE_COLUMNS},
+                          sport=row.sport, group_id=row.group_id if row.is_private else None)
+    return {"created": len(created), "escrowed": sum(line_escrow(row.amount, row.max_total_action) for row in created),
+            "results": batch_results(errors, "line_id", created)}
+
+@app.post("/api/lines/batch")
+async def create_lines(batch: LineBatch, user: Principal = Depends(current_user)):
+    if not 0 < len(batch.lines) <= MAX_BATCH:
+        raise HTTPException(400, f"Send between 1 and {MAX_BATCH} lines")
+    games = {game["id"]: game for game in await run_in_threadpool(game_cache.get)}
+    return await run_db(_create_lines, batch.lines, user, games)
+
+def _take_line(db, take, user):
+    bet, line, after = match_line(db, take.line_id, user, take.amount)
+    db.commit()
+    event_bus.publish("line_matched", {"line_id": line.id, "bet_id": bet.id, "amount": bet.amount, "status": after.status,
+                                       "current_bettors": after.current_bettors, "total_action": after.total_action},
+                      sport=line.sport, group_id=line.group_id if line.is_private else None)
+    # Closing the line may have refunded the bookie's unmatched escrow
+    publish_balances(db, [user.id] if after.status == "open" else [user.id, line.bookie_id])
+    return {"message": "Bet placed"}
+
+@app.post("/api/lines/take")
+async def take_line(take: TakeLine, user: Principal = Depends(current_user)):
+    return await run_db(_take_line, take, user)
+
+@app.get("/api/props", response_model=List[PropOut])
+async def get_props(sport: Optional[str] = None, type: Optional[str] = None, player_name: Optional[str] = None,
+                    bookie_id: Optional[int] = None, min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                    cursor: Optional[int] = None, limit: int = PAGE_SIZE):
+    query = select(*PROP_COLUMNS).where(Prop.status == "open")
+    if sport:
+        query = query.where(Prop.sport == sport)
+    if type:
+        query = query.where(Prop.prop_type == type)
+    if player_name:
+        query = query.where(Prop.player_name == player_name)
+    if bookie_id is not None:
+        query = query.where(Prop.bookie_id == bookie_id)
+    if min_amount is not None:
+        query = query.where(Prop.amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(Prop.amount <= max_amount)
+    key = (sport, type, player_name, bookie_id, min_amount, max_amount, cursor, limit)
+    return await read_cache.response("props", key, lambda: read_replica.run(page, query, Prop.id, cursor, limit),
+                                     page_response)
+
+def _create_prop(db, prop, user):
     new_prop = Prop(bookie_id=user.id, bookie_name=user.username, sport=prop.sport,
                    player_name=prop.player_name, prop_type=prop.prop_type, line=prop.line,
                    side=prop.side, amount=prop.amount)
-    user.balance -= prop.amount
-    user.lines_created += 1
     db.add(new_prop)
+    db.flush()
+    invalidate_reads_after_commit(db, "props")
+    if not debit(db, user.id, prop.amount, "prop", new_prop.id):
+        db.rollback()
+        raise HTTPException(400, "Insufficient balance")
     db.commit()
+    event_bus.publish("prop_created", {c.key: getattr(new_prop, c.key) for c in PROP_COLUMNS}, sport=new_prop.sport)
+    publish_balances(db, [user.id])
     return {"message": "Prop created"}
 
+@app.post("/api/props")
+async def create_prop(prop: PropCreate, user: Principal = Depends(current_user)):
+    if prop.amount <= 0:
+        raise HTTPException(400, "Amount must be positive")
+    return await run_db(_create_prop, prop, user)
+
+def _create_props(db, props, user):
+    errors, rows = [], []
+    now = datetime.utcnow()
+    for prop in props:
+        error = "Amount must be positive" if prop.amount <= 0 else None
+        errors.append(error)
+        if not error:
+            rows.append({"bookie_id": user.id, "bookie_name": user.username, "sport": prop.sport,
+                         "player_name": prop.player_name, "prop_type": prop.prop_type, "line": prop.line,
+                         "side": prop.side, "amount": prop.amount, "status": "open", "created_at": now})
+    created = bulk_create(db, user, Prop.__table__, PROP_COLUMNS, "prop", rows) if rows else []
+    for row in created:
+        event_bus.publish("prop_created", dict(row._mapping), sport=row.sport)
+    return {"created": len(created), "escrowed": sum(row.amount for row in created),
+            "results": batch_results(errors, "prop_id", created)}
+
+@app.post("/api/props/batch")
+async def create_props(batch: PropBatch, user: Principal = Depends(current_user)):
+    if not 0 < len(batch.props) <= MAX_BATCH:
+        raise HTTPException(400, f"Send between 1 and {MAX_BATCH} props")
+    return await run_db(_create_props, batch.props, user)
+
+def _take_prop(db, take, user):
+    prop_bet, prop = match_prop(db, take.prop_id, user)
+    db.commit()
+    event_bus.publish("prop_taken", {"prop_id": prop.id, "prop_bet_id": prop_bet.id, "amount": prop_bet.amount},
+                      sport=prop.sport)
+    publish_balances(db, [user.id])
+    return {"message": "Prop bet placed"}
+
 @app.post("/api/props/take")
-def take_prop(take: TakeProp, token: str, db: Session = Depends(get_db)):
-    user_id = verify_token(token)
-    if not user_id:
-        raise HTTPException(401, "Invalid token")
-    
-    prop = db.query(Prop).filter(Prop.id == take.prop_id, Prop.status == "open").first()
-    if not prop:
-        raise HTTPException(404, "Prop not available")
-    
-    user = db.query(User).filter(User.id == user_id).first()
-    if user.balance < prop.amount:
+async def take_prop(take: TakeProp, user: Principal = Depends(current_user)):
+    return await run_db(_take_prop, take, user)
+
+# Parlays: a bettor picks the other side of several open lines and props and
+# stakes amount on all of them winning; any bookie can take the ticket by
+# covering the rest of the pot. Legs copy their line's or prop's terms and
+# don't use up its action. Settlement is in resolve_parlay_legs.
+PARLAY_COLUMNS = (Parlay.id, Parlay.bettor_id, Parlay.bettor_name, Parlay.bookie_id, Parlay.bookie_name, Parlay.amount,
+                  Parlay.payout, Parlay.leg_count, Parlay.legs_pending, Parlay.status, Parlay.winner, Parlay.created_at)
+PARLAY_LEG_COLUMNS = (ParlayLeg.id, ParlayLeg.parlay_id, ParlayLeg.line_id, ParlayLeg.prop_id, ParlayLeg.sport,
+                      ParlayLeg.game_id, ParlayLeg.game, ParlayLeg.type, ParlayLeg.value, ParlayLeg.player_name,
+                      ParlayLeg.prop_type, ParlayLeg.line, ParlayLeg.bettor_side, ParlayLeg.status)
+OPPOSITE_SIDES = {"home": "away", "away": "home", "over": "under", "under": "over"}
+
+def with_legs(db, rows):
+    """Parlay rows as dicts with their legs attached, fetched in one query"""
+    parlays = [dict(row._mapping) for row in rows]
+    legs = {}
+    if parlays:
+        for leg in db.execute(select(*PARLAY_LEG_COLUMNS).where(ParlayLeg.parlay_id.in_([p["id"] for p in parlays]))
+                              .order_by(ParlayLeg.id)):
+            legs.setdefault(leg.parlay_id, []).append(leg)
+    for parlay in parlays:
+        parlay["legs"] = legs.get(parlay["id"], [])
+    return parlays
+
+def page_parlays(db, query, cursor, limit):
+    rows, next_cursor = page(db, query, Parlay.id, cursor, limit)
+    return with_legs(db, rows), next_cursor
+
+def parlay_error(parlay):
+    """Why a new parlay's terms are invalid, or None"""
+    if parlay.amount <= 0:
+        return "Amount must be positive"
+    if not 2 <= len(parlay.legs) <= MAX_PARLAY_LEGS:
+        return f"A parlay has between 2 and {MAX_PARLAY_LEGS} legs"
+    if any((leg.line_id is None) == (leg.prop_id is None) for leg in parlay.legs):
+        return "Each leg needs exactly one of line_id and prop_id"
+    if len({(leg.line_id, leg.prop_id) for leg in parlay.legs}) < len(parlay.legs):
+        return "A line or prop can only be one leg of a parlay"
+
+@app.get("/api/parlays", response_model=List[ParlayOut])
+async def get_parlays(bettor_id: Optional[int] = None, cursor: Optional[int] = None, limit: int = PAGE_SIZE):
+    query = select(*PARLAY_COLUMNS).where(Parlay.status == "open")
+    if bettor_id is not None:
+        query = query.where(Parlay.bettor_id == bettor_id)
+    key = (bettor_id, cursor, limit)
+    return await read_cache.response("parlays", key, lambda: read_replica.run(page_parlays, query, cursor, limit),
+                                     page_response)
+
+def _create_parlay(db, parlay, user):
+    line_ids = [leg.line_id for leg in parlay.legs if leg.line_id is not None]
+    prop_ids = [leg.prop_id for leg in parlay.legs if leg.prop_id is not None]
+    lines = {row.id: row for row in db.execute(select(Line.__table__).where(Line.id.in_(line_ids)))} if line_ids else {}
+    props = {row.id: row for row in db.execute(select(Prop.__table__).where(Prop.id.in_(prop_ids)))} if prop_ids else {}
+    legs = []
+    for leg in parlay.legs:
+        if leg.line_id is not None:
+            line = lines.get(leg.line_id)
+            # Parlays are listed publicly, so private lines can't be legs
+            if not line or line.status != "open" or line.is_private:
+                raise HTTPException(404, f"Line {leg.line_id} not available")
+            if line.bookie_id == user.id:
+                raise HTTPException(400, "Can't parlay your own line")
+            if line.commence_time is not None and line.commence_time <= datetime.utcnow():
+                raise HTTPException(400, f"Line {leg.line_id}'s game has already started")
+            legs.append({"line_id": line.id, "sport": line.sport, "game_id": line.game_id, "game": line.game,
+                         "commence_time": line.commence_time, "type": line.type, "value": line.value,
+                         "bookie_side": line.side, "bettor_side": OPPOSITE_SIDES.get(line.side, line.side)})
+        else:
+            prop = props.get(leg.prop_id)
+            if not prop or prop.status != "open":
+                raise HTTPException(404, f"Prop {leg.prop_id} not available")
+            if prop.bookie_id == user.id:
+                raise HTTPException(400, "Can't parlay your own prop")
+            legs.append({"prop_id": prop.id, "sport": prop.sport, "player_name": prop.player_name,
+                         "prop_type": prop.prop_type, "line": prop.line, "bookie_side": prop.side,
+                         "bettor_side": OPPOSITE_SIDES.get(prop.side, prop.side)})
+
+    new_parlay = Parlay(bettor_id=user.id, bettor_name=user.username, amount=parlay.amount,
+                        payout=parlay.amount * 2 ** len(legs), leg_count=len(legs), legs_pending=len(legs))
+    db.add(new_parlay)
+    db.flush()
+    db.add_all([ParlayLeg(parlay_id=new_parlay.id, status="pending", **leg) for leg in legs])
+    invalidate_reads_after_commit(db, "parlays")
+    if not debit(db, user.id, parlay.amount, "parlay", new_parlay.id):
+        db.rollback()
         raise HTTPException(400, "Insufficient balance")
-    
-    prop_bet = PropBet(prop_id=prop.id, bookie_id=prop.bookie_id, bookie_name=prop.bookie_name,
-                      bettor_id=user.id, bettor_name=user.username, player_name=prop.player_name,
-                      prop_type=prop.prop_type, line=prop.line, bookie_side=prop.side,
-                      bettor_side="under" if prop.side == "over" else "over", amount=prop.amount)
-    prop.status = "matched"
-    user.balance -= prop.amount
-    db.add(prop_bet)
     db.commit()
-    return {"message": "Prop bet placed"}
+    sports = {leg["sport"] for leg in legs}
+    event_bus.publish("parlay_created", {"id": new_parlay.id, "bettor_id": user.id, "bettor_name": user.username,
+                                         "amount": new_parlay.amount, "payout": new_parlay.payout, "leg_count": len(legs)},
+                      sport=sports.pop() if len(sports) == 1 else None)
+    publish_balances(db, [user.id])
+    return {"message": "Parlay created", "parlay_id": new_parlay.id, "payout": new_parlay.payout}
 
-@app.get("/api/bets")
-def get_bets(token: str, db: Session = Depends(get_db)):
-    user_id = verify_token(token)
-    if not user_id:
-        raise HTTPException(401, "Invalid token")
-    
-    bets = db.query(Bet).filter((Bet.bookie_id == user_id) | (Bet.bettor_id == user_id)).all()
-    prop_bets = db.query(PropBet).filter((PropBet.bookie_id == user_id) | (PropBet.bettor_id == user_id)).all()
-    
-    return {
-        "single_bets": [{"id": b.id, "bookie_id": b.bookie_id, "bookie_name": b.bookie_name,
-                        "bettor_id": b.bettor_id, "bettor_name": b.bettor_name, "game": b.game,
-                        "type": b.type, "bookie_side": b.bookie_side, "bettor_side": b.bettor_side,
-                        "value": b.value, "amount": b.amount, "status": b.status, "winner": b.winner} for b in bets],
-        "prop_bets": [{"id": p.id, "bookie_id": p.bookie_id, "bookie_name": p.bookie_name,
-                      "bettor_id": p.bettor_id, "bettor_name": p.bettor_name, "player_name": p.player_name,
-                      "prop_type": p.prop_type, "line": p.line, "bookie_side": p.bookie_side,
-                      "bettor_side": p.bettor_side, "amount": p.amount, "status": p.status, "winner": p.winner} for p in prop_bets],
-        "parlays": []
-    }
-
-@app.get("/api/groups")
-def get_groups(token: str, db: Session = Depends(get_db)):
-    user_id = verify_token(token)
-    if not user_id:
-        raise HTTPException(401, "Invalid token")
-    
-    groups = db.query(Group).all()
-    result = []
-    for g in groups:
-        members = json.loads(g.members)
-        if user_id in members:
-            result.append({"id": g.id, "name": g.name, "description": g.description,
-                          "creator_id": g.creator_id, "creator_name": g.creator_name,
-                          "member_count": len(members), "is_creator": g.creator_id == user_id})
-    return result
+@app.post("/api/parlays")
+async def create_parlay(parlay: ParlayCreate, user: Principal = Depends(current_user)):
+    error = parlay_error(parlay)
+    if error:
+        raise HTTPException(400, error)
+    return await run_db(_create_parlay, parlay, user)
 
-@app.post("/api/groups")
-def create_group(group: GroupCreate, token: str, db: Session = Depends(get_db)):
-    user_id = verify_token(token)
-    if not user_id:
-        raise HTTPException(401, "Invalid token")
-    user = db.query(User).filter(User.id == user_id).first()
-    
+def _take_parlay(db, take, user):
+    parlays = Parlay.__table__
+    parlay = db.execute(select(parlays).where(parlays.c.id == take.parlay_id).with_for_update()).first()
+    if not parlay or parlay.status != "open":
+        raise HTTPException(404, "Parlay not available")
+    if parlay.bettor_id == user.id:
+        raise HTTPException(400, "Can't take your own parlay")
+    # Like a line, a parlay can't be covered once one of its games is under way; settlement voids it once a leg is decided
+    started = exists().where(ParlayLeg.parlay_id == parlay.id, ParlayLeg.commence_time <= datetime.utcnow())
+    if db.execute(select(started)).scalar():
+        raise HTTPException(400, "Game has already started")
+    result = db.execute(parlays.update().where(parlays.c.id == parlay.id, parlays.c.status == "open", ~started)
+                        .values(status="pending", bookie_id=user.id, bookie_name=user.username))
+    if result.rowcount != 1:
+        db.rollback()
+        raise HTTPException(404, "Parlay not available")
+    invalidate_reads_after_commit(db, "parlays")
+    cover = parlay.payout - parlay.amount
+    if not debit(db, user.id, cover, "parlay_take", parlay.id):
+        db.rollback()
+        raise HTTPException(400, "Insufficient balance")
+    db.commit()
+    event_bus.publish("parlay_taken", {"parlay_id": parlay.id, "bookie_id": user.id, "cover": cover},
+                      users=[parlay.bettor_id])
+    publish_balances(db, [user.id])
+    return {"message": "Parlay taken", "cover": cover}
+
+@app.post("/api/parlays/take")
+async def take_parlay(take: TakeParlay, user: Principal = Depends(current_user)):
+    return await run_db(_take_parlay, take, user)
+
+BET_COLUMNS = (Bet.id, Bet.line_id, Bet.bookie_id, Bet.bookie_name, Bet.bettor_id, Bet.bettor_name, Bet.game_id, Bet.game,
+               Bet.type, Bet.bookie_side, Bet.bettor_side, Bet.value, Bet.amount, Bet.status, Bet.winner, Bet.created_at)
+PROP_BET_COLUMNS = (PropBet.id, PropBet.prop_id, PropBet.bookie_id, PropBet.bookie_name, PropBet.bettor_id,
+                    PropBet.bettor_name, PropBet.player_name, PropBet.prop_type, PropBet.line, PropBet.bookie_side,
+                    PropBet.bettor_side, PropBet.amount, PropBet.status, PropBet.winner, PropBet.created_at)
+BET_KINDS = {"single": (Bet, BET_COLUMNS, Bet.type), "prop": (PropBet, PROP_BET_COLUMNS, PropBet.prop_type),
+             "parlay": (Parlay, PARLAY_COLUMNS, None)}
+BET_ROLES = ("bookie", "bettor")
+
+def bet_history(kind, user_id, role=None, status=None, type=None, since=None, until=None):
+    """A user's bets of one kind as (query, id column) for page().
+
+    Bookie and bettor sides are separate selects on their (user, id)
+    indexes; ordering the UNION ALL by id lets the database merge the two
+    index scans and push the page cursor into each, instead of sorting the
+    user's whole history.
+    """
+    if kind not in BET_KINDS:
+        raise HTTPException(400, f"kind must be one of {', '.join(BET_KINDS)}")
+    if role is not None and role not in BET_ROLES:
+        raise HTTPException(400, f"role must be one of {', '.join(BET_ROLES)}")
+    model, columns, type_column = BET_KINDS[kind]
+    filters = []
+    if status:
+        filters.append(model.status == status)
+    if type:
+        if type_column is None:
+            raise HTTPException(400, f"{kind} bets have no type to filter by")
+        filters.append(type_column == type)
+    if since:
+        filters.append(model.created_at >= since)
+    if until:
+        filters.append(model.created_at < until)
+    sides = {"bookie": [model.bookie_id], "bettor": [model.bettor_id]}.get(role, [model.bookie_id, model.bettor_id])
+    history = union_all(*(select(*columns).where(side == user_id, *filters) for side in sides)).subquery()
+    return select(*history.c), history.c.id
+
+def _bets(db, user, limit):
+    return {"single_bets": page(db, *bet_history("single", user.id), None, limit)[0],
+            "prop_bets": page(db, *bet_history("prop", user.id), None, limit)[0],
+            "parlays": with_legs(db, page(db, *bet_history("parlay", user.id), None, limit)[0])}
+
+@app.get("/api/bets", response_model=BetsOut)
+async def get_bets(user: Principal = Depends(current_user), limit: int = PAGE_SIZE):
+    # The newest bets of each kind; /api/bets/history pages through the rest
+    return APIResponse(await run_db(_bets, user, limit))
+
+@app.get("/api/bets/history", response_model=List[Union[BetOut, PropBetOut, ParlayOut]])
+async def get_bet_history(user: Principal = Depends(current_user), kind: str = "single",
+                          role: Optional[str] = None, status: Optional[str] = None, type: Optional[str] = None,
+                          since: Optional[datetime] = None, until: Optional[datetime] = None,
+                          cursor: Optional[int] = None, limit: int = PAGE_SIZE):
+    query, id_column = bet_history(kind, user.id, role, status, type, since, until)
+    return page_response(await run_db(page, query, id_column, cursor, limit))
+
+async def export_rows(query, id_column):
+    """Every row of a page()-able query in batches of EXPORT_BATCH, so no connection or read transaction is held between batches"""
+    cursor = None
+    while True:
+        rows, cursor = await run_db(page, query, id_column, cursor, EXPORT_BATCH)
+        yield rows
+        if cursor is None:
+            return
+
+async def ndjson_lines(batches):
+    async for rows in batches:
+        yield b"".join(orjson.dumps(row, default=encode_default) + b"\n" for row in rows)
+
+async def csv_lines(batches, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    async for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+@app.get("/api/bets/export")
+async def export_bets(user: Principal = Depends(current_user), format: str = "ndjson", kind: str = "single",
+                      role: Optional[str] = None, status: Optional[str] = None, type: Optional[str] = None,
+                      since: Optional[datetime] = None, until: Optional[datetime] = None):
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(400, "format must be ndjson or csv")
+    query, id_column = bet_history(kind, user.id, role, status, type, since, until)
+    rows = export_rows(query, id_column)
+    filename = f"bets-{kind}-{user.id}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if format == "csv":
+        header = [c.key for c in BET_KINDS[kind][1]]
+        return StreamingResponse(csv_lines(rows, header), media_type="text/csv", headers=headers)
+    return StreamingResponse(ndjson_lines(rows), media_type="application/x-ndjson", headers=headers)
+
+@app.get("/api/ledger", response_model=List[LedgerEntryOut])
+async def get_ledger(user: Principal = Depends(current_user), cursor: Optional[int] = None,
+                     limit: int = PAGE_SIZE):
+    """The caller's ledger entries, newest first"""
+    query = select(LedgerEntry.id, LedgerEntry.amount, LedgerEntry.kind, LedgerEntry.ref_id,
+                   LedgerEntry.created_at).where(LedgerEntry.user_id == user.id)
+    return page_response(await run_db(page, query, LedgerEntry.id, cursor, limit))
+
+def member_groups(user_id):
+    """Subquery of the ids of the groups a user belongs to"""
+    return select(GroupMember.group_id).where(GroupMember.user_id == user_id)
+
+def user_group_ids(db, user_id):
+    """Ids of the groups a user belongs to"""
+    return set(db.execute(member_groups(user_id)).scalars())
+
+def is_member(db, group_id, user_id):
+    return db.execute(select(GroupMember.id).where(GroupMember.group_id == group_id, GroupMember.user_id == user_id)).first() is not None
+
+@app.get("/api/groups", response_model=List[GroupOut])
+async def get_groups(user: Principal = Depends(current_user)):
+    member_count = select(func.count()).where(GroupMember.group_id == Group.id).correlate(Group).scalar_subquery()
+    rows = await run_db(fetch, select(Group.id, Group.name, Group.description, Group.creator_id, Group.creator_name,
+                                      member_count.label("member_count"), Group.invite_code)
+                        .join(GroupMember, GroupMember.group_id == Group.id)
+                        .where(GroupMember.user_id == user.id).order_by(Group.id))
+    return APIResponse([dict(r, is_creator=r["creator_id"] == user.id,
+                             invite_code=r["invite_code"] if r["creator_id"] == user.id else None) for r in rows])
+
+def _create_group(db, group, user):
     new_group = Group(name=group.name, description=group.description,
-                     creator_id=user.id, creator_name=user.username, members=json.dumps([user.id]))
+                     creator_id=user.id, creator_name=user.username, invite_code=new_invite_code())
     db.add(new_group)
+    db.flush()
+    db.add(GroupMember(group_id=new_group.id, user_id=user.id))
     db.commit()
-    return {"message": "Group created", "group_id": new_group.id}
+    return {"message": "Group created", "group_id": new_group.id, "invite_code": new_group.invite_code}
 
-@app.get("/api/leaderboard")
-def leaderboard(db: Session = Depends(get_db)):
-    users = db.query(User).order_by(User.profit.desc()).limit(10).all()
-    return [{"id": u.id, "username": u.username, "balance": u.balance, "profit": u.profit,
-             "wins": u.wins, "losses": u.losses} for u in users]
+@app.post("/api/groups")
+async def create_group(group: GroupCreate, user: Principal = Depends(current_user)):
+    return await run_db(_create_group, group, user)
 
-@app.get("/api/user")
-def get_user(token: str, db: Session = Depends(get_db)):
+def _join_group(db, group_id, body, user):
+    group = db.get(Group, group_id)
+    if not group:
+        raise HTTPException(404, "Group not found")
+    if not group.invite_code or not hmac.compare_digest(body.invite_code.encode(), group.invite_code.encode()):
+        raise HTTPException(403, "Invalid invite code")
+    try:
+        db.add(GroupMember(group_id=group_id, user_id=user.id))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(400, "Already a member")
+    return {"message": "Joined group"}
+
+@app.post("/api/groups/{group_id}/join")
+async def join_group(group_id: int, body: GroupJoin, user: Principal = Depends(current_user)):
+    return await run_db(_join_group, group_id, body, user)
+
+def _rotate_invite(db, group_id, user):
+    group = db.get(Group, group_id)
+    if not group:
+        raise HTTPException(404, "Group not found")
+    if group.creator_id != user.id:
+        raise HTTPException(403, "Only the group's creator can change its invite code")
+    group.invite_code = new_invite_code()
+    db.commit()
+    return {"message": "Invite code changed", "invite_code": group.invite_code}
+
+@app.post("/api/groups/{group_id}/invite")
+async def rotate_invite(group_id: int, user: Principal = Depends(current_user)):
+    return await run_db(_rotate_invite, group_id, user)
+
+def _leave_group(db, group_id, user):
+    group = db.get(Group, group_id)
+    if group and group.creator_id == user.id:
+        raise HTTPException(400, "The creator can't leave their group")
+    result = db.execute(GroupMember.__table__.delete().where(GroupMember.group_id == group_id,
+                                                             GroupMember.user_id == user.id))
+    if result.rowcount == 0:
+        raise HTTPException(404, "Not a member")
+    db.commit()
+    return {"message": "Left group"}
+
+@app.post("/api/groups/{group_id}/leave")
+async def leave_group(group_id: int, user: Principal = Depends(current_user)):
+    return await run_db(_leave_group, group_id, user)
+
+def _group_members(db, group_id, user):
+    if not is_member(db, group_id, user.id):
+        raise HTTPException(403, "Not a member of that group")
+    rows = db.execute(select(User.id, User.username, GroupMember.joined_at)
+                      .join(GroupMember, GroupMember.user_id == User.id)
+                      .where(GroupMember.group_id == group_id).order_by(GroupMember.id)).all()
+    return rows
+
+@app.get("/api/groups/{group_id}/members", response_model=List[MemberOut])
+async def get_group_members(group_id: int, user: Principal = Depends(current_user)):
+    return APIResponse(await run_db(_group_members, group_id, user))
+
+async def _stream_scope(token, groups):
+    """Resolve who a stream is for and which of the requested groups they may watch"""
+    if not token:
+        if groups:
+            raise HTTPException(401, "Invalid token")
+        return None, set()
     user_id = verify_token(token)
     if not user_id:
         raise HTTPException(401, "Invalid token")
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(404, "User not found")
-    return {"id": user.id, "username": user.username, "balance": user.balance, "profit": user.profit,
-            "wins": user.wins, "losses": user.losses, "lines_created": user.lines_created, "is_admin": user.is_admin}
-
-@app.get("/api/users/search")
-def search_users(db: Session = Depends(get_db)):
-    users = db.query(User).limit(50).all()
+    if not groups:
+        return user_id, set()
+    if not groups <= await run_db(user_group_ids, user_id):
+        raise HTTPException(403, "Not a member of that group")
+    return user_id, groups
+
+def sse(event):
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {event['data']}\n\n"
+
+@app.get("/api/stream")
+async def stream(request: Request, token: Optional[str] = None, sports: Optional[str] = None,
+                 groups: Optional[str] = None, since: Optional[int] = None):
+    """Server-Sent Events feed of order book changes.
+
+    sports (comma separated) limits the public book to those sports, groups
+    (comma separated, members only) switches to those private groups' lines,
+    and a token adds the caller's own bet_settled/balance_changed events.
+    Resume with Last-Event-ID or ?since=<seq>; a resync event means the
+    history no longer reaches back that far and the client should refetch.
+    """
+    sport_filter = {x for x in (sports or "").split(",") if x}
+    group_filter = {int(x) for x in (groups or "").split(",") if x}
+    user_id, group_filter = await _stream_scope(token, group_filter)
+    last_id = request.headers.get("last-event-id")
+    since = int(last_id) if last_id and last_id.isdigit() else since
+
+    def visible(message):
+        if message["users"] is not None:
+            return user_id in message["users"]
+        if sport_filter and message["sport"] not in sport_filter:
+            return False
+        if group_filter:
+            return message["group_id"] in group_filter
+        return message["group_id"] is None
+
+    async def events():
+        queue = event_bus.subscribe()
+        try:
+            last_seq = since or 0
+            if since is not None:
+                backlog, complete = await run_db(event_bus.since, since)
+                if not complete:
+                    yield "event: resync\ndata: {}\n\n"
+                for message in backlog:
+                    last_seq = message["seq"]
+                    if visible(message):
+                        yield sse(message)
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is EventBus.LAGGED:
+                    yield "event: resync\ndata: {}\n\n"
+                    break
+                if message["seq"] > last_seq and visible(message):
+                    yield sse(message)
+        finally:
+            event_bus.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _check_board(window, sport):
+    if window not in Leaderboards.WINDOWS:
+        raise HTTPException(400, f"window must be one of {', '.join(Leaderboards.WINDOWS)}")
+    return sport if sport and sport != "ALL" else None
+
+def _leaderboard(db, window, sport, offset, limit):
+    entries = leaderboards.page(db, window, sport, offset, limit)
+    users = {u.id: u for u in db.execute(select(User.id, User.username)
+                                         .where(User.id.in_([user_id for user_id, _, _ in entries])))}
+    balances = ledger.balances(db, users)
+    stats = {e.user_id: e for e in db.execute(select(LeaderboardEntry.user_id, LeaderboardEntry.wins, LeaderboardEntry.losses)
+                                              .where(LeaderboardEntry.board == board_keys()[window],
+                                                     LeaderboardEntry.sport == (sport or "ALL"),
+                                                     LeaderboardEntry.user_id.in_(list(users))))}
+    return [{"id": user_id, "username": users[user_id].username, "balance": balances.get(user_id), "profit": profit,
+             "wins": stats[user_id].wins, "losses": stats[user_id].losses, "rank": rank}
+            for user_id, profit, rank in entries if user_id in users and user_id in stats]
+
+@app.get("/api/leaderboard", response_model=List[LeaderboardRow])
+async def leaderboard(window: str = "all", sport: Optional[str] = None, offset: int = 0, limit: int = 10):
+    sport = _check_board(window, sport)
+    offset, limit = max(offset, 0), max(1, min(limit, MAX_PAGE_SIZE))
+    return await read_cache.response("leaderboard", (window, sport, offset, limit),
+                                     lambda: read_replica.run(_leaderboard, window, sport, offset, limit))
+
+@app.get("/api/leaderboard/rank")
+async def leaderboard_rank(token: Optional[str] = None, user_id: Optional[int] = None, window: str = "all",
+                           sport: Optional[str] = None):
+    sport = _check_board(window, sport)
+    if user_id is None:
+        user_id = verify_token(token) if token else None
+        if not user_id:
+            raise HTTPException(401, "Invalid token")
+    rank, profit, total = await run_db(leaderboards.rank, user_id, window, sport)
+    return {"user_id": user_id, "window": window, "sport": sport or "ALL", "rank": rank, "profit": profit, "total": total}
+
+@app.get("/api/user")
+async def get_user(user: Principal = Depends(current_user)):
+    return user._asdict()
+
+def _search_users(db, query):
     return [{"id": u.id, "username": u.username, "wins": u.wins, "losses": u.losses, "profit": u.profit,
-             "win_rate": round((u.wins / (u.wins + u.losses) * 100) if (u.wins + u.losses) > 0 else 0, 1),
-             "rating": 0, "followers": 0} for u in users]
+             "win_rate": round(u.win_rate, 1), "rating": 0, "followers": 0} for u in db.execute(query)]
+
+@app.get("/api/users/search", response_model=List[UserSearchRow])
+async def search_users(q: Optional[str] = None, sort: Optional[str] = None, limit: int = 50):
+    profit, wins, losses, joined = user_stats(outer=False)
+    played = wins + losses
+    win_rate = case((played > 0, wins * 100.0 / played), else_=0.0)
+    query = select(User.id, User.username, wins.label("wins"), losses.label("losses"), profit.label("profit"),
+                   win_rate.label("win_rate")).select_from(joined)
+    if q:
+        query = query.where(User.username.startswith(q, autoescape=True))
+    order = {"profit": profit.desc(), "win_rate": win_rate.desc()}.get(sort, User.id)
+    limit = max(1, min(limit, 50))
+    return await read_cache.response("users", (q, sort, limit),
+                                     lambda: read_replica.run(_search_users, query.order_by(order).limit(limit)))
+
+@app.post("/api/admin/player-stats")
+async def post_player_stats(body: PlayerStats, token: Optional[str] = None):
+    user = await token_principal(token)
+    if not (user and user.is_admin) and not (ADMIN_PASSWORD and body.admin_password and
+                                             hmac.compare_digest(body.admin_password.encode(), ADMIN_PASSWORD.encode())):
+        raise HTTPException(403, "Admin access required")
+    result = await run_in_threadpool(settle_player_props, body.player_name, body.stats)
+    return {"message": f"Stats recorded for {body.player_name}", "props_settled": result["settled"]}
+
+@app.get("/api/admin/ledger/reconcile")
+async def reconcile_ledger(token: Optional[str] = None):
+    user = await token_principal(token)
+    if not (user and user.is_admin):
+        raise HTTPException(403, "Admin access required")
+    return await run_in_threadpool(ledger.reconcile)
+
+# Frontend
+class StaticPage:
+    """A static file held in memory with gzip (and brotli) encodings and a strong ETag per encoding.
+
+    The file is stat'ed at most once a second and only re-read and
+    re-compressed when its mtime or size changes.
+    """
+    def __init__(self, path, media_type="text/html; charset=utf-8"):
+        self.path = path
+        self.media_type = media_type
+        self.stamp = None
+        self.checked_at = 0.0
+        self.variants = {}  # content coding -> (body, etag)
+        self.etags = set()
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.variants and now - self.checked_at < 1:
+            return
+        self.checked_at = now
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self.stamp:
+            return
+        with open(self.path, "rb") as f:
+            body = f.read()
+        tag = hashlib.sha256(body).hexdigest()[:32]
+        variants = {"identity": (body, f'"{tag}"'), "gzip": (gzip.compress(body, 9, mtime=0), f'"{tag}-gzip"')}
+        if brotli is not None:
+            variants["br"] = (brotli.compress(body, quality=11), f'"{tag}-br"')
+        self.variants, self.etags, self.stamp = variants, {etag for _, etag in variants.values()}, stamp
+
+    def response(self, request):
+        try:
+            self.refresh()
+        except FileNotFoundError:
+            raise HTTPException(404, "Not found")
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next((e for e in ("br", "gzip") if e in accepted and e in self.variants), "identity")
+        body, etag = self.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or
+                              any(t.strip().removeprefix("W/") in self.etags for t in if_none_match.split(","))):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type=self.media_type, headers=headers)
+
+def accepted_encodings(header):
+    """Content codings an Accept-Encoding header allows (q > 0)"""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            if params and float(q) <= 0:
+                continue
+        except ValueError:
+            pass
+        accepted.add(coding.strip().lower())
+    return accepted
+
+class APIGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that honours gzip;q=0 and leaves event streams alone (gzip holds small writes back, so events would stall)"""
+    STREAMS = {"/api/stream"}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and (scope["path"] in self.STREAMS or "gzip" not in accepted_encodings(
+                Headers(scope=scope).get("accept-encoding", ""))):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(APIGZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
+app.add_middleware(MetricsMiddleware)  # outermost, so request timings include compression
+
+FRONTEND_DIR = os.path.dirname(os.path.abspath(__file__))
+app_page = StaticPage(os.path.join(FRONTEND_DIR, "index.html"))
+mega_page = StaticPage(os.path.join(FRONTEND_DIR, "MEGA_UPGRADE_index.html"))
 
 @app.get("/app", response_class=HTMLResponse)
-def serve_app():
-    with open("index.html", "r") as f:
-        return f.read()
+def serve_app(request: Request):
+    return app_page.response(request)
+
+@app.get("/app/mega", response_class=HTMLResponse)
+def serve_mega_app(request: Request):
+    return mega_page.response(request)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8000)))